@@ -0,0 +1,12 @@
+#! /usr/bin/env python3
+
+"""
+    Performance benchmarks of mbrole.
+
+    - synthetic: generates mbrole SQLite DBs and query sets with realistic shapes.
+    - run: times each stage of an analysis for the enrichment engines and compares with JSON baselines.
+
+    Usage:
+        python -m benchmarks.run --compounds 100000 --categories 10000 --save baseline.json
+        python -m benchmarks.run --compounds 100000 --categories 10000 --baseline baseline.json
+"""
@@ -0,0 +1,187 @@
+#! /usr/bin/env python3
+
+"""
+    Times each stage of an enrichment analysis on a synthetic DB, for each engine:
+        - annotation: loading the categories from the DB.
+        - background: building the background set.
+        - enrichment: p-values of every category for every query.
+        - fdr: Benjamini-Hochberg correction.
+        - output: filtering and writing the CSV.
+
+    Creating the DB (db_load) is timed once. Each stage reports its wall time and the peak RSS of
+    the process after it. Results are printed and can be saved as a JSON baseline, or compared
+    against one: the run fails if a stage is slower than the baseline by more than the tolerance.
+"""
+
+import argparse
+import contextlib
+import json
+import logging
+import os
+import os.path
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import mbrole.annotation
+import mbrole.cli
+import mbrole.functional_enrichment
+import mbrole.output
+from mbrole.metrics import peak_rss_mb
+from benchmarks import synthetic
+
+ENGINES = ("batch", "sql", "loop")
+# Stages faster than this are not compared, their timings are mostly noise
+MIN_COMPARED_SECONDS = 0.1
+
+class Stages:
+    """
+        Records the wall time and peak RSS of named stages
+    """
+
+    def __init__(self):
+        self.results: dict = {}
+
+    @contextlib.contextmanager
+    def stage(self, name: str, **counts):
+        start: float = time.perf_counter()
+        yield
+        self.results[name] = {"seconds": time.perf_counter() - start, "peak_rss_mb": peak_rss_mb()} | counts
+
+def _enrich(engine: str, store: mbrole.annotation.AnnotationStore, queries: list, stages: Stages) -> tuple[list, list]:
+    """
+        Runs the annotation, background and enrichment stages of an engine.
+        Returns the names, overlaps and sizes of the categories and the p-values, one row per query.
+    """
+    if engine == "batch":
+        with stages.stage("annotation"):
+            annotation = store.annotation_matrix().for_databases([])
+        with stages.stage("background"):
+            background: set = store.compounds()
+        with stages.stage("enrichment", tests=len(annotation) * len(queries)):
+            names, in_set, sizes, pvals = mbrole.functional_enrichment.multi_query_functional_enrichment(queries, annotation, background)
+        return [(names, in_set[:, i], sizes, pvals[:, i]) for i in range(len(queries))]
+    if engine == "sql":
+        with stages.stage("annotation"):
+            pass
+        with stages.stage("background"):
+            pass
+        with stages.stage("enrichment"):
+            results: list = [mbrole.functional_enrichment.sql_functional_enrichment(store.conn, store.table, x) for x in queries]
+        stages.results["enrichment"]["tests"] = sum(len(x[0]) for x in results)
+        return results
+    with stages.stage("annotation"):
+        annotation: dict = store.compounds_for_databases()
+    with stages.stage("background"):
+        background: set = store.compounds()
+    with stages.stage("enrichment", tests=len(annotation) * len(queries)):
+        results: list = []
+        for query in queries:
+            rows: list = [mbrole.functional_enrichment.functional_enrichment(query, set(compounds), background) for compounds in annotation.values()]
+            pvals, in_set, sizes = zip(*rows) if rows else ((), (), ())
+            results.append((list(annotation), in_set, sizes, pvals))
+    return results
+
+def run_engine(engine: str, db_file: str, queries: list, table: str, pval: float, output_dir: str) -> dict:
+    stages: Stages = Stages()
+    with mbrole.annotation.AnnotationStore(db_file, table) as store:
+        results: list = _enrich(engine, store, queries, stages)
+    with stages.stage("fdr"):
+        fdrs: list = [mbrole.functional_enrichment.correct_pvalue(np.asarray(x[3], dtype=float)) for x in results]
+    with stages.stage("output"):
+        tables: dict = {}
+        for i, ((names, in_set, sizes, pvals), fdr) in enumerate(zip(results, fdrs)):
+            keep = fdr < pval
+            columns: tuple = (np.asarray(names, dtype=object), np.asarray(in_set, dtype=np.int64), np.asarray(sizes, dtype=np.int64), np.asarray(pvals, dtype=float), fdr)
+            tables[f"query{i}"] = {name: column[keep] for name, column in zip(mbrole.cli.RESULT_COLUMNS, columns)}
+        with open(os.path.join(output_dir, f"{engine}.csv"), "w", newline="") as fhand:
+            mbrole.output.write_csv(fhand, tables, query_column=True)
+    stages.results["output"]["rows"] = sum(len(x["name"]) for x in tables.values())
+    enrichment: dict = stages.results["enrichment"]
+    enrichment["tests_per_second"] = enrichment["tests"] / max(enrichment["seconds"], 1e-9)
+    return stages.results
+
+def run(compounds: int, categories: int, engines: list, queries: int = 1, query_size: int = 100, alpha: float = 2.0,
+        databases: int = 3, pval: float = 0.05, seed: int = 0, table: str = "mbrole") -> dict:
+    """
+        Generates a synthetic DB and runs the benchmark of each engine on it. Returns the results as a dict.
+    """
+    config: dict = {"compounds": compounds, "categories": categories, "queries": queries, "query_size": query_size,
+                    "alpha": alpha, "databases": databases, "pval": pval, "seed": seed}
+    with tempfile.TemporaryDirectory() as directory:
+        db_file: str = os.path.join(directory, "synthetic.db")
+        stages: Stages = Stages()
+        with stages.stage("db_load"):
+            rows: int = synthetic.generate_db(db_file, compounds, categories, databases, alpha, seed, table)
+        stages.results["db_load"]["rows"] = rows
+        stages.results["db_load"]["rows_per_second"] = rows / max(stages.results["db_load"]["seconds"], 1e-9)
+        query_sets: list = synthetic.generate_queries(db_file, queries, query_size, seed=seed, table=table)
+        results: dict = {"setup": stages.results}
+        for engine in engines:
+            logging.info(f"Running engine {engine}")
+            results[engine] = run_engine(engine, db_file, query_sets, table, pval, directory)
+    return {"config": config,
+            "machine": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+            "results": results}
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+        Stages slower than in the baseline by more than tolerance (a fraction), as messages
+    """
+    regressions: list = []
+    if current["config"] != baseline["config"]:
+        logging.warning("The baseline was run with another configuration, timings may not be comparable")
+    for group, stages in current["results"].items():
+        for stage, values in stages.items():
+            reference: dict = baseline["results"].get(group, {}).get(stage)
+            if reference is None or reference["seconds"] < MIN_COMPARED_SECONDS:
+                continue
+            ratio: float = values["seconds"] / reference["seconds"]
+            if ratio > 1 + tolerance:
+                regressions.append(f"{group}.{stage}: {values['seconds']:.3f} s, baseline {reference['seconds']:.3f} s ({ratio:.2f}x)")
+    return regressions
+
+def report(result: dict) -> str:
+    lines: list = [f"{'engine':<8} {'stage':<12} {'seconds':>10} {'peak RSS MB':>12}  counts"]
+    for group, stages in result["results"].items():
+        for stage, values in stages.items():
+            counts: str = ", ".join(f"{k}={v:.0f}" for k, v in values.items() if k not in ("seconds", "peak_rss_mb"))
+            lines.append(f"{group:<8} {stage:<12} {values['seconds']:>10.3f} {values['peak_rss_mb']:>12.1f}  {counts}")
+    return "\n".join(lines)
+
+def _parse_args(argv: list = None) -> argparse.Namespace:
+    parser: argparse.ArgumentParser = argparse.ArgumentParser("mbrole benchmarks")
+    parser.add_argument("--compounds", "-c", type=int, default=10000, help="Compounds of the synthetic DB (10^4 to 10^6)")
+    parser.add_argument("--categories", "-k", type=int, default=1000, help="Categories of the synthetic DB (10^3 to 10^5)")
+    parser.add_argument("--alpha", type=float, default=2.0, help="Exponent of the power law of category sizes")
+    parser.add_argument("--databases", type=int, default=3, help="Source databases the categories are spread over")
+    parser.add_argument("--queries", "-q", type=int, default=1, help="Number of query sets")
+    parser.add_argument("--query_size", "-s", type=int, default=100, help="Compounds of each query set")
+    parser.add_argument("--engines", "-e", nargs="+", choices=ENGINES, default=["batch", "sql"], help="Engines to benchmark")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", type=str, help="Save the results as a JSON baseline")
+    parser.add_argument("--baseline", type=str, help="JSON baseline to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown over the baseline, as a fraction")
+    return parser.parse_args(argv)
+
+def main(argv: list = None) -> int:
+    args = _parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    result: dict = run(args.compounds, args.categories, args.engines, args.queries, args.query_size, args.alpha, args.databases, seed=args.seed)
+    print(report(result))
+    if args.save:
+        with open(args.save, "wt") as fhand:
+            json.dump(result, fhand, indent=1)
+    if args.baseline:
+        with open(args.baseline) as fhand:
+            regressions: list = compare(result, json.load(fhand), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
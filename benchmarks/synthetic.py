@@ -0,0 +1,80 @@
+#! /usr/bin/env python3
+
+"""
+    Synthetic annotation databases.
+
+    Category sizes follow a power law (a Pareto distribution): most categories are small and a few
+    are very large, as pathways or ontology classes are. Compounds are also drawn with power-law
+    weights, so a few of them (water, ATP...) are annotated in many categories.
+"""
+
+import logging
+import sqlite3
+
+import numpy as np
+
+import mbrole.database
+
+def category_sizes(categories: int, compounds: int, alpha: float = 2.0, min_size: int = 3, max_fraction: float = 0.2, rng: np.random.Generator = None) -> np.ndarray:
+    """
+        Power-law category sizes, between min_size and max_fraction of the compounds
+    """
+    rng = rng or np.random.default_rng()
+    sizes = min_size * (1 - rng.random(categories)) ** (-1 / (alpha - 1))
+    return np.clip(sizes, min_size, max(min_size, max_fraction * compounds)).astype(np.int64)
+
+def annotation_pairs(categories: int, compounds: int, alpha: float = 2.0, compound_skew: float = 0.8, rng: np.random.Generator = None) -> tuple[np.ndarray, np.ndarray]:
+    """
+        (category, compound) index pairs of a synthetic annotation, without repetitions
+    """
+    rng = rng or np.random.default_rng()
+    sizes: np.ndarray = category_sizes(categories, compounds, alpha, rng=rng)
+    weights = np.arange(1, compounds + 1, dtype=float) ** -compound_skew
+    cumulative = np.cumsum(weights / weights.sum())
+    category_ids = np.repeat(np.arange(categories, dtype=np.int64), sizes)
+    compound_ids = np.minimum(np.searchsorted(cumulative, rng.random(len(category_ids))), compounds - 1)
+    # Repeated draws in a category are dropped, so sizes are slightly under the drawn ones
+    pairs = np.unique(category_ids * compounds + compound_ids)
+    return pairs // compounds, pairs % compounds
+
+def compound_name(index: int) -> str:
+    return f"C{index:07d}"
+
+def generate_db(db_file: str, compounds: int = 10000, categories: int = 1000, databases: int = 3, alpha: float = 2.0, seed: int = 0, table: str = mbrole.database.DEFAULT_TABLE) -> int:
+    """
+        Writes a synthetic annotation table into db_file. Categories are spread over the given number of source databases.
+
+        Returns the number of rows inserted.
+    """
+    rng = np.random.default_rng(seed)
+    category_ids, compound_ids = annotation_pairs(categories, compounds, alpha, rng=rng)
+    logging.info(f"Generating {len(category_ids)} annotation rows: {categories} categories, {compounds} compounds")
+    rows = ((compound_name(compound), f"category{category:06d}", "", f"DB{category % databases}", "")
+            for category, compound in zip(category_ids.tolist(), compound_ids.tolist()))
+    conn = sqlite3.connect(db_file)
+    total: int = mbrole.database.bulk_insert(conn, rows, table)
+    conn.close()
+    return total
+
+def generate_queries(db_file: str, queries: int = 1, size: int = 100, signal: float = 0.5, seed: int = 0, table: str = mbrole.database.DEFAULT_TABLE) -> list[set]:
+    """
+        Query sets of the given size: a fraction (signal) of each one comes from a random category
+        (chosen with probability proportional to its size), so some categories are enriched,
+        and the rest from the whole table.
+    """
+    rng = np.random.default_rng(seed)
+    conn = sqlite3.connect(db_file)
+    all_compounds: list = sorted(x[0] for x in conn.execute(f"SELECT DISTINCT compound FROM {table};"))
+    names, sizes = zip(*conn.execute(f"SELECT annotation, COUNT(*) FROM {table} GROUP BY annotation ORDER BY annotation;"))
+    weights = np.asarray(sizes, dtype=float) / sum(sizes)
+    result: list = []
+    for _ in range(queries):
+        category: str = names[rng.choice(len(names), p=weights)]
+        members: list = sorted(x[0] for x in conn.execute(f"SELECT compound FROM {table} WHERE annotation = ?;", (category,)))
+        planted = rng.choice(members, size=min(len(members), int(size * signal)), replace=False)
+        query: set = set(planted.tolist())
+        while len(query) < min(size, len(all_compounds)):
+            query.update(rng.choice(all_compounds, size=size - len(query)).tolist())
+        result.append(query)
+    conn.close()
+    return result
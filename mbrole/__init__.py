@@ -1,5 +1,19 @@
 #! /usr/bin/env python3
 
-from . import annotation  # noqa: F401
-from . import functional_enrichment  # noqa: F401
+"""
+    Submodules are imported on first access (e.g. mbrole.functional_enrichment), so importing
+    the package, or the command line entry point, does not load numpy, scipy and the engines.
+"""
 
+import importlib
+
+_SUBMODULES = ("annotation", "arg_parse", "cli", "database", "functional_enrichment", "identifiers", "incidence",
+               "jsonstream", "metrics", "ontology", "output", "parallel", "permutation", "redundancy", "server", "snapshot")
+
+def __getattr__(name: str):
+    if name in _SUBMODULES:
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__() -> list:
+    return sorted(list(globals()) + list(_SUBMODULES))
@@ -1,12 +1,178 @@
 #! /usr/bin/env python3
 
+"""
+    Access to the annotation database.
+
+    AnnotationStore owns a single read-only connection to a mbrole SQLite file, tuned for reading,
+    and runs every query with parameters, so statements are reused and names with quotes are safe.
+    Lists of names are sent in a TEMP table and joined, so fetching N categories is a single query.
+    Query identifiers are translated to the compounds of the table the same way (see AnnotationStore.translate).
+"""
+
 import logging
+import os.path
 import sqlite3
+import urllib.parse
+
+import mbrole.database
+import mbrole.identifiers
+from mbrole.incidence import AnnotationMatrix
+
+class AnnotationStore:
+    """
+        Read-only access to the annotation table of a mbrole SQLite file.
+
+        The file is opened with mode=ro and, unless immutable is False, immutable=1: SQLite then
+        skips locking and change detection, so the file must not change while it is open.
+        It can be used as a context manager, closing the connection on exit.
+    """
+
+    def __init__(self, db_file: str, table: str = mbrole.database.DEFAULT_TABLE, mmap_size: int = 1 << 30, cache_size: int = -65536, immutable: bool = True):
+        if not os.path.isfile(db_file):
+            raise FileNotFoundError(f"Annotation database not found: {db_file}")
+        self.db_file = db_file
+        self.table = table
+        uri: str = f"file:{urllib.parse.quote(os.path.abspath(db_file))}?mode=ro{'&immutable=1' if immutable else ''}"
+        self.conn: sqlite3.Connection = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        self.conn.execute(f"PRAGMA mmap_size = {int(mmap_size)};")
+        self.conn.execute(f"PRAGMA cache_size = {int(cache_size)};")
+        self.conn.execute("PRAGMA temp_store = MEMORY;")
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self) -> "AnnotationStore":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def _load_names(self, names: list) -> str:
+        """
+            Loads the names into a TEMP table, to be joined by the queries. Returns its name.
+        """
+        self.conn.execute("DROP TABLE IF EXISTS temp.mbrole_names;")
+        self.conn.execute("CREATE TEMP TABLE mbrole_names (name TEXT PRIMARY KEY) WITHOUT ROWID;")
+        self.conn.executemany("INSERT OR IGNORE INTO temp.mbrole_names (name) VALUES (?);", ((x,) for x in names))
+        return "temp.mbrole_names"
+
+    def databases(self) -> list[str]:
+        """
+            Source databases of the table (CHEBI, KEGG, HMDB...), in the order of mbrole.database.database_order
+        """
+        return mbrole.database.database_order(self.conn, self.table)
+
+    def annotations(self) -> list[str]:
+        """
+            Names of every annotation of the table
+        """
+        SQL = f"SELECT DISTINCT annotation FROM {mbrole.database.source_table(self.conn, self.table)};"
+        logging.debug(SQL)
+        return [x[0] for x in self.conn.execute(SQL)]
+
+    def compounds(self) -> set:
+        """
+            Every compound of the table: the default background
+        """
+        SQL = f"SELECT DISTINCT compound FROM {self.table};"
+        logging.debug(SQL)
+        return {x[0] for x in self.conn.execute(SQL)}
+
+    def organisms(self) -> dict[str, int]:
+        """
+            Organisms with a background in the database, and the size of each background
+        """
+        if mbrole.database.object_type(self.conn, mbrole.database.background_sizes_table(self.table)) != "table":
+            return {}
+        SQL = f"SELECT organism, size FROM {mbrole.database.background_sizes_table(self.table)};"
+        logging.debug(SQL)
+        return dict(self.conn.execute(SQL))
+
+    def background(self, organism: str) -> set:
+        """
+            Compounds of the background of an organism, read through the primary key, without scanning the annotation.
+            Raises KeyError if the organism has no background.
+        """
+        size: int = self.organisms().get(organism)
+        if size is None:
+            raise KeyError(f"No background for organism {organism}")
+        SQL = f"SELECT compound FROM {mbrole.database.backgrounds_table(self.table)} WHERE organism = ?;"
+        logging.debug(SQL)
+        background: set = {x[0] for x in self.conn.execute(SQL, (organism,))}
+        if len(background) != size:
+            logging.warning(f"Background of {organism} has {len(background)} compounds, {size} expected")
+        return background
+
+    def compounds_for_annotations(self, annotations: list) -> dict[str, set]:
+        """
+            Compounds of each of the given annotations, merging databases, in a single query.
+            Annotations not in the table are returned empty.
+        """
+        result: dict = {x: set() for x in annotations}
+        SQL = f"SELECT m.annotation, m.compound FROM {self.table} AS m JOIN {self._load_names(annotations)} AS n ON n.name = m.annotation;"
+        logging.debug(SQL)
+        for annotation, compound in self.conn.execute(SQL):
+            result[annotation].add(compound)
+        return result
+
+    def compounds_for_databases(self, databases: list = None) -> dict[str, list]:
+        """
+            Compounds of each annotation of the given databases (all of them if None), in a single query.
+
+            Annotations with the same name in several databases are taken from the last database given
+            (see mbrole.database.merge_categories).
+        """
+        databases = databases or self.databases()
+        categories: dict = {}
+        SQL = (f"SELECT m.database, m.annotation, m.compound FROM {mbrole.database.category_rows(self.conn, self.table)} AS m "
+               f"JOIN {self._load_names(databases)} AS n ON n.name = m.database ORDER BY m.position;")
+        logging.debug(SQL)
+        for database, annotation, compound in self.conn.execute(SQL):
+            categories.setdefault((database, annotation), []).append(compound)
+        keys: list = list(categories)
+        return {keys[i][1]: categories[keys[i]] for i in mbrole.database.merge_categories(keys, databases)}
+
+    def has_id_map(self) -> bool:
+        return mbrole.database.object_type(self.conn, mbrole.database.id_map_table(self.table)) == "table"
+
+    def translate(self, identifiers: list, id_type: str = "auto") -> dict[str, set]:
+        """
+            Compounds of the table each identifier stands for, in a single query.
+
+            Identifiers that are compounds of the table, as given or in the normal form of their namespace
+            (HMDB00122 is HMDB0000122), are kept, and every identifier is also looked up
+            in the id map (see mbrole.database.store_id_map), so it gets the IDs of the compound in every source
+            annotated in the table.
+            id_type is the namespace of the identifiers (see mbrole.identifiers.NAMESPACES) or "auto", to guess
+            it from each identifier. Identifiers not found are returned with an empty set.
+        """
+        result: dict = {x: set() for x in identifiers}
+        aliases: list = []
+        for identifier in result:
+            namespace: str = mbrole.identifiers.guess_namespace(identifier) if id_type == "auto" else id_type
+            aliases.append((identifier, namespace, mbrole.identifiers.normalize(namespace, identifier)))
+        self.conn.execute("DROP TABLE IF EXISTS temp.mbrole_aliases;")
+        self.conn.execute("CREATE TEMP TABLE mbrole_aliases (identifier TEXT PRIMARY KEY, namespace TEXT, alias TEXT) WITHOUT ROWID;")
+        self.conn.executemany("INSERT INTO temp.mbrole_aliases (identifier, namespace, alias) VALUES (?, ?, ?);", aliases)
+        SQL = f"""SELECT a.identifier, m.compound FROM temp.mbrole_aliases AS a JOIN {self.table} AS m ON m.compound = a.identifier
+                  UNION SELECT a.identifier, m.compound FROM temp.mbrole_aliases AS a JOIN {self.table} AS m ON m.compound = a.alias"""
+        if self.has_id_map():
+            SQL += f""" UNION SELECT a.identifier, i.compound FROM temp.mbrole_aliases AS a JOIN {mbrole.database.id_map_table(self.table)} AS i
+                       ON i.alias = a.alias AND i.namespace = a.namespace
+                       WHERE EXISTS (SELECT 1 FROM {self.table} AS m WHERE m.compound = i.compound)"""
+        else:
+            logging.warning(f"No id map in {self.db_file}, identifiers are only matched exactly")
+        logging.debug(SQL)
+        for identifier, compound in self.conn.execute(SQL + ";"):
+            result[identifier].add(compound)
+        return result
+
+    def annotation_matrix(self, databases: list = None, annotations: list = None) -> AnnotationMatrix:
+        """
+            Annotation of the given databases and annotation names (all of them if None) as an AnnotationMatrix
+        """
+        return AnnotationMatrix.from_db(self.conn, self.table, databases, annotations)
 
 def get_categories_from_db(db, table):
-    SQL = f"SELECT DISTINCT database from {table};"
-    logging.debug(SQL)
-    conn = sqlite3.Connection(db)
-    cursor = conn.cursor()
-    cursor.execute(SQL)
-    return [x[0] for x in cursor.fetchall()]
+    with AnnotationStore(db, table) as store:
+        return store.databases()
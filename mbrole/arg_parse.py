@@ -2,12 +2,15 @@
 
 import argparse
 
-def _parse_arguments() -> argparse.Namespace:
+import mbrole.identifiers
+
+def _parse_arguments(argv: list = None) -> argparse.Namespace:
     """
         Parses command line arguments.
 
         Mandatory arguments:
             - Compound list: main input file. Consists of a list of compounds, one per line.
+              Or, in batch mode, many of them.
             - Annotation: SQLite db file containing annotation.
             - Background: List of background compounds, one per line.
             - Output: Path to output file.
@@ -15,15 +18,67 @@ def _parse_arguments() -> argparse.Namespace:
 
     """
     parser: argparse.ArgumentParser = argparse.ArgumentParser("mbRole")
-    parser.add_argument("--compound","-i", type=str, help="Path to a file containing a set of compounds. One compound per line.", required=True)
-    parser.add_argument("--output","-o", type=str, help="Path to a file to store results. CSV format", default="/dev/stdout")
+    queries = parser.add_mutually_exclusive_group(required=True)
+    queries.add_argument("--compound","-i", type=str, help="Path to a file containing a set of compounds. One compound per line.")
+    queries.add_argument("--batch","-b", type=str, help="Many query files, analyzed against the same annotation: a directory, a glob pattern or a manifest file with one query file path per line")
+    parser.add_argument("--output_dir","-od", type=str, help="In batch mode, directory to store one CSV per query. If not given, a single table with a query column is written to --output")
+    parser.add_argument("--output","-o", type=str, help="Path to a file to store results. CSV format, unless another one is given by --output-format or the extension (.csv.gz, .csv.zst, .parquet, .arrow)", default="/dev/stdout")
+    parser.add_argument("--output-format", "--output_format", dest="output_format", type=str, choices=["csv", "csv.gz", "csv.zst", "parquet", "arrow"],
+                        help="Format of the results. By default, taken from the extension of --output. zst needs Python 3.14 or zstandard, parquet and arrow need pyarrow")
+    parser.add_argument("--overlaps", action="store_true", help="Add a column with the compounds of the query in each category reported")
     parser.add_argument("--db_file","-dbf", type=str, help="Path to a SQLite database file containing annotation.", required=True)
     parser.add_argument("--annotation","-a", nargs="*", type=str, help="Annotation to make the enrichment analysis to", default=[])
     parser.add_argument("--background","-bg", type=str, help="(Optional) Path to a file containing background compounds. One compound per line. If no value indicated, the compouns on all annotation sets will be used as background", required=False)
+    parser.add_argument("--organism", "-org", type=str, help="(Optional) Use the background of this organism stored in the db (see scripts/kegg-organism-backgrounds.py). Not compatible with --background", required=False)
+    parser.add_argument("--id-type", "--id_type", dest="id_type", type=str, choices=["exact", "auto", *mbrole.identifiers.NAMESPACES], default="exact",
+                        help="Identifiers of the query and background files: exact (compounds of the db, default), auto (guessed from each identifier: ChEBI, HMDB, KEGG, PubChem, InChIKey, CAS or names) or a namespace. They are translated through the id map of the db")
     parser.add_argument("--database", "-db", type=str, nargs="+", help="Source database from which the annotations are used, stored in db. More than one can be used. Non case sensitive", default=[])
     parser.add_argument("--loglevel", "-l", type=str, choices=["debug","info","warning","error","critical"], help="Miminal log level to report", default="info")
     parser.add_argument("--logfile", "-lf", type=str, help="File path to store logs")
     parser.add_argument("--table", "-t", type=str, help="Table used in the db to store annotations", default="mbrole")
-    parser.add_argument("--all", "-all", action="store_true", default=False, help="Use this flag to print all categories, and not only those that are statistically significant")
+    parser.add_argument("--all", "-all", action="store_true", default=False, help="Use this flag to print all categories, and not only those that are statistically significant. Without it, categories that cannot reach --pval are not tested")
     parser.add_argument("--pval","-pv", type=float, default=0.05, help="Maximum pvalue to filter. Does nothing if --all is used")
-    return parser.parse_args()
+    parser.add_argument("--min-size", "--min_size", dest="min_size", type=int, default=0, help="Only test categories with at least this many compounds. Smaller ones are left out of the analysis and of the FDR correction")
+    parser.add_argument("--max-size", "--max_size", dest="max_size", type=int, help="Only test categories with at most this many compounds. Larger ones are left out of the analysis and of the FDR correction")
+    parser.add_argument("--dedup", action="store_true", help="Batch and loop engines: test each distinct compound set once, and give its result to every category with that set")
+    parser.add_argument("--cluster-jaccard", "--cluster_jaccard", dest="cluster_jaccard", type=float,
+                        help="Batch and loop engines: add a cluster column, shared by categories whose compounds have at least this Jaccard index (0 to 1), directly or through other categories")
+    parser.add_argument("--workers", "-w", type=int, default=1, help="Number of worker processes for the batch engine. Categories are split across them")
+    parser.add_argument("--engine", "-e", type=str, choices=["batch","loop","sql"], default="batch", help="Enrichment engine: batch tests all categories at once (default), loop tests one category at a time, sql computes the overlaps inside SQLite for DBs too large for memory")
+    parser.add_argument("--permutations", type=int, default=0, help="Batch engine: also compute empirical p-values from this many random query sets drawn from the background, and their family-wise (min-p) correction")
+    parser.add_argument("--seed", type=int, help="Seed of the random query sets of --permutations, for reproducible results")
+    parser.add_argument("--pval-cache", "--pval_cache", dest="pval_cache", type=str, nargs="?", const="", help="Cache p-values by contingency table (batch and sql engines). If a file is given, the cache is loaded from it and saved back, to be reused by later runs")
+    parser.add_argument("--pval-cache-size", "--pval_cache_size", dest="pval_cache_size", type=int, default=1 << 20, help="Maximum number of p-values kept in the cache")
+    parser.add_argument("--metrics-out", "--metrics_out", dest="metrics_out", type=str, help="Write wall time, CPU time, peak memory and counts of each stage of the run to this JSON file")
+    parser.add_argument("--profile", type=str, help="Profile the run with cProfile and write its stats to this file (read them with pstats)")
+    parser.add_argument("--tracemalloc", type=str, help="Trace memory allocations: adds the peak traced memory of each stage to the metrics and writes the largest allocations to this file")
+    return parser.parse_args(argv)
+
+def _parse_compile_arguments(argv: list = None) -> argparse.Namespace:
+    """
+        Parses the arguments of mbrole-cli compile, which precompiles the annotation of a
+        SQLite db file into a snapshot stored next to it.
+    """
+    parser: argparse.ArgumentParser = argparse.ArgumentParser("mbRole compile")
+    parser.add_argument("--db_file","-dbf", type=str, help="Path to a SQLite database file containing annotation.", required=True)
+    parser.add_argument("--table", "-t", type=str, help="Table used in the db to store annotations", default="mbrole")
+    parser.add_argument("--loglevel", "-l", type=str, choices=["debug","info","warning","error","critical"], help="Miminal log level to report", default="info")
+    parser.add_argument("--logfile", "-lf", type=str, help="File path to store logs")
+    return parser.parse_args(argv)
+
+
+def _parse_serve_arguments(argv: list = None) -> argparse.Namespace:
+    """
+        Parses the arguments of mbrole-cli serve, which starts an enrichment server
+        that keeps annotation DBs loaded between requests.
+    """
+    parser: argparse.ArgumentParser = argparse.ArgumentParser("mbRole serve")
+    parser.add_argument("--db_file","-dbf", type=str, nargs="+", help="SQLite database files to serve, loaded on start-up. The first one is the default of requests, others are refused", required=True)
+    parser.add_argument("--table", "-t", type=str, help="Table used in the db to store annotations", default="mbrole")
+    parser.add_argument("--host", type=str, help="Address to listen on", default="127.0.0.1")
+    parser.add_argument("--port", "-p", type=int, help="TCP port to listen on", default=8765)
+    parser.add_argument("--socket", "-s", type=str, help="Path of a Unix socket to listen on, instead of TCP")
+    parser.add_argument("--cache_size", "-c", type=int, help="Maximum number of annotation DBs kept loaded", default=4)
+    parser.add_argument("--loglevel", "-l", type=str, choices=["debug","info","warning","error","critical"], help="Miminal log level to report", default="info")
+    parser.add_argument("--logfile", "-lf", type=str, help="File path to store logs")
+    return parser.parse_args(argv)
\ No newline at end of file
@@ -6,32 +6,51 @@
     It performs a Functional Enrichment of the list of metabolites providen,
     agains a user-database of compounds and annotations
 
-    Generates a csv file (exported from a pandas dataframe) with the result of the different 
+    Generates a csv file with the result of the different 
     Functional enrichment provided
 
+    Heavy modules (numpy, scipy, the engines) are imported on the code paths that use them,
+    so --help and argument errors do not pay for them. An analysis imports the ones it needs
+    before it starts (see import_modules), so their import time is not part of its stages.
 """
 
+from __future__ import annotations
+
+import glob
+import importlib
 import logging
-import sqlite3
+import os
+import os.path
 import sys
 
-import pandas as pd
-import scipy
-import tqdm
-
+# The other submodules of mbrole (and numpy, scipy...) are imported on first use,
+# through the lazy attributes of the package (see mbrole/__init__.py)
 import mbrole.arg_parse
-import mbrole.functional_enrichment
 
-def get_bg_set(bg_arg:str, table:str, db:str) -> set:
+RESULT_COLUMNS = ("name", "Compund-in-set", "Compound-in-annotation", "pval", "FDR")
+# Added to the results with --permutations
+PERMUTATION_COLUMNS = ("empirical_pval", "FWER")
+# Added to the results with --cluster-jaccard: categories with similar compounds share a cluster
+CLUSTER_COLUMN = "cluster"
+# Added to the results with --overlaps: the compounds of the query in each category
+OVERLAP_COLUMN = "compounds"
+
+def get_bg_set(bg_arg:str, store: mbrole.annotation.AnnotationStore, snapshot: mbrole.incidence.AnnotationMatrix = None, organism: str = None) -> set:
     if bg_arg:
         return parse_input_file(bg_arg)
-    return mbrole.functional_enrichment.get_background_genes_from_db(sqlite3.Connection(db), table)
+    if organism:
+        return store.background(organism)
+    if snapshot is not None:
+        # The snapshot holds every compound of the table
+        return set(snapshot.compounds)
+    return store.compounds()
 
 def parse_input_file(file:str) -> set:
     compounds: set = {}
     with open(file) as fhand:
         compounds:str = fhand.readlines()
-        compounds:set = set(map(lambda x: x.strip(), compounds))
+        # Blank lines are not compounds: files with only blank lines are empty
+        compounds:set = set(map(lambda x: x.strip(), compounds)) - {""}
     return compounds
 
 def set_logger(name:str, file:str, log_level:int) -> logging.Logger:
@@ -59,81 +78,438 @@ def set_logger(name:str, file:str, log_level:int) -> logging.Logger:
 
 def _perform_FE(category: set, query_set:set, bg_set:set, annotation:str) -> tuple[float, int, int]:
     #annotation = mbrole.functional_enrichment.get_categories_from_db(conn, table, db, category)
-    logging.debug(f"Performing FE for {category}: bg of {len(bg_set)}")
+    logging.debug("Performing FE for %s: bg of %d", category, len(bg_set))
     res:tuple = mbrole.functional_enrichment.functional_enrichment(query_set, annotation, bg_set) 
     if (res is None):
         return
     pval, in_set, in_annotation = res
     return pval, in_set, in_annotation
 
+def load_annotation(args, logger: logging.Logger, store: mbrole.annotation.AnnotationStore) -> dict:
+    """
+        Loads the annotation as a dict of annotation name -> compounds, used by the loop engine
+    """
+    categories:list = args.annotation
+    if len(categories) == 0:
+        logger.info("No categories selected: Using full database")
+        logger.info(f"database selected {args.database}")
+        logger.info("Consolidating annotations")
+        # We want to merge the annotations from different databases
+        # That are available in the database. No database indicated means all of them
+        annotation:dict = store.compounds_for_databases(args.database)
+    else:
+        # As we have the annotations of interest, we just query them
+        annotation:dict = store.compounds_for_annotations(categories)
+    return {name: compounds for name, compounds in annotation.items() if in_size_window(len(compounds), args)}
+
+def in_size_window(size: int, args) -> bool:
+    return size >= args.min_size and (args.max_size is None or size <= args.max_size)
+
+def pruning_threshold(args) -> float:
+    """
+        p-value below which categories are tested (see functional_enrichment.enrichment_pvalues): the
+        FDR threshold, as categories that cannot reach it are not reported. None with --all, which reports every category.
+    """
+    return None if args.all else args.pval
+
+def load_annotation_matrix(args, logger: logging.Logger, store: mbrole.annotation.AnnotationStore, snapshot: mbrole.incidence.AnnotationMatrix = None) -> mbrole.incidence.AnnotationMatrix:
+    """
+        Loads the annotation as an AnnotationMatrix, used by the batch engine.
+        If a snapshot of the table is given, it is used instead of querying the db file.
+
+        Gives the same categories as load_annotation: annotations with the same name in
+        different databases are merged as the dicts are, and only those within --min-size and --max-size are kept.
+    """
+    import numpy as np
+    if len(args.annotation) == 0:
+        logger.info("No categories selected: Using full database")
+        logger.info(f"database selected {args.database}")
+        logger.info("Consolidating annotations")
+        if snapshot is None:
+            snapshot = store.annotation_matrix(args.database)
+        annotation = snapshot.for_databases(args.database)
+    else:
+        if snapshot is None:
+            snapshot = store.annotation_matrix(annotations=args.annotation)
+        annotation = snapshot.for_annotations(args.annotation)
+    if args.min_size > 0 or args.max_size is not None:
+        annotation = annotation.select(np.flatnonzero(mbrole.functional_enrichment.size_window(annotation.sizes, args.min_size, args.max_size)))
+    logger.debug(f"Annotation matrix: {annotation.matrix.shape}, {annotation.nbytes()} bytes")
+    return annotation
+
+def get_query_files(batch: str) -> list[str]:
+    """
+        Query files of a batch run. The batch argument can be:
+            - A directory: every file in it is a query.
+            - A manifest: a file with the path of one query file per line, relative to the manifest.
+            - A glob pattern, e.g. "samples/*.txt"
+    """
+    if os.path.isdir(batch):
+        return sorted(os.path.join(batch, x) for x in os.listdir(batch) if os.path.isfile(os.path.join(batch, x)))
+    if os.path.isfile(batch):
+        with open(batch) as fhand:
+            files: list = [x.strip() for x in fhand if x.strip()]
+        return [os.path.join(os.path.dirname(batch), x) for x in files]
+    return sorted(glob.glob(batch))
+
+def _query_name(file: str) -> str:
+    return os.path.splitext(os.path.basename(file))[0]
+
+def query_names(files: list[str]) -> list[str]:
+    """
+        Name of each query file: its name without extension or, for names found in more than one folder,
+        its path without extension relative to the folder all the files share, e.g. "a/q1" and "b/q1"
+    """
+    names: list = [_query_name(x) for x in files]
+    repeated: set = {x for x in names if names.count(x) > 1}
+    if not repeated:
+        return names
+    common: str = os.path.commonpath([os.path.abspath(x) for x in files])
+    return [os.path.splitext(os.path.relpath(os.path.abspath(file), common))[0] if name in repeated else name for file, name in zip(files, names)]
+
+def output_file_names(names: list[str]) -> list[str]:
+    """
+        File name (without extension) of each query in --output_dir: path separators are replaced
+        by "_", and a number is added to names that are still repeated
+    """
+    files: list = []
+    for name in names:
+        stem: str = name.replace(os.sep, "_").replace("/", "_")
+        file, i = stem, 1
+        while file in files:
+            i += 1
+            file = f"{stem}-{i}"
+        files.append(file)
+    return files
+
+def parse_queries(args, logger: logging.Logger) -> dict[str, set]:
+    """
+        Parses the query sets, either the single --compound file or every file of --batch (see query_names).
+        In batch mode, empty files are skipped.
+    """
+    if args.compound:
+        return {_query_name(args.compound): parse_input_file(args.compound)}
+    queries: dict = {}
+    files: list = get_query_files(args.batch)
+    for file, name in zip(files, query_names(files)):
+        compounds: set = parse_input_file(file)
+        if len(compounds) == 0:
+            logger.warning(f"Empty input file: {file}. Skipping")
+            continue
+        queries[name] = compounds
+    return queries
+
+def translate_set(name: str, identifiers: set, store: mbrole.annotation.AnnotationStore, id_type: str, logger: logging.Logger,
+                  translation: dict = None) -> set:
+    """
+        Compounds of the db the identifiers stand for (see AnnotationStore.translate), logging how many were mapped.
+        translation holds identifiers already translated, if any.
+    """
+    translation = translation if translation is not None else store.translate(sorted(identifiers), id_type)
+    unmapped: list = sorted(x for x in identifiers if not translation[x])
+    compounds: set = set().union(*(translation[x] for x in identifiers))
+    logger.info(f"{name}: {len(identifiers) - len(unmapped)} identifiers mapped to {len(compounds)} compounds, {len(unmapped)} unmapped")
+    if unmapped:
+        logger.warning(f"Unmapped identifiers of {name}: {', '.join(unmapped[:10])}{'...' if len(unmapped) > 10 else ''}")
+    return compounds
+
+def translate_queries(queries: dict[str, set], store: mbrole.annotation.AnnotationStore, id_type: str, logger: logging.Logger) -> dict[str, set]:
+    """
+        Translates every query set with a single query to the db
+    """
+    translation: dict = store.translate(sorted(set().union(*queries.values())), id_type)
+    return {name: translate_set(f"Query set {name}", query_set, store, id_type, logger, translation) for name, query_set in queries.items()}
+
+def load_pvalue_cache(args) -> mbrole.functional_enrichment.PValueCache:
+    """
+        p-value cache of --pval-cache: None if not used, loaded from the file if one is given and exists
+    """
+    if args.pval_cache is None:
+        return None
+    if args.engine == "loop" or args.workers > 1:
+        logging.warning("The p-value cache is only used by the batch (single worker) and sql engines")
+        return None
+    if args.pval_cache:
+        return mbrole.functional_enrichment.PValueCache.load(args.pval_cache, args.pval_cache_size)
+    return mbrole.functional_enrichment.PValueCache(args.pval_cache_size)
+
+def result_table(names, in_set, in_annotation, pvals, args, permutation: tuple = None, overlaps=None, clusters=None) -> dict:
+    """
+        Table with the result of one query, as a dict of column -> array (see RESULT_COLUMNS):
+        FDR correction and, unless --all is used, filtering.
+        permutation holds the empirical and family-wise p-values of --permutations, if used (see PERMUTATION_COLUMNS).
+        overlaps is a function giving the compounds of the query in categories, by name (see overlap_function):
+        it is only called for the rows kept.
+        clusters holds the cluster of each category of --cluster-jaccard, if used (see mbrole.redundancy.cluster_categories).
+    """
+    import numpy as np
+    pvals = np.asarray(pvals, dtype=float)
+    names_array = np.empty(len(pvals), dtype=object)
+    names_array[:] = list(names)
+    fdr = mbrole.functional_enrichment.correct_pvalue(pvals)
+    keep = slice(None) if args.all else fdr < args.pval
+    columns: tuple = (names_array, np.asarray(in_set, dtype=np.int64), np.asarray(in_annotation, dtype=np.int64), pvals, fdr)
+    table: dict = {name: column[keep] for name, column in zip(RESULT_COLUMNS, columns)}
+    if permutation is not None:
+        table.update({name: np.asarray(column)[keep] for name, column in zip(PERMUTATION_COLUMNS, permutation)})
+    if clusters is not None:
+        table[CLUSTER_COLUMN] = np.asarray(clusters, dtype=np.int64)[keep]
+    if overlaps is not None:
+        table[OVERLAP_COLUMN] = np.empty(len(table["name"]), dtype=object)
+        table[OVERLAP_COLUMN][:] = [";".join(sorted(x)) for x in overlaps(table["name"])]
+    return table
+
+def overlap_function(args, annotation, store: mbrole.annotation.AnnotationStore, query_set: set):
+    """
+        Function giving, for a list of category names, the compounds of the query annotated in each of them,
+        read from the annotation of the engine (the db for the sql engine)
+    """
+    if args.engine == "batch":
+        rows: dict = {name: i for i, name in enumerate(annotation.names)}
+        vector = annotation.indicator(query_set)
+        return lambda names: annotation.overlap_compounds([rows[x] for x in names], vector)
+    if args.engine == "loop":
+        return lambda names: [query_set.intersection(annotation[x]) for x in names]
+    def from_db(names) -> list:
+        compounds: dict = store.compounds_for_annotations(list(names))
+        return [query_set.intersection(compounds[x]) for x in names]
+    return from_db
+
+def write_results(results: dict[str, dict], args) -> None:
+    """
+        Writes the results, in --output-format or the format of the extension of the output (see mbrole.output).
+        A single query is written as is to --output. In batch mode results are written one file per query
+        to --output_dir, if given, or as one long table with a query column to --output.
+    """
+    if args.compound:
+        mbrole.output.write_tables(args.output, results, args.output_format)
+    elif args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+        extension: str = mbrole.output.FORMATS[args.output_format or "csv"]
+        for (name, table), file in zip(results.items(), output_file_names(list(results))):
+            mbrole.output.write_tables(os.path.join(args.output_dir, f"{file}{extension}"), {name: table}, args.output_format)
+    else:
+        mbrole.output.write_tables(args.output, results, args.output_format, query_column=True)
+
+def compile_main(argv: list) -> None:
+    """
+        mbrole-cli compile: writes the snapshot of the annotation table next to the db file
+    """
+    args = mbrole.arg_parse._parse_compile_arguments(argv)
+    logger:logging.Logger = set_logger("mbrole-cli", args.logfile, args.loglevel)
+    path: str = mbrole.snapshot.compile_snapshot(args.db_file, args.table)
+    logger.info(f"Snapshot saved in {path}")
+
+def serve_main(argv: list) -> None:
+    """
+        mbrole-cli serve: starts the enrichment server (see mbrole.server)
+    """
+    import asyncio
+    import mbrole.server
+    args = mbrole.arg_parse._parse_serve_arguments(argv)
+    logger: logging.Logger = set_logger("mbrole-cli", args.logfile, args.loglevel)
+    try:
+        server = mbrole.server.EnrichmentServer(args.db_file, args.table, args.cache_size)
+    except ValueError as error:
+        logger.error(str(error))
+        sys.exit(1)
+    try:
+        asyncio.run(server.serve_forever(args.host, args.port, args.socket))
+    except KeyboardInterrupt:
+        pass
+
+def import_modules(args) -> None:
+    """
+        Imports the modules the analysis of args uses
+    """
+    modules: list = ["mbrole.annotation", "mbrole.functional_enrichment", "mbrole.output"]
+    if args.engine == "batch":
+        modules.append("mbrole.snapshot")
+    if args.engine == "loop":
+        modules.append("tqdm")
+    if args.workers > 1:
+        modules += ["mbrole.parallel", "concurrent.futures.process"]
+    if args.permutations > 0:
+        modules.append("mbrole.permutation")
+    if args.dedup or args.cluster_jaccard is not None:
+        modules.append("mbrole.redundancy")
+    for module in modules:
+        importlib.import_module(module)
+    if args.engine == "loop":
+        # tqdm imports multiprocessing for its lock on the first bar
+        importlib.import_module("tqdm").tqdm.get_lock()
+
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "compile":
+        return compile_main(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        return serve_main(sys.argv[2:])
     args = mbrole.arg_parse._parse_arguments()
 
     # Setting up logger for mbrole-cli
     logger:logging.Logger = set_logger("mbrole-cli", args.logfile, args.loglevel)
     logger.info("Welcome to Mbrole-CLI")
     logger.info("Parsing input file")
+    metrics = mbrole.metrics.Metrics(args.metrics_out is not None, args.profile is not None, args.tracemalloc is not None)
+    with metrics.stage("imports"):
+        import_modules(args)
+    try:
+        mbrole.output.check_format(mbrole.output.format_of(args.output_dir or args.output, args.output_format))
+    except ImportError as error:
+        logger.error(str(error))
+        sys.exit(1)
 
-    # Parse input set. Note that if the file is empty
+    # Parse input sets. Note that if the file is empty
     # There's no reason to continue. So the user is warned
     # and the program exits
-    query_set:set = parse_input_file(args.compound)
-    if len(query_set) == 0:
-        logger.error(f"Empty input file: {args.compound}")
+    with metrics.stage("input") as stage:
+        queries: dict = parse_queries(args, logger)
+        stage.count(queries=len(queries), compounds=sum(len(x) for x in queries.values()))
+    if len(queries) == 0 or all(len(x) == 0 for x in queries.values()):
+        logger.error(f"Empty input: {args.compound or args.batch}")
+        sys.exit(1)
+    for name, query_set in queries.items():
+        logger.info(f"Query set {name} parsed: Detected {len(query_set)} compounds")
+        logger.debug("Compounds detected: %s", query_set)
+
+    if args.background and args.organism:
+        logger.error("Use either --background or --organism, not both")
         sys.exit(1)
-    logger.info(f"Query set parsed: Detected {len(query_set)} compounds")
-    logger.info(f"Compounds detected: {query_set}")
 
     # Now we parse the categories providen, which can be from 0 to as many as the user wants
     # If no values are provided, takes ALL annotations of the databases, so user does not have to specify it
     # By providing a DB, only annotations that were obtained from that database will be used
     # (And by DB I mean CHEBI, KEGG, ECMDB, HMDB, YMDB, etc)
-    categories:list = args.annotation
-    logger.info(f"Categories selected: {categories}")
-    if len(categories) == 0:
-        logger.info("No categories selected: Using full database")
-        logger.info(f"database selected {args.database}")
-        annotation:dict = dict()
-        databases:list = args.database
-        #logging.debug(type(databases), databases)
-        if databases == []: 
-            databases:list = mbrole.annotation.get_categories_from_db(args.db_file, args.table) # No database indicated, using all of them
-            #logging.debug(type(databases), databases)
-        logger.info("Consolidating annotations")
-        # We want to merge the annotations from different databases
-        # That are available in the database. 
-        for category in tqdm.tqdm(databases):
-            ann_ = mbrole.functional_enrichment.get_genes_per_category(sqlite3.Connection(args.db_file), args.table, category)
-            annotation = annotation | ann_ # This is a set union operator. It works for dicts as well as keys behave as sets
-    else:
-        # As we have the annotations of interest, we just query them
-        # A dict comprehension is easy to set up
-        annotation = {x:mbrole.functional_enrichment.get_category_compounds(sqlite3.Connection(args.db_file), x) for x in categories}
-
-    logger.info(f"Analyzing {len(annotation)} categories")
-
-    # Now we need to get the background set. The get_bg_set either parses the file given or uses the FULL SQLITE DATABASE as background
-    # This were the available possibilites at mbRole 3, so I kept them
-    # TODO: Add species particular sets, as a variation of providing a file
-    bg_set:set = get_bg_set(args.background, args.table, args.db_file)
-
-    # Performing the FE
-    #result = list(map(lambda x: _perform_FE(x, query_set, bg_set, annotation[x]), tqdm.tqdm(annotation.keys())))
-    result: list = list()
-    for annotation_name in tqdm.tqdm(annotation.keys()):
-        pval, in_set, in_annotation = _perform_FE(annotation_name, query_set, bg_set, annotation[annotation_name])
-        if (pval is None):
-            pval = 1
-        result.append((annotation_name, in_set, in_annotation, pval))
-    
-    # Pandas makes easy to work with the table.
-    df:pd.DataFrame = pd.DataFrame(result, columns=["name","Compund-in-set","Compound-in-annotation", "pval"])
-    df["pval"] = df["pval"].astype(float)
-    logging.info(df)
-    df["FDR"] = scipy.stats.false_discovery_control(df["pval"])
-    if (not args.all):
-        df:pd.DataFrame = df[df["FDR"] < args.pval]
-    df.to_csv(args.output, index=False)
+    logger.info(f"Categories selected: {args.annotation}")
+    with metrics.stage("categories") as stage:
+        # A single read-only connection is shared by every query of the run
+        store = mbrole.annotation.AnnotationStore(args.db_file, args.table)
+        snapshot: mbrole.incidence.AnnotationMatrix = None
+        if args.engine == "batch":
+            snapshot = mbrole.snapshot.load_snapshot(args.db_file, args.table)
+        stage.count(snapshot=snapshot is not None)
+    if args.organism and args.organism not in store.organisms():
+        logger.error(f"No background for organism {args.organism} in {args.db_file}. Available: {', '.join(sorted(store.organisms())) or 'none'}")
+        sys.exit(1)
+    if args.id_type != "exact":
+        with metrics.stage("identifiers") as stage:
+            queries = translate_queries(queries, store, args.id_type, logger)
+            stage.count(compounds=sum(len(x) for x in queries.values()))
+        if all(len(x) == 0 for x in queries.values()):
+            logger.error(f"No identifier of {args.compound or args.batch} found in {args.db_file}")
+            sys.exit(1)
+    annotation = None
+    with metrics.stage("annotation") as stage:
+        if args.engine == "batch":
+            annotation: mbrole.incidence.AnnotationMatrix = load_annotation_matrix(args, logger, store, snapshot)
+            logger.info(f"Analyzing {len(annotation)} categories")
+            stage.count(categories=len(annotation))
+        elif args.engine == "loop":
+            annotation: dict = load_annotation(args, logger, store)
+            logger.info(f"Analyzing {len(annotation)} categories")
+            stage.count(categories=len(annotation))
+
+    # Now we need to get the background set. The get_bg_set either parses the file given, reads the background
+    # of the organism stored in the db or uses the FULL SQLITE DATABASE as background
+    with metrics.stage("background") as stage:
+        if args.engine == "sql" and not (args.background or args.organism):
+            # The full database background is computed inside SQLite
+            bg_set:set = None
+        else:
+            bg_set:set = get_bg_set(args.background, store, snapshot, args.organism)
+            if args.background and args.id_type != "exact":
+                bg_set = translate_set("Background", bg_set, store, args.id_type, logger)
+        stage.count(compounds=len(bg_set) if bg_set is not None else None)
+
+    # Performing the FE: raw p-values of each query, corrected and filtered afterwards
+    raw: dict = dict()
+    cache: mbrole.functional_enrichment.PValueCache = load_pvalue_cache(args)
+    with metrics.stage("enrichment") as stage:
+        if args.engine == "batch":
+            tested: mbrole.incidence.AnnotationMatrix = annotation
+            if args.dedup:
+                # Each distinct compound set is tested once, and its result given to all its categories
+                rows, inverse = mbrole.redundancy.deduplicate(annotation)
+                tested = annotation.select(rows)
+                logger.info(f"Testing {len(rows)} distinct compound sets of {len(annotation)} categories")
+                stage.count(distinct=len(rows))
+            if args.workers > 1:
+                _, in_set, _, pvals = mbrole.parallel.parallel_functional_enrichment(list(queries.values()), tested, bg_set, args.workers,
+                                                                                     prune=pruning_threshold(args))
+            else:
+                _, in_set, _, pvals = mbrole.functional_enrichment.multi_query_functional_enrichment(list(queries.values()), tested, bg_set, cache=cache,
+                                                                                                     prune=pruning_threshold(args))
+            if args.dedup:
+                in_set, pvals = in_set[inverse], pvals[inverse]
+            names, in_annotation = annotation.names, annotation.sizes
+            for i, name in enumerate(queries):
+                raw[name] = (names, in_set[:, i], in_annotation, pvals[:, i])
+        elif args.engine == "sql":
+            if args.dedup:
+                logger.warning("--dedup is only available with the batch and loop engines, ignoring it")
+            for name, query_set in queries.items():
+                raw[name] = mbrole.functional_enrichment.sql_functional_enrichment(store.conn, args.table, query_set, bg_set, args.database, args.annotation, cache=cache,
+                                                                                   prune=pruning_threshold(args), min_size=args.min_size, max_size=args.max_size)
+                logger.info(f"Analyzed {len(raw[name][0])} categories for {name}")
+        else:
+            import tqdm
+            for name, query_set in queries.items():
+                #result = list(map(lambda x: _perform_FE(x, query_set, bg_set, annotation[x]), tqdm.tqdm(annotation.keys())))
+                result: list = list()
+                # With --dedup, p-values and overlaps by compound set, tested once
+                tested: dict = dict()
+                for annotation_name in tqdm.tqdm(annotation.keys()):
+                    key: frozenset = frozenset(annotation[annotation_name]) if args.dedup else annotation_name
+                    if key not in tested:
+                        tested[key] = _perform_FE(annotation_name, query_set, bg_set, annotation[annotation_name])
+                    pval, in_set, _ = tested[key]
+                    in_annotation = len(annotation[annotation_name])
+                    if (pval is None):
+                        pval = 1
+                    result.append((annotation_name, in_set, in_annotation, pval))
+                raw[name] = tuple(zip(*result)) if result else ([], [], [], [])
+        stage.count(tests=sum(len(x[0]) for x in raw.values()))
+        if cache is not None:
+            stage.count(cache_hits=cache.hits, cache_misses=cache.misses)
+            logger.info(f"p-value cache: {cache.hits} hits, {cache.misses} misses")
+            if args.pval_cache:
+                cache.save(args.pval_cache)
+    permutation: dict = dict()
+    if args.permutations > 0 and args.engine == "batch":
+        with metrics.stage("permutation") as stage:
+            import numpy as np
+            # One independent stream of draws per query, all derived from --seed
+            seeds: list = np.random.SeedSequence(args.seed).spawn(len(queries))
+            for seed, (name, query_set) in zip(seeds, queries.items()):
+                logger.info(f"Running {args.permutations} permutations for {name}")
+                permutation[name] = mbrole.permutation.permutation_enrichment(query_set, annotation, bg_set, args.permutations, seed, args.workers)
+            stage.count(permutations=args.permutations * len(queries))
+    elif args.permutations > 0:
+        logger.warning("--permutations is only available with the batch engine, ignoring it")
+    clusters = None
+    if args.cluster_jaccard is not None and args.engine != "sql":
+        with metrics.stage("clusters") as stage:
+            matrix: mbrole.incidence.AnnotationMatrix = annotation
+            if args.engine == "loop":
+                matrix = mbrole.incidence.AnnotationMatrix.from_dict(annotation).for_annotations(list(annotation))
+            clusters = mbrole.redundancy.cluster_categories(matrix, args.cluster_jaccard)
+            stage.count(clusters=int(clusters.max()) + 1 if len(clusters) else 0)
+    elif args.cluster_jaccard is not None:
+        logger.warning("--cluster-jaccard is only available with the batch and loop engines, ignoring it")
+    with metrics.stage("fdr") as stage:
+        results: dict = {name: result_table(*values, args, permutation.get(name), overlap_function(args, annotation, store, queries[name]) if args.overlaps else None, clusters)
+                         for name, values in raw.items()}
+        stage.count(significant=sum(len(x["name"]) for x in results.values()))
+    store.close()
+    with metrics.stage("write") as stage:
+        write_results(results, args)
+        stage.count(rows=sum(len(x["name"]) for x in results.values()))
+    if args.profile:
+        metrics.dump_profile(args.profile)
+    if args.tracemalloc:
+        metrics.dump_tracemalloc(args.tracemalloc)
+    if args.metrics_out:
+        metrics.write(args.metrics_out)
   
 if __name__ == "__main__":
     main()
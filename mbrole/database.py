@@ -0,0 +1,508 @@
+#! /usr/bin/env python3
+
+"""
+    Schema of the mbrole SQLite database.
+
+    Loaders and queries share this layout, so every database file is built the same way.
+    Categories are normalised into a lookup table with integer keys:
+
+        - {table}_categories: id, database, annotation, category, content_hash. One row per category.
+        - {table}_compounds: compound, category_id, url. One row per compound annotated in a category.
+        - {table}_sources: database, version, generation, updated. One row per source database,
+          with the release loaded and a counter increased every time its rows change.
+        - {table}_backgrounds: organism, compound. The compounds of each organism, used as background.
+        - {table}_background_sizes: organism, size. Number of compounds of each background.
+        - {table}_id_map: alias, namespace, compound, source. Identifiers of other namespaces (ChEBI, HMDB,
+          KEGG, PubChem, InChIKey, CAS, names) of the compounds, as given by the cross-references of each source.
+
+    A view named as the table joins both, with the columns every query uses:
+    compound, annotation, category, database, url (and the rowid of the compound row).
+    Inserting into the view is also possible, through an INSTEAD OF trigger.
+
+    Indexes:
+        - {table}_categories (database, annotation, category): unique, finds categories by source and name.
+        - {table}_compounds (category_id, compound): unique, the compounds of a category.
+        - {table}_compounds (compound, category_id): the categories of a compound.
+        - {table}_id_map (alias, namespace, compound, source): primary key, finds the compounds of an alias.
+
+    The schema version is stored in PRAGMA user_version.
+
+    New releases of a source are loaded with sync_source: rows are streamed into a TEMP staging table,
+    categories are compared by the hash of their compounds one at a time, and only those that changed
+    are rewritten, in a single transaction.
+"""
+
+import contextlib
+import hashlib
+import itertools
+import logging
+import sqlite3
+import time
+
+from mbrole import identifiers
+
+SCHEMA_VERSION = 2
+DEFAULT_TABLE = "mbrole"
+COLUMNS = ("compound", "annotation", "category", "database", "url")
+
+def categories_table(table: str) -> str:
+    return f"{table}_categories"
+
+def compounds_table(table: str) -> str:
+    return f"{table}_compounds"
+
+def sources_table(table: str) -> str:
+    return f"{table}_sources"
+
+def backgrounds_table(table: str) -> str:
+    return f"{table}_backgrounds"
+
+def background_sizes_table(table: str) -> str:
+    return f"{table}_background_sizes"
+
+def id_map_table(table: str) -> str:
+    return f"{table}_id_map"
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version;").fetchone()[0]
+
+def object_type(conn: sqlite3.Connection, name: str) -> str:
+    """
+        Type of a schema object: "table", "view", "index", "trigger" or None if it does not exist
+    """
+    row = conn.execute("SELECT type FROM sqlite_master WHERE name = ?;", (name,)).fetchone()
+    return row[0] if row else None
+
+def is_normalised(conn: sqlite3.Connection, table: str = DEFAULT_TABLE) -> bool:
+    """
+        Whether the table follows this schema, or is a plain table from older loaders
+    """
+    return object_type(conn, table) == "view" and object_type(conn, categories_table(table)) == "table"
+
+def create_indexes(conn: sqlite3.Connection, table: str = DEFAULT_TABLE) -> None:
+    """
+        Creates the indexes of the schema. For plain tables of older loaders, creates
+        the equivalent covering indexes on their columns.
+    """
+    if is_normalised(conn, table):
+        conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {categories_table(table)}_source ON {categories_table(table)} (database, annotation, category);")
+        conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {compounds_table(table)}_category ON {compounds_table(table)} (category_id, compound);")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {compounds_table(table)}_compound ON {compounds_table(table)} (compound, category_id);")
+    else:
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_source ON {table} (database, annotation, compound);")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_compound ON {table} (compound);")
+
+def drop_indexes(conn: sqlite3.Connection, table: str = DEFAULT_TABLE) -> None:
+    """
+        Drops the indexes of the compound rows, so bulk loads do not update them on every row
+        (the unique index of the categories is kept, it is needed to find them).
+    """
+    conn.execute(f"DROP INDEX IF EXISTS {compounds_table(table)}_category;")
+    conn.execute(f"DROP INDEX IF EXISTS {compounds_table(table)}_compound;")
+
+def create_schema(conn: sqlite3.Connection, table: str = DEFAULT_TABLE, indexes: bool = True) -> None:
+    """
+        Creates the tables, view, trigger and indexes of the schema, if they do not exist.
+        A plain table with the same name, from older loaders, is migrated (see migrate_legacy_table).
+    """
+    if object_type(conn, table) == "table":
+        return migrate_legacy_table(conn, table)
+    conn.execute(f"""CREATE TABLE IF NOT EXISTS {categories_table(table)} (
+                        id INTEGER PRIMARY KEY,
+                        database TEXT NOT NULL,
+                        annotation TEXT NOT NULL,
+                        category TEXT NOT NULL DEFAULT '',
+                        content_hash TEXT);""")
+    # Tables of schema version 1 have no content hash
+    if "content_hash" not in {x[1] for x in conn.execute(f"PRAGMA table_info({categories_table(table)});")}:
+        conn.execute(f"ALTER TABLE {categories_table(table)} ADD COLUMN content_hash TEXT;")
+    conn.execute(f"""CREATE TABLE IF NOT EXISTS {sources_table(table)} (
+                        database TEXT PRIMARY KEY,
+                        version TEXT,
+                        generation INTEGER NOT NULL DEFAULT 0,
+                        updated TEXT);""")
+    conn.execute(f"""CREATE TABLE IF NOT EXISTS {backgrounds_table(table)} (
+                        organism TEXT NOT NULL,
+                        compound TEXT NOT NULL,
+                        PRIMARY KEY (organism, compound)) WITHOUT ROWID;""")
+    conn.execute(f"""CREATE TABLE IF NOT EXISTS {background_sizes_table(table)} (
+                        organism TEXT PRIMARY KEY,
+                        size INTEGER NOT NULL);""")
+    conn.execute(f"""CREATE TABLE IF NOT EXISTS {id_map_table(table)} (
+                        alias TEXT NOT NULL,
+                        namespace TEXT NOT NULL,
+                        compound TEXT NOT NULL,
+                        source TEXT NOT NULL,
+                        PRIMARY KEY (alias, namespace, compound, source)) WITHOUT ROWID;""")
+    conn.execute(f"""CREATE TABLE IF NOT EXISTS {compounds_table(table)} (
+                        compound TEXT NOT NULL,
+                        category_id INTEGER NOT NULL REFERENCES {categories_table(table)} (id),
+                        url TEXT);""")
+    conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {categories_table(table)}_source ON {categories_table(table)} (database, annotation, category);")
+    conn.execute(f"""CREATE VIEW IF NOT EXISTS {table} AS
+                        SELECT c.compound AS compound, g.annotation AS annotation, g.category AS category, g.database AS database, c.url AS url, c.rowid AS rowid
+                        FROM {compounds_table(table)} AS c JOIN {categories_table(table)} AS g ON g.id = c.category_id;""")
+    conn.execute(f"""CREATE TRIGGER IF NOT EXISTS {table}_insert INSTEAD OF INSERT ON {table}
+                     BEGIN
+                        INSERT OR IGNORE INTO {categories_table(table)} (database, annotation, category)
+                            VALUES (NEW.database, NEW.annotation, COALESCE(NEW.category, ''));
+                        INSERT OR IGNORE INTO {compounds_table(table)} (compound, category_id, url)
+                            SELECT NEW.compound, id, NEW.url FROM {categories_table(table)}
+                            WHERE database = NEW.database AND annotation = NEW.annotation AND category = COALESCE(NEW.category, '');
+                     END;""")
+    if indexes:
+        create_indexes(conn, table)
+    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION};")
+    conn.commit()
+
+def migrate_legacy_table(conn: sqlite3.Connection, table: str = DEFAULT_TABLE) -> None:
+    """
+        Moves the rows of a plain table created by older loaders into the schema.
+        Missing columns (category, url) are left empty and repeated rows are stored once.
+        Tables are expected to have, at least, compound (or id), annotation and database columns.
+    """
+    columns: set = {x[1].lower() for x in conn.execute(f"PRAGMA table_info({table});")}
+    logging.info(f"Migrating table {table} with columns {sorted(columns)} to schema version {SCHEMA_VERSION}")
+    legacy: str = f"{table}_legacy"
+    conn.execute(f"ALTER TABLE {table} RENAME TO {legacy};")
+    create_schema(conn, table, indexes=False)
+    # Older Reactome tables named the compound column id
+    compound: str = "l.compound" if "compound" in columns else "l.id"
+    category: str = "COALESCE(l.category, '')" if "category" in columns else "''"
+    url: str = "l.url" if "url" in columns else "NULL"
+    conn.execute(f"""INSERT OR IGNORE INTO {categories_table(table)} (database, annotation, category)
+                     SELECT l.database, l.annotation, {category} FROM {legacy} AS l ORDER BY l.rowid;""")
+    conn.execute(f"""INSERT INTO {compounds_table(table)} (compound, category_id, url)
+                     SELECT {compound}, g.id, MIN({url}) FROM {legacy} AS l JOIN {categories_table(table)} AS g
+                     ON g.database = l.database AND g.annotation = l.annotation AND g.category = {category}
+                     GROUP BY {compound}, g.id ORDER BY MIN(l.rowid);""")
+    conn.execute(f"DROP TABLE {legacy};")
+    create_indexes(conn, table)
+    conn.commit()
+    analyze(conn)
+
+def source_table(conn: sqlite3.Connection, table: str = DEFAULT_TABLE) -> str:
+    """
+        Table to read the (database, annotation) pairs from, without reading every compound row
+    """
+    return categories_table(table) if is_normalised(conn, table) else table
+
+def category_rows(conn: sqlite3.Connection, table: str = DEFAULT_TABLE) -> str:
+    """
+        Rows of the table (compound, annotation, database...) with the position of their category, to be used in a FROM clause.
+        Categories are ordered by their id in normalised tables, and by their first row in plain tables of older loaders.
+        Every engine reads the categories in this order (see database_order).
+    """
+    if is_normalised(conn, table):
+        return (f"(SELECT c.compound AS compound, g.annotation AS annotation, g.category AS category, g.database AS database, c.url AS url, g.id AS position "
+                f"FROM {compounds_table(table)} AS c JOIN {categories_table(table)} AS g ON g.id = c.category_id)")
+    return f"(SELECT *, rowid AS position FROM {table})"
+
+def database_order(conn: sqlite3.Connection, table: str = DEFAULT_TABLE) -> list[str]:
+    """
+        Source databases of the table, in the order of their first category (see category_rows).
+        It is the order the engines merge annotation names repeated across databases in, when no databases are given.
+    """
+    if is_normalised(conn, table):
+        SQL = f"SELECT database FROM {categories_table(table)} GROUP BY database ORDER BY MIN(id);"
+    else:
+        SQL = f"SELECT database FROM {table} GROUP BY database ORDER BY MIN(rowid);"
+    logging.debug(SQL)
+    return [x[0] for x in conn.execute(SQL)]
+
+def merge_categories(categories: list, databases: list) -> list[int]:
+    """
+        Keeps one category per annotation name, as merging the dicts of get_genes_per_category of the databases in order:
+        the name is taken from the last of the databases it is in, and keeps the position of its first category
+        in the first of them. Categories are (database, annotation) pairs in the order of category_rows,
+        those of other databases are left out.
+
+        Returns the indices of the categories kept, in order.
+    """
+    order: dict = {database: i for i, database in enumerate(databases)}
+    winners: dict = {}
+    first_seen: dict = {}
+    for i, (database, annotation) in enumerate(categories):
+        if database not in order:
+            continue
+        rank: tuple = (order[database], i)
+        first_seen[annotation] = min(first_seen.get(annotation, rank), rank)
+        if annotation not in winners or order[database] >= order[categories[winners[annotation]][0]]:
+            winners[annotation] = i
+    return [winners[x] for x in sorted(winners, key=first_seen.get)]
+
+def analyze(conn: sqlite3.Connection) -> None:
+    """
+        Updates the statistics the query planner uses to choose indexes
+    """
+    conn.execute("ANALYZE;")
+    conn.commit()
+
+def source_generations(conn: sqlite3.Connection, table: str = DEFAULT_TABLE) -> dict[str, int]:
+    """
+        Generation of each source database: it changes every time the rows of the source do
+    """
+    if object_type(conn, sources_table(table)) != "table":
+        return {}
+    return dict(conn.execute(f"SELECT database, generation FROM {sources_table(table)};"))
+
+def source_versions(conn: sqlite3.Connection, table: str = DEFAULT_TABLE) -> dict[str, str]:
+    """
+        Release of each source database, as given when it was loaded
+    """
+    if object_type(conn, sources_table(table)) != "table":
+        return {}
+    return dict(conn.execute(f"SELECT database, version FROM {sources_table(table)};"))
+
+def _touch_sources(conn: sqlite3.Connection, table: str, databases, version: str = None, changed: set = None) -> None:
+    """
+        Increases the generation of the source databases that changed (all of them if None)
+        and records their version (if given)
+    """
+    conn.executemany(f"""INSERT INTO {sources_table(table)} (database, version, generation, updated) VALUES (?, ?, ?, datetime('now'))
+                         ON CONFLICT (database) DO UPDATE SET version = COALESCE(excluded.version, version),
+                         generation = generation + excluded.generation, updated = excluded.updated;""",
+                     ((x, version, int(changed is None or x in changed)) for x in databases))
+
+@contextlib.contextmanager
+def _relaxed_durability(conn: sqlite3.Connection):
+    """
+        Relaxes journal and sync during a load, restoring them afterwards
+    """
+    journal_mode: str = conn.execute("PRAGMA journal_mode;").fetchone()[0]
+    synchronous: int = conn.execute("PRAGMA synchronous;").fetchone()[0]
+    conn.execute("PRAGMA journal_mode = MEMORY;")
+    conn.execute("PRAGMA synchronous = OFF;")
+    conn.execute("PRAGMA cache_size = -262144;") # 256 MB
+    try:
+        yield
+    finally:
+        conn.execute(f"PRAGMA journal_mode = {journal_mode};")
+        conn.execute(f"PRAGMA synchronous = {synchronous};")
+
+def _load_category_ids(conn: sqlite3.Connection, table: str) -> dict:
+    return {(database, annotation, category): id for id, database, annotation, category in conn.execute(f"SELECT id, database, annotation, category FROM {categories_table(table)};")}
+
+def bulk_insert(conn: sqlite3.Connection, rows, table: str = DEFAULT_TABLE, batch_size: int = 100000) -> int:
+    """
+        Inserts (compound, annotation, category, database, url) rows in batches, inside a single transaction.
+
+        During the load, journal and sync are relaxed. When the table is empty, the indexes of the
+        compound rows are dropped, so they are built once after the data is in. Repeated rows
+        are stored once. Progress is logged in rows per second.
+
+        Rows are appended: use sync_source to replace a source with a new release. The content hash
+        of the categories of the sources loaded is cleared, and their generation increased.
+
+        Returns the number of rows read.
+    """
+    create_schema(conn, table)
+    conn.commit()
+    category_ids: dict = _load_category_ids(conn, table)
+    insert_category: str = f"INSERT INTO {categories_table(table)} (database, annotation, category) VALUES (?, ?, ?);"
+    # Rebuilding the indexes only pays off when loading into an empty table.
+    # Otherwise, the unique index discards repeated rows as they come.
+    empty: bool = conn.execute(f"SELECT NOT EXISTS (SELECT 1 FROM {compounds_table(table)});").fetchone()[0]
+    insert_compound: str = f"INSERT {'' if empty else 'OR IGNORE '}INTO {compounds_table(table)} (compound, category_id, url) VALUES (?, ?, ?);"
+    start: float = time.perf_counter()
+    total: int = 0
+    databases: set = set()
+    with _relaxed_durability(conn):
+        try:
+            if empty:
+                drop_indexes(conn, table)
+            cursor = conn.cursor()
+            iterator = iter(rows)
+            while batch := list(itertools.islice(iterator, batch_size)):
+                values: list = []
+                for compound, annotation, category, database, url in batch:
+                    key: tuple = (database, annotation, category or "")
+                    if key not in category_ids:
+                        cursor.execute(insert_category, key)
+                        category_ids[key] = cursor.lastrowid
+                    values.append((compound, category_ids[key], url))
+                    databases.add(database)
+                cursor.executemany(insert_compound, values)
+                total += len(values)
+                logging.info(f"Inserted {total} rows into {table}: {total / (time.perf_counter() - start):.0f} rows/s")
+            if empty:
+                # Keep the first of repeated rows, so the unique index can be built
+                conn.execute(f"DELETE FROM {compounds_table(table)} WHERE rowid NOT IN (SELECT MIN(rowid) FROM {compounds_table(table)} GROUP BY category_id, compound);")
+                create_indexes(conn, table)
+            # Appended categories no longer match their hash
+            conn.executemany(f"UPDATE {categories_table(table)} SET content_hash = NULL WHERE database = ?;", ((x,) for x in databases))
+            _touch_sources(conn, table, databases)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            create_indexes(conn, table)
+            raise
+    analyze(conn)
+    elapsed: float = time.perf_counter() - start
+    logging.info(f"Loaded {total} rows into {table} in {elapsed:.1f} s ({total / max(elapsed, 1e-9):.0f} rows/s)")
+    return total
+
+def content_hash(compounds: dict) -> str:
+    """
+        Hash of the compounds of a category and their urls (a dict compound -> url), whatever their order
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for compound in sorted(compounds):
+        digest.update(f"{compound}\t{compounds[compound] or ''}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+def staging_table(table: str) -> str:
+    return f"temp.{table}_staging"
+
+def _stage_rows(conn: sqlite3.Connection, rows, table: str, databases: list = None, batch_size: int = 100000) -> int:
+    """
+        Streams (compound, annotation, category, database, url) rows into a TEMP staging table, in batches,
+        with a unique index by category and compound: repeated rows are stored once, with the first url.
+        The staging table lives in the temp store of SQLite, on disk for large releases.
+
+        Returns the number of rows read.
+    """
+    conn.execute(f"DROP TABLE IF EXISTS {staging_table(table)};")
+    conn.execute(f"""CREATE TABLE {staging_table(table)} (
+                        database TEXT NOT NULL,
+                        annotation TEXT NOT NULL,
+                        category TEXT NOT NULL,
+                        compound TEXT NOT NULL,
+                        url TEXT,
+                        PRIMARY KEY (database, annotation, category, compound));""")
+    insert: str = f"INSERT OR IGNORE INTO {staging_table(table)} (database, annotation, category, compound, url) VALUES (?, ?, ?, ?, ?);"
+    total: int = 0
+    iterator = iter(rows)
+    while batch := list(itertools.islice(iterator, batch_size)):
+        for compound, annotation, category, database, url in batch:
+            if databases is not None and database not in databases:
+                raise ValueError(f"Row of database {database}, not one of the synced sources: {databases}")
+        conn.executemany(insert, ((database, annotation, category or "", compound, url) for compound, annotation, category, database, url in batch))
+        total += len(batch)
+        logging.debug(f"Staged {total} rows into {staging_table(table)}")
+    return total
+
+def _staged_categories(conn: sqlite3.Connection, table: str):
+    """
+        Categories of the staging table, one at a time, as (database, annotation, category), {compound: url}.
+        Rows are read in index order, so only the compounds of one category are held in memory.
+    """
+    cursor = conn.execute(f"SELECT database, annotation, category, compound, url FROM {staging_table(table)} ORDER BY database, annotation, category, compound;")
+    for key, group in itertools.groupby(cursor, key=lambda x: x[:3]):
+        yield key, {compound: url for _, _, _, compound, url in group}
+
+def sync_source(conn: sqlite3.Connection, rows, table: str = DEFAULT_TABLE, version: str = None, databases: list = None, batch_size: int = 100000) -> dict[str, int]:
+    """
+        Replaces the rows of source databases with a new release, given as (compound, annotation, category, database, url) rows.
+
+        The databases synced are the given ones, or those found in rows if None: categories of these databases
+        missing from rows are deleted. Rows are streamed into a TEMP staging table (see _stage_rows), then read back
+        one category at a time and compared with the stored ones by their content hash: only new and changed
+        categories are written. Changes are applied in a single transaction, which also records the version of the
+        release and, if anything changed, increases the generation of the source, so snapshots compiled before
+        are only stale for the sources that changed.
+
+        Repeated rows are stored once, with the first url.
+
+        Returns the number of rows read and of categories added, removed, changed and unchanged.
+    """
+    create_schema(conn, table)
+    conn.commit()
+    counts: dict = {"rows": 0, "added": 0, "removed": 0, "changed": 0, "unchanged": 0}
+    changed: set = set()
+    empty: bool = conn.execute(f"SELECT NOT EXISTS (SELECT 1 FROM {compounds_table(table)});").fetchone()[0]
+    start: float = time.perf_counter()
+    with _relaxed_durability(conn):
+        try:
+            counts["rows"] = _stage_rows(conn, rows, table, databases, batch_size)
+            synced: list = list(databases) if databases is not None else \
+                           [x[0] for x in conn.execute(f"SELECT DISTINCT database FROM {staging_table(table)} ORDER BY database;")]
+            if empty:
+                drop_indexes(conn, table)
+            cursor = conn.cursor()
+            for database in synced:
+                removed: list = conn.execute(f"""SELECT id FROM {categories_table(table)} AS g WHERE database = ? AND NOT EXISTS
+                                                 (SELECT 1 FROM {staging_table(table)} AS s
+                                                  WHERE s.database = g.database AND s.annotation = g.annotation AND s.category = g.category);""",
+                                             (database,)).fetchall()
+                cursor.executemany(f"DELETE FROM {compounds_table(table)} WHERE category_id = ?;", removed)
+                cursor.executemany(f"DELETE FROM {categories_table(table)} WHERE id = ?;", removed)
+                counts["removed"] += len(removed)
+                if removed:
+                    changed.add(database)
+            SQL = f"SELECT id, content_hash FROM {categories_table(table)} WHERE database = ? AND annotation = ? AND category = ?;"
+            for key, compounds in _staged_categories(conn, table):
+                digest: str = content_hash(compounds)
+                stored = cursor.execute(SQL, key).fetchone()
+                if stored is not None:
+                    id, stored_digest = stored
+                    if stored_digest == digest:
+                        counts["unchanged"] += 1
+                        continue
+                    cursor.execute(f"DELETE FROM {compounds_table(table)} WHERE category_id = ?;", (id,))
+                    cursor.execute(f"UPDATE {categories_table(table)} SET content_hash = ? WHERE id = ?;", (digest, id))
+                    counts["changed"] += 1
+                else:
+                    cursor.execute(f"INSERT INTO {categories_table(table)} (database, annotation, category, content_hash) VALUES (?, ?, ?, ?);", key + (digest,))
+                    id = cursor.lastrowid
+                    counts["added"] += 1
+                changed.add(key[0])
+                cursor.executemany(f"INSERT INTO {compounds_table(table)} (compound, category_id, url) VALUES (?, ?, ?);",
+                                   ((compound, id, url) for compound, url in compounds.items()))
+            if empty:
+                create_indexes(conn, table)
+            _touch_sources(conn, table, synced, version, changed)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            create_indexes(conn, table)
+            raise
+        finally:
+            conn.execute(f"DROP TABLE IF EXISTS {staging_table(table)};")
+            conn.commit()
+    analyze(conn)
+    logging.info(f"Synced {', '.join(synced)} into {table} in {time.perf_counter() - start:.1f} s: {counts}")
+    return counts
+
+def store_background(conn: sqlite3.Connection, organism: str, compounds, table: str = DEFAULT_TABLE) -> int:
+    """
+        Replaces the background of an organism with the given compounds, in a single transaction,
+        and caches its size. Returns the number of compounds stored.
+    """
+    create_schema(conn, table)
+    try:
+        conn.execute(f"DELETE FROM {backgrounds_table(table)} WHERE organism = ?;", (organism,))
+        conn.executemany(f"INSERT OR IGNORE INTO {backgrounds_table(table)} (organism, compound) VALUES (?, ?);", ((organism, x) for x in compounds))
+        size: int = conn.execute(f"SELECT COUNT(*) FROM {backgrounds_table(table)} WHERE organism = ?;", (organism,)).fetchone()[0]
+        conn.execute(f"INSERT OR REPLACE INTO {background_sizes_table(table)} (organism, size) VALUES (?, ?);", (organism, size))
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    logging.info(f"Stored a background of {size} compounds for {organism}")
+    return size
+
+def store_id_map(conn: sqlite3.Connection, rows, source: str, table: str = DEFAULT_TABLE) -> int:
+    """
+        Replaces the identifier map given by a source with (namespace, alias, compound) rows, in a single transaction.
+        Aliases are stored in the normal form of their namespace (see mbrole.identifiers), so queries written
+        in any form find them. Rows of unknown namespaces or without alias are skipped.
+
+        Returns the number of rows stored.
+    """
+    create_schema(conn, table)
+    conn.commit()
+    values = ((identifiers.normalize(namespace, alias), namespace, compound, source) for namespace, alias, compound in rows
+              if namespace in identifiers.NORMALIZERS and alias and alias.strip())
+    with _relaxed_durability(conn):
+        try:
+            conn.execute(f"DELETE FROM {id_map_table(table)} WHERE source = ?;", (source,))
+            conn.executemany(f"INSERT OR IGNORE INTO {id_map_table(table)} (alias, namespace, compound, source) VALUES (?, ?, ?, ?);", values)
+            total: int = conn.execute(f"SELECT COUNT(*) FROM {id_map_table(table)} WHERE source = ?;", (source,)).fetchone()[0]
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    analyze(conn)
+    logging.info(f"Stored {total} identifiers of {source} in {id_map_table(table)}")
+    return total
@@ -2,38 +2,42 @@
 
 import numpy as np
 import scipy
+import scipy.special
 import scipy.stats
 import sqlite3
 
 import logging
 import collections
 
+from mbrole.database import DEFAULT_TABLE, category_rows, database_order, merge_categories, source_table
+from mbrole.incidence import AnnotationMatrix
 
-def get_category_compounds(conn: sqlite3.Connection, category: str) -> list[str]:
-    SQL = f"SELECT compound FROM mbrole WHERE annotation=\"{category}\""
+
+def get_category_compounds(conn: sqlite3.Connection, category: str, table: str = DEFAULT_TABLE) -> list[str]:
+    SQL = f"SELECT compound FROM {table} WHERE annotation = ?;"
     cursor = conn.cursor()
-    cursor.execute(SQL)
+    cursor.execute(SQL, (category,))
     return {x[0] for x in cursor.fetchall()}
 
 def get_all_categories_from_db(conn: sqlite3.Connection, table:str):
-    SQL = f"SELECT DISTINCT annotation FROM {table};"
+    SQL = f"SELECT DISTINCT annotation FROM {source_table(conn, table)};"
     #logging.debug(SQL)
     cursor = conn.cursor()
     cursor.execute(SQL)
     return [x[0] for x in cursor.fetchall()]
 
 def get_categories_from_db(conn: sqlite3.Connection, table: str, db:str, annotation:str) -> set:
-    SQL = f"SELECT compound FROM {table} WHERE database=\"{db}\" AND annotation=\"{annotation.lower()}\";"
+    SQL = f"SELECT compound FROM {table} WHERE database = ? AND annotation = ?;"
     #logging.debug(SQL)
     cursor = conn.cursor()
-    cursor.execute(SQL)
+    cursor.execute(SQL, (db, annotation.lower()))
     return {x[0] for x in cursor.fetchall()}
 
 def get_genes_per_category(conn, table, db):
-    SQL = f"SELECT * FROM {table} WHERE database=\"{db}\";"
+    SQL = f"SELECT compound, annotation FROM {table} WHERE database = ?;"
     #logging.debug(SQL)
     cursor = conn.cursor()
-    cursor.execute(SQL)
+    cursor.execute(SQL, (db,))
     categories = collections.defaultdict(list)
     for compound in cursor.fetchall():
         #logging.debug(compound)
@@ -51,6 +55,81 @@ def get_background_genes_from_db(conn: sqlite3.Connection, table:str):
     return {x[0] for x in cursor.fetchall()}
 
 
+def _load_temp_set(conn: sqlite3.Connection, name: str, compounds: set) -> None:
+    conn.execute(f"DROP TABLE IF EXISTS temp.{name};")
+    conn.execute(f"CREATE TEMP TABLE {name} (compound TEXT PRIMARY KEY) WITHOUT ROWID;")
+    conn.executemany(f"INSERT OR IGNORE INTO temp.{name} (compound) VALUES (?);", ((x,) for x in compounds))
+
+def get_overlap_counts_from_db(conn: sqlite3.Connection, table: str, genes_in_query: set, background: set = None, databases: list = None, annotations: list = None) -> tuple[list, np.ndarray, np.ndarray, np.ndarray, int]:
+    """
+        Computes the overlap counts of every category inside SQLite, so only one row
+        per category is transferred instead of every (compound, annotation) row.
+
+        The query and the background are loaded into TEMP tables and joined with the annotation
+        in a single GROUP BY query. If background is None, all the compounds of the table are used.
+
+        Categories are selected as in the other engines: by annotation name (merging databases) if
+        annotations is given, or else by database, keeping annotation names repeated across databases
+        from the last database given (see mbrole.database.merge_categories).
+
+        Returns the category names, the compounds of the query in each category, the compounds of the
+        background in each category, the size of each category and the size of the background.
+    """
+    _load_temp_set(conn, "mbrole_query", genes_in_query)
+    if background is None:
+        background_size: int = conn.execute(f"SELECT COUNT(DISTINCT compound) FROM {table};").fetchone()[0]
+        background_join: str = ""
+        background_count: str = "COUNT(DISTINCT m.compound)"
+    else:
+        _load_temp_set(conn, "mbrole_background", background)
+        background_size: int = len(background)
+        background_join: str = "LEFT JOIN temp.mbrole_background AS b ON b.compound = m.compound"
+        background_count: str = "COUNT(DISTINCT b.compound)"
+    if annotations:
+        group: str = "m.annotation"
+        where: str = f"m.annotation IN ({','.join('?' * len(annotations))})"
+        parameters: list = list(annotations)
+    else:
+        group: str = "m.database, m.annotation"
+        where: str = f"m.database IN ({','.join('?' * len(databases))})" if databases else "1"
+        parameters: list = list(databases or [])
+    SQL = (f"SELECT {'NULL' if annotations else 'm.database'}, m.annotation, COUNT(DISTINCT q.compound), {background_count}, COUNT(DISTINCT m.compound) "
+           f"FROM {category_rows(conn, table)} AS m LEFT JOIN temp.mbrole_query AS q ON q.compound = m.compound {background_join} "
+           f"WHERE {where} GROUP BY {group} ORDER BY MIN(m.position);")
+    logging.debug(SQL)
+    rows: list = conn.execute(SQL, parameters).fetchall()
+    if annotations:
+        counts: dict = {x[1]: x[2:5] for x in rows}
+        names: list = list(annotations)
+    else:
+        kept: list = merge_categories([x[:2] for x in rows], databases or database_order(conn, table))
+        names: list = [rows[i][1] for i in kept]
+        counts: dict = {rows[i][1]: rows[i][2:5] for i in kept}
+    in_query, in_background, sizes = (np.array([counts.get(x, (0, 0, 0))[i] for x in names], dtype=np.int64) for i in range(3))
+    return names, in_query, in_background, sizes, background_size
+
+def sql_functional_enrichment(conn: sqlite3.Connection, table: str, genes_in_query: set, background: set = None, databases: list = None, annotations: list = None, alternative: str = "two-sided", cache: "PValueCache" = None,
+                              prune: float = None, min_size: int = 0, max_size: int = None) -> tuple[list, np.ndarray, np.ndarray, np.ndarray]:
+    """
+        Performs the functional enrichment with the overlap counts computed inside SQLite (see get_overlap_counts_from_db).
+        For large DBs that do not fit comfortably in memory. Only categories with min_size to max_size compounds are tested.
+
+        Returns the same as matrix_functional_enrichment
+    """
+    names, in_query, in_background, sizes, background_size = get_overlap_counts_from_db(conn, table, genes_in_query, background, databases, annotations)
+    window = size_window(sizes, min_size, max_size)
+    if not window.all():
+        names, in_query, in_background, sizes = [x for x, keep in zip(names, window) if keep], in_query[window], in_background[window], sizes[window]
+    pvalues = enrichment_pvalues(in_query, in_background, len(genes_in_query) - in_query, background_size - in_background, alternative, cache, prune)
+    return names, in_query, sizes, pvalues
+
+def size_window(sizes: np.ndarray, min_size: int = 0, max_size: int = None) -> np.ndarray:
+    """
+        Boolean mask of the categories with min_size to max_size compounds (no upper limit if None)
+    """
+    sizes = np.asarray(sizes, dtype=np.int64)
+    return (sizes >= min_size) & (sizes <= (max_size if max_size is not None else np.iinfo(np.int64).max))
+
 def functional_enrichment(genes_in_query: set, genes_in_category:set, background:set) -> float:
     """
         Perfoms a fisher test to execute the functional enrichment analysis
@@ -75,5 +154,364 @@ def functional_enrichment(genes_in_query: set, genes_in_category:set, background
     pval = scipy.stats.fisher_exact(table)
     return pval.pvalue, genes_from_query_in_set, len(genes_in_category)
 
+def _vectorized_binary_search(function, target: np.ndarray, lo: np.ndarray, hi: np.ndarray) -> np.ndarray:
+    """
+        Element-wise version of the implicit binary search that scipy.stats.fisher_exact
+        uses to find the tail on the other side of the mode.
+
+        function(x, idx) must evaluate the searched function at x for the elements idx.
+        Returns, for every element, the index i between lo and hi such that
+        function(i) <= target < function(i+1)
+    """
+    lo = lo.copy()
+    hi = hi.copy()
+    result = np.zeros(lo.shape, dtype=np.int64)
+    searching = np.ones(lo.shape, dtype=bool)
+    while True:
+        idx = np.flatnonzero(searching & (lo < hi))
+        if idx.size == 0:
+            break
+        mid = lo[idx] + (hi[idx] - lo[idx]) // 2
+        midval = function(mid, idx)
+        less = midval < target[idx]
+        greater = midval > target[idx]
+        equal = ~(less | greater)
+        lo[idx[less]] = mid[less] + 1
+        hi[idx[greater]] = mid[greater] - 1
+        result[idx[equal]] = mid[equal]
+        searching[idx[equal]] = False
+    idx = np.flatnonzero(searching)
+    if idx.size:
+        below = function(lo[idx], idx) <= target[idx]
+        result[idx] = np.where(below, lo[idx], lo[idx] - 1)
+    return result
+
+def fisher_exact_batch(in_query_in_set, in_background_in_set, in_query_not_in_set, in_background_not_in_set, alternative: str = "two-sided", log_factorial: "LogFactorial" = None) -> np.ndarray:
+    """
+        Vectorized Fisher exact test over many 2x2 tables at once.
+
+        Each argument holds one cell of the table, with the same layout used in
+        functional_enrichment: [[query in set, background in set], [query not in set, background not in set]]
+
+        The p-values come from the hypergeometric distribution, evaluated for all the
+        tables in the same scipy.stats.hypergeom call, and match scipy.stats.fisher_exact.
+        If a LogFactorial table is given, they are summed from it instead (see _log_factorial_pvalues):
+        much faster for many tables, with the same terms as scipy, within the rounding of the log-factorials
+        (see LOG_FACTORIAL_ERROR). Tables whose terms are too close to tell apart are computed by scipy.
+
+        Returns uncorrected p-values
+    """
+    a, b, c, d = (np.asarray(x, dtype=np.int64) for x in (in_query_in_set, in_background_in_set, in_query_not_in_set, in_background_not_in_set))
+    pvalues = np.ones(a.shape, dtype=float)
+    # If both values in a row or column are zero, the p-value is 1
+    valid = np.flatnonzero((a + b > 0) & (c + d > 0) & (a + c > 0) & (b + d > 0))
+    a, b, c, d = a[valid], b[valid], c[valid], d[valid]
+    n1 = a + b
+    total = n1 + c + d
+    n = a + c
+    if alternative not in ("two-sided", "less", "greater"):
+        raise ValueError("`alternative` should be one of {'two-sided', 'less', 'greater'}")
+    if log_factorial is not None:
+        pvalues[valid] = _log_factorial_pvalues(a, total, n1, n, alternative, log_factorial)
+        # Ties that rounding cannot decide
+        undecided = np.flatnonzero(np.isnan(pvalues[valid]))
+        a, total, n1, n, valid = a[undecided], total[undecided], n1[undecided], n[undecided], valid[undecided]
+    hypergeom = scipy.stats.hypergeom
+    match alternative:
+        case "greater":
+            pvalues[valid] = hypergeom.sf(a - 1, total, n1, n)
+        case "less":
+            pvalues[valid] = hypergeom.cdf(a, total, n1, n)
+        case "two-sided":
+            pvalues[valid] = _two_sided_pvalues(a, total, n1, n)
+    return np.minimum(pvalues, 1.0)
+
+def minimum_pvalues(a: np.ndarray, b: np.ndarray, c: np.ndarray, d: np.ndarray) -> np.ndarray:
+    """
+        Lower bound of the p-value of each table, for any alternative: the hypergeometric probability
+        of the table itself, which every tail includes. In closed form, from nine log-factorials:
+            (a + b)! (c + d)! (a + c)! (b + d)! / (a! b! c! d! N!)
+    """
+    a, b, c, d = (np.asarray(x, dtype=float) for x in (a, b, c, d))
+    gammaln = scipy.special.gammaln
+    log_p = (gammaln(a + b + 1) + gammaln(c + d + 1) + gammaln(a + c + 1) + gammaln(b + d + 1)
+             - gammaln(a + 1) - gammaln(b + 1) - gammaln(c + 1) - gammaln(d + 1) - gammaln(a + b + c + d + 1))
+    return np.exp(log_p)
+
+def enrichment_pvalues(in_query_in_set: np.ndarray, in_background_in_set: np.ndarray, in_query_not_in_set: np.ndarray, in_background_not_in_set: np.ndarray, alternative: str = "two-sided", cache: "PValueCache" = None, prune: float = None) -> np.ndarray:
+    """
+        p-values of the enrichment tables, with the same shape as the arguments (which are broadcast together).
+
+        Tables without compounds from the query get a p-value of 1 without being tested, as in functional_enrichment.
+        As most categories have no compound of the query, this avoids most of the tests. Repeated tables
+        (frequent among small categories) are tested once. With a PValueCache, tables already tested,
+        in this or previous runs, are not tested again.
+
+        With prune, tables whose p-value cannot be below it (see minimum_pvalues) also get a p-value of 1 without
+        being tested. Given the FDR threshold as prune, the categories that pass the Benjamini-Hochberg correction,
+        and their FDR, are the same as without pruning: the p-values of pruned tables are above the threshold anyway.
+    """
+    tables = np.broadcast_arrays(*(np.asarray(x, dtype=np.int64) for x in (in_query_in_set, in_background_in_set, in_query_not_in_set, in_background_not_in_set)))
+    pvalues = np.ones(tables[0].shape, dtype=float)
+    tested = tables[0] > 0
+    if not tested.any():
+        return pvalues
+    unique, inverse = np.unique(np.stack([x[tested] for x in tables], axis=1), axis=0, return_inverse=True)
+    reachable = np.ones(len(unique), dtype=bool)
+    if prune is not None:
+        # The margin keeps tables whose bound is only above prune by rounding
+        reachable = minimum_pvalues(*unique.T) * (1 - RELATIVE_ERROR) < prune
+        logging.debug(f"Pruned {len(unique) - reachable.sum()} of {len(unique)} tables")
+    unique_pvalues = np.ones(len(unique), dtype=float)
+    if cache is not None:
+        unique_pvalues[reachable] = cache.pvalues(*unique[reachable].T)
+    else:
+        unique_pvalues[reachable] = fisher_exact_batch(*unique[reachable].T, alternative=alternative)
+    pvalues[tested] = unique_pvalues[inverse.reshape(-1)]
+    return pvalues
+
+def _two_sided_pvalues(a: np.ndarray, total: np.ndarray, n1: np.ndarray, n: np.ndarray) -> np.ndarray:
+    """
+        Two sided p-values, following the same steps as scipy.stats.fisher_exact
+        so results are numerically the same.
+    """
+    hypergeom = scipy.stats.hypergeom
+    epsilon = TIE_EPSILON
+    gamma = 1 + epsilon
+    mode = np.floor((n + 1) * (n1 + 1) / (total + 2)).astype(np.int64)
+    pexact = hypergeom.pmf(a, total, n1, n)
+    pmode = hypergeom.pmf(mode, total, n1, n)
+    pvalues = np.ones(a.shape, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        at_mode = np.abs(pexact - pmode) / np.maximum(pexact, pmode) <= epsilon
+    threshold = pexact * gamma
+
+    # Observed value below the mode: the other tail lies between mode and n
+    lower = np.flatnonzero(~at_mode & (a < mode))
+    if lower.size:
+        pvalues[lower] = hypergeom.cdf(a[lower], total[lower], n1[lower], n[lower])
+        search = lower[hypergeom.pmf(n[lower], total[lower], n1[lower], n[lower]) <= threshold[lower]]
+        guess = _vectorized_binary_search(lambda x, idx: -hypergeom.pmf(x, total[search][idx], n1[search][idx], n[search][idx]),
+                                          -threshold[search], mode[search], n[search])
+        pvalues[search] += hypergeom.sf(guess, total[search], n1[search], n[search])
+
+    # Observed value at or above the mode: the other tail lies between 0 and mode
+    upper = np.flatnonzero(~at_mode & (a >= mode))
+    if upper.size:
+        pvalues[upper] = hypergeom.sf(a[upper] - 1, total[upper], n1[upper], n[upper])
+        search = upper[hypergeom.pmf(0, total[upper], n1[upper], n[upper]) <= threshold[upper]]
+        guess = _vectorized_binary_search(lambda x, idx: hypergeom.pmf(x, total[search][idx], n1[search][idx], n[search][idx]),
+                                          threshold[search], np.zeros(search.size, dtype=np.int64), mode[search])
+        pvalues[search] += hypergeom.cdf(guess, total[search], n1[search], n[search])
+    return pvalues
+
+class LogFactorial:
+    """
+        Table of log(x!), grown on demand. Sized to the background, it gives the
+        hypergeometric probabilities of any table with a few lookups.
+    """
+
+    def __init__(self, size: int = 0):
+        self.table = np.zeros(0)
+        self.grow(size)
+
+    def grow(self, size: int) -> None:
+        if size >= len(self.table):
+            self.table = scipy.special.gammaln(np.arange(max(size + 1, 2 * len(self.table)), dtype=float) + 1)
+
+    def __call__(self, x: np.ndarray) -> np.ndarray:
+        return self.table[x]
+
+# Probabilities within RELATIVE_ERROR of each other are taken as equal by the permutation tests and pruning (as R's fisher.test)
+RELATIVE_ERROR = 1e-7
+# Terms of a table in the two-sided test: probability up to the observed one, times 1 + TIE_EPSILON (as scipy.stats.fisher_exact)
+TIE_EPSILON = 1e-14
+# Relative error of the probabilities summed from a LogFactorial table, in units of the machine epsilon
+# times the largest log-factorial of the table
+LOG_FACTORIAL_ERROR = 64
+# Tables x support values evaluated at once by _log_factorial_pvalues
+SUPPORT_BLOCK = 1 << 22
+
+def _log_factorial_pvalues(a: np.ndarray, total: np.ndarray, n1: np.ndarray, n: np.ndarray, alternative: str, log_factorial: LogFactorial) -> np.ndarray:
+    """
+        Hypergeometric p-values summed over the support of each table: probabilities come from the log-factorial table,
+        relative to the largest one of the table. Two-sided p-values have the terms scipy.stats.fisher_exact adds up (see
+        _two_sided_pvalues). Tables with a term too close to the observed one to tell, given the rounding of the
+        log-factorials, are left as NaN, to be computed by scipy.
+        Tables are evaluated in blocks of similar support width, to bound the memory used.
+    """
+    log_factorial.grow(int(total.max()))
+    low = np.maximum(0, n - (total - n1))
+    width = np.minimum(n, n1) - low + 1
+    pvalues = np.ones(a.shape, dtype=float)
+    order = np.argsort(width, kind="stable")
+    start: int = 0
+    while start < len(order):
+        # As tables are sorted by width, the block width is the one of its last table
+        end: int = start + 1
+        while end < len(order) and (end - start + 1) * width[order[end]] <= SUPPORT_BLOCK:
+            end += 1
+        idx = order[start:end]
+        x = low[idx, None] + np.arange(width[idx[-1]])[None, :]
+        in_support = x < (low[idx] + width[idx])[:, None]
+        x = np.where(in_support, x, low[idx, None])
+        remaining = (total[idx] - n1[idx] - n[idx])[:, None]
+        log_d = -(log_factorial(x) + log_factorial(n1[idx, None] - x) + log_factorial(n[idx, None] - x) + log_factorial(remaining + x))
+        log_d = np.where(in_support, log_d, -np.inf)
+        d = np.exp(log_d - log_d.max(axis=1, keepdims=True))
+        observed = x == a[idx, None]
+        match alternative:
+            case "greater":
+                selected = in_support & (x >= a[idx, None])
+            case "less":
+                selected = in_support & (x <= a[idx, None])
+            case _:
+                d_observed = np.where(observed & in_support, d, 0).max(axis=1, keepdims=True)
+                selected = in_support & (d <= d_observed * (1 + TIE_EPSILON))
+                error = LOG_FACTORIAL_ERROR * np.finfo(float).eps * log_factorial(total[idx])[:, None]
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    undecided = (in_support & ~observed & (np.abs(d / d_observed - 1) <= error + TIE_EPSILON)).any(axis=1)
+        pvalues[idx] = np.where(selected, d, 0).sum(axis=1) / d.sum(axis=1)
+        if alternative == "two-sided":
+            pvalues[idx[undecided]] = np.nan
+            # At the mode, scipy gives 1
+            mode = np.floor((n[idx] + 1) * (n1[idx] + 1) / (total[idx] + 2)).astype(np.int64)
+            pvalues[idx[a[idx] == mode]] = 1.0
+        start = end
+    return pvalues
+
+class PValueCache:
+    """
+        LRU cache of p-values, keyed by contingency table (a, b, c, d), for one alternative.
+
+        Misses are summed from a LogFactorial table sized to the largest background seen (see fisher_exact_batch):
+        they add up the same terms as the engines without the cache, ties included, and differ from them only by
+        the rounding of the log-factorials (see LOG_FACTORIAL_ERROR). The cache can be saved and loaded between runs: as keys are whole tables, they include
+        the background size, so entries stay valid for any background. Runs against the same background hit the most.
+        Files saved with another METHOD are not loaded.
+    """
+
+    # Way the p-values are computed, saved with the cache: files with other values are discarded on load
+    METHOD = "log-factorial"
+
+    def __init__(self, maxsize: int = 1 << 20, alternative: str = "two-sided"):
+        self.maxsize = maxsize
+        self.alternative = alternative
+        self.entries: collections.OrderedDict = collections.OrderedDict()
+        self.log_factorial: LogFactorial = LogFactorial()
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def pvalues(self, a: np.ndarray, b: np.ndarray, c: np.ndarray, d: np.ndarray) -> np.ndarray:
+        """
+            p-values of the given tables, from the cache or computed and stored
+        """
+        keys: list = list(zip(np.asarray(a).tolist(), np.asarray(b).tolist(), np.asarray(c).tolist(), np.asarray(d).tolist()))
+        result = np.empty(len(keys), dtype=float)
+        missing: list = []
+        for i, key in enumerate(keys):
+            value: float = self.entries.get(key)
+            if value is None:
+                missing.append(i)
+            else:
+                self.entries.move_to_end(key)
+                result[i] = value
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            tables = np.asarray([keys[i] for i in missing], dtype=np.int64)
+            result[missing] = fisher_exact_batch(*tables.T, alternative=self.alternative, log_factorial=self.log_factorial)
+            for i in missing:
+                self.entries[keys[i]] = float(result[i])
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return result
+
+    def save(self, file: str) -> None:
+        keys = np.asarray(list(self.entries.keys()), dtype=np.int64).reshape(-1, 4)
+        values = np.fromiter(self.entries.values(), dtype=float, count=len(self.entries))
+        with open(file, "wb") as fhand:
+            np.savez(fhand, keys=keys, values=values, alternative=self.alternative, method=self.METHOD)
+        logging.info(f"Saved {len(values)} p-values to {file}")
+
+    @classmethod
+    def load(cls, file: str, maxsize: int = 1 << 20, alternative: str = "two-sided") -> "PValueCache":
+        """
+            Cache with the entries saved in file, if it exists and was saved for the same alternative and method.
+            The most recently used entries are kept if there are more than maxsize.
+        """
+        cache: PValueCache = cls(maxsize, alternative)
+        try:
+            data = np.load(file)
+        except (OSError, ValueError):
+            return cache
+        if str(data["alternative"]) != alternative:
+            logging.info(f"p-value cache {file} was saved for another alternative, starting empty")
+            return cache
+        if str(data["method"]) != cls.METHOD:
+            logging.info(f"p-value cache {file} was computed by another method, starting empty")
+            return cache
+        keys: list = list(map(tuple, data["keys"][-maxsize:].tolist())) if maxsize else []
+        cache.entries.update(zip(keys, data["values"][len(data["values"]) - len(keys):].tolist()))
+        logging.info(f"Loaded {len(cache)} p-values from {file}")
+        return cache
+
+def matrix_functional_enrichment(genes_in_query: set, annotation: AnnotationMatrix, background: set, alternative: str = "two-sided", cache: PValueCache = None, prune: float = None) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+        Performs the functional enrichment of every category of an AnnotationMatrix at once.
+
+        The overlaps of the query and the background with all the categories are two sparse
+        matrix-vector products, and all the p-values are obtained in a single vectorized test
+        (see fisher_exact_batch). Compounds of the query or the background that are not
+        annotated still count in the totals of the contingency tables.
+
+        Returns the category names, the compounds of the query in each category, the size of each
+        category and the uncorrected p-values, in the same order.
+        Categories without compounds from the query get a p-value of 1, as in functional_enrichment,
+        and so do those that cannot reach prune, if given (see enrichment_pvalues).
+    """
+    genes_from_query_in_set = annotation.overlap(annotation.indicator(genes_in_query))
+    genes_from_background_in_set = annotation.overlap(annotation.indicator(background))
+    genes_from_query_not_in_set = len(genes_in_query) - genes_from_query_in_set
+    genes_from_background_not_in_set = len(background) - genes_from_background_in_set
+    pvalues = enrichment_pvalues(genes_from_query_in_set, genes_from_background_in_set,
+                                 genes_from_query_not_in_set, genes_from_background_not_in_set, alternative, cache, prune)
+    return annotation.names, genes_from_query_in_set, annotation.sizes, pvalues
+
+def multi_query_functional_enrichment(queries: list, annotation: AnnotationMatrix, background: set, alternative: str = "two-sided", cache: PValueCache = None, prune: float = None) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+        Performs the functional enrichment of many queries against every category of an AnnotationMatrix.
+
+        The queries are stacked in a compound x query matrix, so the overlaps of every query with every
+        category come from a single sparse matrix product.
+
+        Returns the category names, the category x query matrix of compounds of each query in each category,
+        the size of each category and the category x query matrix of uncorrected p-values.
+    """
+    genes_from_query_in_set = annotation.overlap_many(annotation.indicator_matrix(queries))
+    genes_from_background_in_set = annotation.overlap(annotation.indicator(background))[:, None]
+    query_sizes = np.array([len(x) for x in queries], dtype=np.int64)[None, :]
+    genes_from_query_not_in_set = query_sizes - genes_from_query_in_set
+    genes_from_background_not_in_set = len(background) - genes_from_background_in_set
+    pvalues = enrichment_pvalues(genes_from_query_in_set, genes_from_background_in_set,
+                                 genes_from_query_not_in_set, genes_from_background_not_in_set, alternative, cache, prune)
+    return annotation.names, genes_from_query_in_set, annotation.sizes, pvalues
+
+def batch_functional_enrichment(genes_in_query: set, annotation: dict, background: set, alternative: str = "two-sided") -> tuple[list, np.ndarray, np.ndarray, np.ndarray]:
+    """
+        Performs the functional enrichment of every category in a dict of annotation name -> compounds
+        at once, encoding it as an AnnotationMatrix (see matrix_functional_enrichment).
+
+        The size reported for each category is the length of its compound collection, as in functional_enrichment.
+    """
+    names: list = list(annotation.keys())
+    matrix: AnnotationMatrix = AnnotationMatrix.from_dict(annotation).for_annotations(names)
+    _, in_set, _, pvalues = matrix_functional_enrichment(genes_in_query, matrix, background, alternative)
+    sizes = np.fromiter((len(annotation[x]) for x in names), dtype=np.int64, count=len(names))
+    return names, in_set, sizes, pvalues
+
 def correct_pvalue(pvalues):
     return scipy.stats.false_discovery_control(pvalues, method="bh")
\ No newline at end of file
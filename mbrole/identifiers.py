@@ -0,0 +1,83 @@
+#! /usr/bin/env python3
+
+"""
+    Compound identifiers of the source databases.
+
+    Each namespace has a normal form, the one the loaders store (CHEBI_15422, HMDB0000122, C00031...),
+    so the same compound written in different ways is found in the id map (see mbrole.database.store_id_map).
+    guess_namespace tells the namespace of an identifier from its shape, for queries with mixed IDs.
+"""
+
+import re
+
+def _chebi(identifier: str) -> str:
+    return "CHEBI_" + identifier.upper().removeprefix("CHEBI:").removeprefix("CHEBI_")
+
+def _hmdb(identifier: str) -> str:
+    number: str = identifier.upper().removeprefix("HMDB:").removeprefix("HMDB")
+    return f"HMDB{number.zfill(7)}" if number.isdigit() else identifier
+
+def _kegg(identifier: str) -> str:
+    return identifier.upper().removeprefix("KEGG:").removeprefix("CPD:")
+
+def _pubchem(identifier: str) -> str:
+    return identifier.upper().removeprefix("PUBCHEM:").removeprefix("CID:").strip()
+
+def _inchikey(identifier: str) -> str:
+    return identifier.upper().removeprefix("INCHIKEY=")
+
+def _cas(identifier: str) -> str:
+    return identifier.upper().removeprefix("CAS:")
+
+def _name(identifier: str) -> str:
+    return " ".join(identifier.split()).casefold()
+
+# Normal form of the identifiers of each namespace
+NORMALIZERS = {"chebi": _chebi,
+               "hmdb": _hmdb,
+               "kegg": _kegg,
+               "pubchem": _pubchem,
+               "inchikey": _inchikey,
+               "cas": _cas,
+               "name": _name}
+NAMESPACES = tuple(NORMALIZERS)
+
+# Namespace of the names used by the sources for their cross-references (lowercase)
+ALIASES = {"chebi": "chebi",
+           "hmdb": "hmdb",
+           "human metabolome database": "hmdb",
+           "kegg": "kegg",
+           "kegg compound": "kegg",
+           "kegg_compound": "kegg",
+           "pubchem": "pubchem",
+           "pubchem-compound": "pubchem",
+           "pubchem_compound": "pubchem",
+           "cas": "cas",
+           "inchikey": "inchikey",
+           "name": "name"}
+
+# Shapes of the identifiers of each namespace, in the order they are tried. Anything else is a name.
+PATTERNS = (("chebi", re.compile(r"^CHEBI[:_]\d+$", re.IGNORECASE)),
+            ("hmdb", re.compile(r"^HMDB:?\d+$", re.IGNORECASE)),
+            ("kegg", re.compile(r"^(CPD:|KEGG:)?[CDG]\d{5}$", re.IGNORECASE)),
+            ("inchikey", re.compile(r"^(INCHIKEY=)?[A-Z]{14}-[A-Z]{10}-[A-Z]$", re.IGNORECASE)),
+            ("cas", re.compile(r"^(CAS:)?\d{2,7}-\d{2}-\d$", re.IGNORECASE)),
+            ("pubchem", re.compile(r"^(PUBCHEM:|CID:)?\d+$", re.IGNORECASE)))
+
+def namespace_of(source: str) -> str:
+    """
+        Namespace of a cross-reference database, as written by a source (e.g. "KEGG COMPOUND"). None if unknown.
+    """
+    return ALIASES.get(source.strip().lower())
+
+def guess_namespace(identifier: str) -> str:
+    for namespace, pattern in PATTERNS:
+        if pattern.match(identifier):
+            return namespace
+    return "name"
+
+def normalize(namespace: str, identifier: str) -> str:
+    """
+        Normal form of an identifier of the namespace (see NORMALIZERS)
+    """
+    return NORMALIZERS[namespace](identifier.strip())
@@ -0,0 +1,277 @@
+#! /usr/bin/env python3
+
+"""
+    Integer-encoded annotation.
+
+    Compound IDs and category names are interned into integer indices, and the annotation
+    is stored as a sparse category x compound incidence matrix (CSR). A query is then a
+    boolean vector over the compounds, and the overlap of the query with every category
+    is a single sparse matrix-vector product.
+
+    Each category is identified by its (database, annotation) pair, as in the SQLite table.
+"""
+
+import collections
+import logging
+import sqlite3
+
+import numpy as np
+import scipy.sparse
+
+import mbrole.database
+
+INDEX_DTYPE = np.int32
+
+def _decoded(strings) -> np.ndarray:
+    """
+        Object array of strings given as an array or as a table decoded on first use
+    """
+    return strings if isinstance(strings, np.ndarray) else strings.decode()
+
+class AnnotationMatrix:
+    """
+        Sparse category x compound incidence matrix.
+
+        - compounds: compound IDs, one per column.
+        - names: annotation name of each category, one per row.
+        - databases: source databases.
+        - category_database: index in databases of the source of each category.
+        - matrix: CSR array with a 1 for every (category, compound) annotated.
+
+        compounds and names can also be given as tables decoded on first use (see mbrole.snapshot.StringTable).
+    """
+
+    def __init__(self, compounds: np.ndarray, names: np.ndarray, databases: np.ndarray, category_database: np.ndarray, matrix: scipy.sparse.csr_array):
+        self._compounds = compounds
+        self._names = names
+        self.databases = databases
+        self.category_database = category_database
+        self.matrix = matrix
+        self._compound_index: dict = None
+
+    @classmethod
+    def from_rows(cls, rows) -> "AnnotationMatrix":
+        """
+            Builds the matrix from an iterable of (compound, annotation, database) rows,
+            e.g. the result of a SQL query. Repeated rows are stored once.
+        """
+        compound_index: dict = {}
+        category_index: dict = {}
+        database_index: dict = {}
+        row_ids: list = []
+        column_ids: list = []
+        for compound, annotation, database in rows:
+            database_id = database_index.setdefault(database, len(database_index))
+            row_ids.append(category_index.setdefault((database_id, annotation), len(category_index)))
+            column_ids.append(compound_index.setdefault(compound, len(compound_index)))
+        return cls._build(compound_index, category_index, database_index, row_ids, column_ids)
+
+    @classmethod
+    def from_dict(cls, annotation: dict, database: str = "") -> "AnnotationMatrix":
+        """
+            Builds the matrix from a dict of annotation name -> compounds,
+            the structure returned by get_genes_per_category
+        """
+        return cls.from_rows((compound, name, database) for name, compounds in annotation.items() for compound in compounds)
+
+    @classmethod
+    def from_db(cls, conn: sqlite3.Connection, table: str, databases: list = None, annotations: list = None) -> "AnnotationMatrix":
+        """
+            Loads the annotation of the given databases and annotation names (all of them if None) in a single query.
+            Categories, and the databases, come in the order of mbrole.database.category_rows, as in the other engines.
+        """
+        filters: list = []
+        parameters: list = []
+        for column, values in (("database", databases), ("annotation", annotations)):
+            if values:
+                filters.append(f"{column} IN ({','.join('?' * len(values))})")
+                parameters.extend(values)
+        SQL = f"SELECT compound, annotation, database FROM {mbrole.database.category_rows(conn, table)}"
+        if filters:
+            SQL += " WHERE " + " AND ".join(filters)
+        SQL += " ORDER BY position;"
+        logging.debug(SQL)
+        return cls.from_rows(conn.execute(SQL, parameters))
+
+    @classmethod
+    def _build(cls, compound_index: dict, category_index: dict, database_index: dict, row_ids: list, column_ids: list) -> "AnnotationMatrix":
+        rows = np.asarray(row_ids, dtype=INDEX_DTYPE)
+        columns = np.asarray(column_ids, dtype=INDEX_DTYPE)
+        data = np.ones(rows.shape, dtype=np.int8)
+        matrix = scipy.sparse.csr_array((data, (rows, columns)), shape=(len(category_index), len(compound_index)))
+        # Duplicated rows are summed on conversion: keep them as a single 1
+        matrix.sum_duplicates()
+        matrix.data[:] = 1
+        categories = list(category_index.keys())
+        compounds = np.empty(len(compound_index), dtype=object)
+        compounds[:] = list(compound_index.keys())
+        names = np.empty(len(categories), dtype=object)
+        names[:] = [x[1] for x in categories]
+        category_database = np.fromiter((x[0] for x in categories), dtype=INDEX_DTYPE, count=len(categories))
+        databases = np.empty(len(database_index), dtype=object)
+        databases[:] = list(database_index.keys())
+        return cls(compounds, names, databases, category_database, matrix)
+
+    @classmethod
+    def stack(cls, matrices: list) -> "AnnotationMatrix":
+        """
+            Matrix with the categories of every matrix, one after the other, over the union of their compounds.
+            Compounds without any category are dropped.
+        """
+        compound_index: dict = {}
+        database_index: dict = {}
+        indptr: list = [np.zeros(1, dtype=np.int64)]
+        indices: list = [np.zeros(0, dtype=np.int64)]
+        category_database: list = [np.zeros(0, dtype=INDEX_DTYPE)]
+        offset: int = 0
+        for matrix in matrices:
+            columns = np.fromiter((compound_index.setdefault(x, len(compound_index)) for x in matrix.compounds), dtype=np.int64, count=len(matrix.compounds))
+            databases = np.fromiter((database_index.setdefault(x, len(database_index)) for x in matrix.databases), dtype=INDEX_DTYPE, count=len(matrix.databases))
+            csr: scipy.sparse.csr_array = matrix.matrix
+            indptr.append(np.asarray(csr.indptr[1:], dtype=np.int64) - csr.indptr[0] + offset)
+            indices.append(columns[csr.indices[csr.indptr[0]:csr.indptr[-1]]])
+            offset += int(csr.indptr[-1] - csr.indptr[0])
+            # Categories grouped by for_annotations have no database (-1)
+            known = matrix.category_database >= 0
+            category_database.append(np.where(known, databases[np.where(known, matrix.category_database, 0)] if len(databases) else -1, -1).astype(INDEX_DTYPE))
+        all_indices = np.concatenate(indices)
+        used = np.bincount(all_indices, minlength=len(compound_index)) > 0
+        new_column = (np.cumsum(used) - 1).astype(INDEX_DTYPE)
+        compounds = np.empty(len(compound_index), dtype=object)
+        compounds[:] = list(compound_index.keys())
+        names = np.empty(sum(len(x) for x in matrices), dtype=object)
+        names[:] = [x for matrix in matrices for x in matrix.names]
+        databases = np.empty(len(database_index), dtype=object)
+        databases[:] = list(database_index.keys())
+        data = np.ones(len(all_indices), dtype=np.int8)
+        result = scipy.sparse.csr_array((data, new_column[all_indices], np.concatenate(indptr).astype(INDEX_DTYPE)), shape=(len(names), int(used.sum())))
+        return cls(compounds[used], names, databases, np.concatenate(category_database), result)
+
+    def __len__(self) -> int:
+        return self.matrix.shape[0]
+
+    @property
+    def compounds(self) -> np.ndarray:
+        return _decoded(self._compounds)
+
+    @property
+    def names(self) -> np.ndarray:
+        return _decoded(self._names)
+
+    @property
+    def sizes(self) -> np.ndarray:
+        """
+            Number of compounds annotated in each category
+        """
+        return np.diff(self.matrix.indptr).astype(np.int64)
+
+    @property
+    def compound_index(self) -> dict:
+        if self._compound_index is None:
+            self._compound_index = {compound: i for i, compound in enumerate(self.compounds)}
+        return self._compound_index
+
+    def indicator(self, compounds: set) -> np.ndarray:
+        """
+            Boolean vector over the columns, True for the given compounds.
+            Compounds that are not annotated in any category are ignored.
+        """
+        vector = np.zeros(self.matrix.shape[1], dtype=bool)
+        index: dict = self.compound_index
+        vector[[index[x] for x in compounds if x in index]] = True
+        return vector
+
+    def indicator_matrix(self, queries: list) -> scipy.sparse.csc_array:
+        """
+            Sparse compound x query matrix with the indicator vectors of many compound sets stacked as columns
+        """
+        index: dict = self.compound_index
+        rows: list = []
+        columns: list = []
+        for i, compounds in enumerate(queries):
+            found: list = [index[x] for x in compounds if x in index]
+            rows.extend(found)
+            columns.extend([i] * len(found))
+        data = np.ones(len(rows), dtype=np.int64)
+        return scipy.sparse.csc_array((data, (rows, columns)), shape=(self.matrix.shape[1], len(queries)))
+
+    def overlap(self, vector: np.ndarray) -> np.ndarray:
+        """
+            Number of compounds of the vector (see indicator) in each category
+        """
+        return np.asarray(self.matrix @ vector.astype(np.int64), dtype=np.int64)
+
+    def overlap_many(self, queries: scipy.sparse.csc_array) -> np.ndarray:
+        """
+            Dense category x query matrix with the overlaps of every query (see indicator_matrix) with every category,
+            computed as a single sparse matrix product
+        """
+        return np.asarray((self.matrix @ queries).toarray(), dtype=np.int64)
+
+    def category_compounds(self, row: int) -> np.ndarray:
+        return self.compounds[self.matrix.indices[self.matrix.indptr[row]:self.matrix.indptr[row + 1]]]
+
+    def overlap_compounds(self, rows: list, vector: np.ndarray) -> list[np.ndarray]:
+        """
+            Compounds of the vector (see indicator) annotated in each of the given categories
+        """
+        result: list = []
+        for row in rows:
+            columns = self.matrix.indices[self.matrix.indptr[row]:self.matrix.indptr[row + 1]]
+            result.append(self.compounds[columns[vector[columns]]])
+        return result
+
+    def select(self, rows: np.ndarray) -> "AnnotationMatrix":
+        """
+            New matrix with only the given categories, in that order. Compounds are kept.
+        """
+        result = AnnotationMatrix(self._compounds, self.names[rows], self.databases, self.category_database[rows], self.matrix[rows])
+        result._compound_index = self._compound_index
+        return result
+
+    def for_databases(self, databases: list = None) -> "AnnotationMatrix":
+        """
+            Categories of the given databases (all of them if None or empty).
+
+            An annotation name present in more than one database is kept once, taken from the last of
+            the databases given (see mbrole.database.merge_categories).
+        """
+        categories: list = list(zip(self.databases[self.category_database], self.names)) if len(self.databases) else []
+        # Databases are in the order of mbrole.database.database_order, as loaded by from_db
+        kept: list = mbrole.database.merge_categories(categories, databases or list(self.databases))
+        return self.select(np.array(kept, dtype=np.int64))
+
+    def for_annotations(self, names: list) -> "AnnotationMatrix":
+        """
+            One category per given annotation name, with the compounds annotated to that name in any database.
+            Names that are not in the matrix give empty categories.
+        """
+        positions: dict = collections.defaultdict(list)
+        for row, name in enumerate(self.names):
+            positions[name].append(row)
+        group_rows: list = []
+        group_columns: list = []
+        for i, name in enumerate(names):
+            group_rows.extend([i] * len(positions.get(name, [])))
+            group_columns.extend(positions.get(name, []))
+        grouping = scipy.sparse.csr_array((np.ones(len(group_rows), dtype=np.int8), (group_rows, group_columns)), shape=(len(names), len(self)))
+        matrix = scipy.sparse.csr_array(grouping @ self.matrix)
+        matrix.data[:] = 1
+        selected = np.empty(len(names), dtype=object)
+        selected[:] = list(names)
+        database = np.full(len(names), -1, dtype=INDEX_DTYPE)
+        result = AnnotationMatrix(self._compounds, selected, self.databases, database, matrix)
+        result._compound_index = self._compound_index
+        return result
+
+    def to_dict(self) -> dict:
+        """
+            dict of annotation name -> set of compounds, as used by functional_enrichment
+        """
+        return {self.names[i]: set(self.category_compounds(i)) for i in range(len(self))}
+
+    def nbytes(self) -> int:
+        """
+            Memory used by the integer arrays of the matrix
+        """
+        return self.matrix.data.nbytes + self.matrix.indices.nbytes + self.matrix.indptr.nbytes + self.category_database.nbytes
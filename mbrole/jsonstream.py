@@ -0,0 +1,187 @@
+#! /usr/bin/env python3
+
+"""
+    Incremental JSON reading.
+
+    Walks a JSON document from a file handle without loading it whole: the handle is read in
+    chunks, values outside the requested path are skipped, and the elements of the requested
+    array are decoded and yielded one at a time. Memory is bounded by the chunk size and the
+    size of a single element, not by the size of the document.
+
+    Example, nodes of an OBO graph JSON file:
+        for node in iter_array(fhand, ("graphs", 0, "nodes")):
+            ...
+"""
+
+import json
+import re
+
+CHUNK_SIZE = 1 << 20
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_BLANK = " \t\n\r"
+_DELIMITERS = " \t\n\r,:]}"
+_decoder = json.JSONDecoder()
+
+class _Scanner:
+    """
+        Buffer over a text handle, with the primitives needed to walk a JSON document
+    """
+
+    def __init__(self, fhand, chunk_size: int = CHUNK_SIZE):
+        self.fhand = fhand
+        self.chunk_size = chunk_size
+        self.buffer: str = ""
+        self.pos: int = 0
+        self.eof: bool = False
+
+    def _fill(self) -> bool:
+        """
+            Reads the next chunk, dropping the consumed part of the buffer. Returns False at the end of the file.
+        """
+        if self.eof:
+            return False
+        chunk: str = self.fhand.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """
+            Next character that is not whitespace, without consuming it
+        """
+        while True:
+            if self.pos < len(self.buffer) and self.buffer[self.pos] not in _BLANK:
+                return self.buffer[self.pos]
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of JSON document")
+
+    def expect(self, char: str) -> None:
+        found: str = self.peek()
+        if found != char:
+            raise ValueError(f"Expected {char!r} in JSON document, found {found!r}")
+        self.pos += 1
+
+    def read_string(self) -> str:
+        self.expect('"')
+        while True:
+            try:
+                value, end = json.decoder.scanstring(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            self.pos = end
+            return value
+
+    def _decode(self) -> tuple:
+        """
+            Decodes the value at the current position from the buffer as it is.
+            Returns (value, end), or None if the value does not end inside the buffer.
+        """
+        try:
+            value, end = _decoder.raw_decode(self.buffer, self.pos)
+        except json.JSONDecodeError:
+            return None
+        # A number at the end of the buffer may continue in the next chunk
+        if not self.eof and (end == len(self.buffer) or self.buffer[end] not in _DELIMITERS):
+            return None
+        return value, end
+
+    def read_value(self):
+        """
+            Decodes the next value. Used for the (small) elements of the requested array.
+        """
+        self.peek()
+        while (decoded := self._decode()) is None:
+            if not self._fill():
+                # Raises the decoding error of the truncated value
+                _decoder.raw_decode(self.buffer, self.pos)
+        self.pos = decoded[1]
+        return decoded[0]
+
+    def skip_value(self) -> None:
+        """
+            Skips the next value. If it ends inside the buffer it is decoded (in C, faster than walking it)
+            and dropped. Otherwise it is walked item by item, so memory stays bounded by the buffer.
+        """
+        char: str = self.peek()
+        decoded: tuple = self._decode()
+        if decoded is not None:
+            self.pos = decoded[1]
+            return
+        if char not in "[{":
+            self.read_value()
+            return
+        self.pos += 1
+        closing: str = "]" if char == "[" else "}"
+        first: bool = True
+        while self.next_item(closing, first):
+            first = False
+            if closing == "}":
+                self.read_string()
+                self.expect(":")
+            self.skip_value()
+
+    def next_item(self, closing: str, first: bool) -> bool:
+        """
+            Moves to the next item of an object or array. Returns False at its end.
+        """
+        if self.peek() == closing:
+            self.pos += 1
+            return False
+        if not first:
+            self.expect(",")
+        return True
+
+def _descend(scanner: _Scanner, path: tuple) -> bool:
+    """
+        Moves the scanner to the value at path. Returns False if it does not exist.
+    """
+    for step in path:
+        if isinstance(step, int):
+            scanner.expect("[")
+            index: int = 0
+            first: bool = True
+            found: bool = False
+            while scanner.next_item("]", first):
+                first = False
+                if index == step:
+                    found = True
+                    break
+                scanner.skip_value()
+                index += 1
+        else:
+            scanner.expect("{")
+            first: bool = True
+            found: bool = False
+            while scanner.next_item("}", first):
+                first = False
+                key: str = scanner.read_string()
+                scanner.expect(":")
+                if key == step:
+                    found = True
+                    break
+                scanner.skip_value()
+        if not found:
+            return False
+    return True
+
+def iter_array(fhand, path: tuple, chunk_size: int = CHUNK_SIZE):
+    """
+        Yields the elements of the array found at path (keys of objects and indexes of arrays)
+        in the JSON document read from fhand. Yields nothing if the path does not exist.
+    """
+    scanner: _Scanner = _Scanner(fhand, chunk_size)
+    if not _descend(scanner, path):
+        return
+    scanner.expect("[")
+    first: bool = True
+    while scanner.next_item("]", first):
+        first = False
+        yield scanner.read_value()
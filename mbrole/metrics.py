@@ -0,0 +1,130 @@
+#! /usr/bin/env python3
+
+"""
+    Per-stage instrumentation of a run.
+
+    Each stage records its wall time, CPU time, peak RSS of the process, the modules it imported
+    and counts (rows, categories...) set by the code it wraps. Results are written as JSON, to compare runs and find regressions.
+    cProfile and tracemalloc can also be enabled, and dumped to files.
+
+    When disabled, stage() returns a shared no-op object, so instrumented code pays almost nothing.
+"""
+
+import cProfile
+import json
+import resource
+import sys
+import time
+import tracemalloc
+
+def peak_rss_mb() -> float:
+    """
+        Peak resident memory of the process so far, in MB
+    """
+    peak: int = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kB, macOS bytes
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024
+
+class _NullStage:
+    """
+        Stage of disabled metrics: does nothing
+    """
+
+    def __enter__(self) -> "_NullStage":
+        return self
+
+    def __exit__(self, *args) -> None:
+        pass
+
+    def count(self, **counts) -> None:
+        pass
+
+_NULL_STAGE = _NullStage()
+
+class Stage:
+    """
+        A timed stage. Use count() inside it to record what it processed.
+    """
+
+    def __init__(self, metrics: "Metrics", name: str):
+        self.metrics = metrics
+        self.record: dict = {"stage": name}
+
+    def __enter__(self) -> "Stage":
+        if self.metrics.tracemalloc:
+            tracemalloc.reset_peak()
+        self.modules: int = len(sys.modules)
+        self.wall: float = time.perf_counter()
+        self.cpu: float = time.process_time()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.record["wall_seconds"] = time.perf_counter() - self.wall
+        self.record["cpu_seconds"] = time.process_time() - self.cpu
+        self.record["peak_rss_mb"] = peak_rss_mb()
+        # Imports inside a stage add to its times
+        self.record["modules_loaded"] = len(sys.modules) - self.modules
+        if self.metrics.tracemalloc:
+            self.record["peak_traced_mb"] = tracemalloc.get_traced_memory()[1] / (1 << 20)
+        self.metrics.stages.append(self.record)
+
+    def count(self, **counts) -> None:
+        self.record.update(counts)
+
+class Metrics:
+    """
+        Metrics of a run: a list of stages, and optional cProfile and tracemalloc data.
+
+        Usage:
+            metrics = Metrics(enabled=True)
+            with metrics.stage("enrichment") as stage:
+                ...
+                stage.count(categories=n)
+            metrics.write("metrics.json")
+    """
+
+    def __init__(self, enabled: bool = False, profile: bool = False, trace_memory: bool = False):
+        self.enabled = enabled or profile or trace_memory
+        self.stages: list = []
+        self.profiler: cProfile.Profile = None
+        self.tracemalloc: bool = trace_memory
+        self.start: float = time.perf_counter()
+        self.cpu: float = time.process_time()
+        if trace_memory:
+            tracemalloc.start()
+        if profile:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def stage(self, name: str):
+        if not self.enabled:
+            return _NULL_STAGE
+        return Stage(self, name)
+
+    def summary(self) -> dict:
+        return {"argv": sys.argv,
+                "wall_seconds": time.perf_counter() - self.start,
+                "cpu_seconds": time.process_time() - self.cpu,
+                "peak_rss_mb": peak_rss_mb(),
+                "stages": self.stages}
+
+    def write(self, file: str) -> None:
+        with open(file, "wt") as fhand:
+            json.dump(self.summary(), fhand, indent=1)
+
+    def dump_profile(self, file: str) -> None:
+        """
+            Stops cProfile and writes its stats, to be read with pstats or snakeviz
+        """
+        self.profiler.disable()
+        self.profiler.dump_stats(file)
+
+    def dump_tracemalloc(self, file: str, limit: int = 50) -> None:
+        """
+            Writes the lines with the largest allocations still alive, and stops tracemalloc
+        """
+        statistics: list = tracemalloc.take_snapshot().statistics("lineno")
+        with open(file, "wt") as fhand:
+            for statistic in statistics[:limit]:
+                fhand.write(f"{statistic}\n")
+        tracemalloc.stop()
@@ -0,0 +1,65 @@
+#! /usr/bin/env python3
+
+"""
+    Ontology helpers for the loaders.
+
+    Annotating a compound only with its direct classes (e.g. ChEBI is_a edges) misses every
+    ancestor class, so the closure of the ontology DAG is computed once at load time.
+
+    Nodes are visited in topological order, parents first, so the ancestors of a node are
+    the union of its parents and their (already computed) ancestors: each edge is followed
+    once, instead of a search per node. The ancestors of a node are freed as soon as all its
+    children have been visited, so only those of the current frontier are kept in memory.
+"""
+
+import collections
+import itertools
+import logging
+from typing import Iterable, Iterator
+
+def ancestor_closure(edges: Iterable[tuple[str, str]]) -> Iterator[tuple[str, list[str]]]:
+    """
+        Transitive closure of a DAG given as (child, parent) edges.
+
+        Yields (node, ancestors) for every node with at least one parent, in topological order.
+        Nodes in a cycle can not be ordered: they are logged and skipped, with their descendants.
+    """
+    parents: dict = collections.defaultdict(list)
+    children: dict = collections.defaultdict(list)
+    for child, parent in edges:
+        if child != parent:
+            parents[child].append(parent)
+            children[parent].append(child)
+    for node in parents:
+        parents[node] = list(dict.fromkeys(parents[node]))
+    for node in children:
+        children[node] = list(dict.fromkeys(children[node]))
+    pending_parents: dict = {node: len(x) for node, x in parents.items()}
+    pending_children: dict = {node: len(x) for node, x in children.items()}
+    queue: collections.deque = collections.deque(x for x in children if x not in parents)
+    # Ancestors of the nodes whose children are not all visited
+    ancestors: dict = {}
+    visited: int = 0
+    while queue:
+        node: str = queue.popleft()
+        visited += 1
+        node_parents: list = parents.get(node, [])
+        if len(node_parents) == 1:
+            node_ancestors: tuple = (node_parents[0],) + ancestors[node_parents[0]]
+        else:
+            node_ancestors: tuple = tuple(dict.fromkeys(itertools.chain.from_iterable((x,) + ancestors[x] for x in node_parents)))
+        for parent in node_parents:
+            pending_children[parent] -= 1
+            if pending_children[parent] == 0:
+                del ancestors[parent]
+        if node_ancestors:
+            yield node, list(node_ancestors)
+        if node in children:
+            ancestors[node] = node_ancestors
+            for child in children[node]:
+                pending_parents[child] -= 1
+                if pending_parents[child] == 0:
+                    queue.append(child)
+    total: int = len(set(parents) | set(children))
+    if visited < total:
+        logging.warning(f"{total - visited} nodes are in (or below) a cycle and were not propagated")
@@ -0,0 +1,134 @@
+#! /usr/bin/env python3
+
+"""
+    Writers of the result tables.
+
+    A result table is a dict of column -> NumPy array, one per query (see mbrole.cli.result_table).
+    Tables are written as they come from the statistics, without building a DataFrame:
+        - csv: written in chunks of CHUNK_ROWS rows, so only a chunk is converted to Python objects at a time.
+        - csv.gz, csv.zst: the same, compressed while written. zstd needs Python 3.14 (compression.zstd)
+          or the zstandard package.
+        - parquet, arrow (IPC file): one record batch per query, built from the arrays without copying
+          the numeric columns. They need pyarrow.
+
+    The format is taken from the extension of the output file, unless it is given.
+"""
+
+import csv
+import gzip
+import importlib
+import importlib.util
+
+# Rows converted to Python objects at once when writing CSV
+CHUNK_ROWS = 65536
+# Extension of the files of each format
+FORMATS = {"csv": ".csv",
+           "csv.gz": ".csv.gz",
+           "csv.zst": ".csv.zst",
+           "parquet": ".parquet",
+           "arrow": ".arrow"}
+# Other extensions recognised by format_of
+EXTENSIONS = {".gz": "csv.gz", ".zst": "csv.zst", ".feather": "arrow", ".ipc": "arrow"}
+
+def format_of(path: str, output_format: str = None) -> str:
+    """
+        Format of an output file: the one given or, if None, the one of its extension (csv if unknown)
+    """
+    if output_format:
+        return output_format
+    for name, extension in sorted(FORMATS.items(), key=lambda x: -len(x[1])):
+        if path.endswith(extension):
+            return name
+    for extension, name in EXTENSIONS.items():
+        if path.endswith(extension):
+            return name
+    return "csv"
+
+def _zstd():
+    """
+        Module with a zstd open(), from the standard library or the zstandard package. None if neither is installed.
+    """
+    for name in ("compression.zstd", "zstandard"):
+        try:
+            return importlib.import_module(name)
+        except ImportError:
+            continue
+    return None
+
+def check_format(output_format: str) -> None:
+    """
+        Raises ImportError if the optional package needed to write the format is not installed
+    """
+    if output_format == "csv.zst" and _zstd() is None:
+        raise ImportError("Writing csv.zst needs Python 3.14 or the zstandard package")
+    if output_format in ("parquet", "arrow") and importlib.util.find_spec("pyarrow") is None:
+        raise ImportError(f"Writing {output_format} needs the pyarrow package")
+
+def open_text(path: str, output_format: str = "csv"):
+    """
+        Opens a CSV output file for writing text, compressed as the format says
+    """
+    if output_format == "csv.gz":
+        return gzip.open(path, "wt", newline="", encoding="utf-8")
+    if output_format == "csv.zst":
+        check_format(output_format)
+        return _zstd().open(path, "wt", newline="", encoding="utf-8")
+    return open(path, "w", newline="")
+
+def write_csv(fhand, results: dict[str, dict], query_column: bool = False, chunk_rows: int = CHUNK_ROWS) -> None:
+    """
+        Writes result tables as CSV, straight from their arrays. Columns are those of the first table.
+        With query_column, the tables are written one after the other with the query name as first column.
+    """
+    columns: tuple = tuple(next(iter(results.values()))) if results else ()
+    writer = csv.writer(fhand, lineterminator="\n")
+    writer.writerow((("query",) if query_column else ()) + columns)
+    for name, table in results.items():
+        prefix: tuple = (name,) if query_column else ()
+        size: int = len(table[columns[0]]) if columns else 0
+        for start in range(0, size, chunk_rows):
+            chunk = zip(*(table[x][start:start + chunk_rows].tolist() for x in columns))
+            writer.writerows(prefix + row for row in chunk)
+
+def _record_batch(pa, table: dict, columns: tuple, query: str = None):
+    """
+        pyarrow RecordBatch of a result table. Numeric arrays are wrapped without copying,
+        text columns (object arrays) are converted to strings.
+    """
+    size: int = len(table[columns[0]]) if columns else 0
+    arrays: list = [pa.repeat(pa.scalar(query, pa.string()), size)] if query is not None else []
+    for name in columns:
+        column = table[name]
+        arrays.append(pa.array(column, type=pa.string()) if column.dtype == object else pa.array(column))
+    return pa.RecordBatch.from_arrays(arrays, names=(["query"] if query is not None else []) + list(columns))
+
+def write_arrow(path: str, results: dict[str, dict], output_format: str = "parquet", query_column: bool = False) -> None:
+    """
+        Writes result tables as Parquet or Arrow IPC, one record batch per query, streamed to the file
+    """
+    check_format(output_format)
+    import pyarrow as pa
+    columns: tuple = tuple(next(iter(results.values()))) if results else ()
+    batches = (_record_batch(pa, table, columns, name if query_column else None) for name, table in results.items())
+    first = next(batches, None)
+    if first is None:
+        first = pa.RecordBatch.from_arrays([], names=[])
+    if output_format == "parquet":
+        import pyarrow.parquet as pq
+        writer = pq.ParquetWriter(path, first.schema)
+    else:
+        writer = pa.ipc.new_file(path, first.schema)
+    with writer:
+        writer.write_batch(first)
+        for batch in batches:
+            writer.write_batch(batch)
+
+def write_tables(path: str, results: dict[str, dict], output_format: str = None, query_column: bool = False) -> None:
+    """
+        Writes result tables to a file, in the given format or the one of its extension (see format_of)
+    """
+    output_format = format_of(path, output_format)
+    if output_format in ("parquet", "arrow"):
+        return write_arrow(path, results, output_format, query_column)
+    with open_text(path, output_format) as fhand:
+        write_csv(fhand, results, query_column)
@@ -0,0 +1,114 @@
+#! /usr/bin/env python3
+
+"""
+    Multiprocess enrichment.
+
+    The CSR arrays of the AnnotationMatrix are copied once into shared memory blocks.
+    Worker processes attach to them instead of receiving a pickled copy of the annotation,
+    and each one tests a chunk of contiguous categories. Only the raw p-values are computed
+    in the workers: FDR correction is done afterwards on the whole family, so results are
+    the same as in a serial run.
+"""
+
+import concurrent.futures
+import logging
+from multiprocessing import shared_memory
+
+import numpy as np
+import scipy.sparse
+
+from mbrole import functional_enrichment
+from mbrole.incidence import AnnotationMatrix
+
+# Annotation attached by each worker process
+_worker_matrix: scipy.sparse.csr_array = None
+_worker_blocks: list = []
+
+class SharedAnnotation:
+    """
+        Context manager that places the CSR arrays of an AnnotationMatrix in shared memory.
+
+        The descriptor attribute holds what a worker needs to attach to them (see _attach).
+        Blocks are released when the context exits.
+    """
+
+    def __init__(self, annotation: AnnotationMatrix):
+        self.annotation = annotation
+        self.blocks: list = []
+        self.descriptor: dict = None
+
+    def __enter__(self) -> "SharedAnnotation":
+        arrays: dict = {}
+        for key in ("indptr", "indices"):
+            array: np.ndarray = getattr(self.annotation.matrix, key)
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            shared = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+            shared[:] = array
+            self.blocks.append(block)
+            arrays[key] = (block.name, array.shape, array.dtype.str)
+        self.descriptor = {"arrays": arrays, "shape": self.annotation.matrix.shape}
+        return self
+
+    def __exit__(self, *args) -> None:
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+def _attach(descriptor: dict) -> None:
+    """
+        Worker initializer: maps the shared CSR arrays as the annotation of this process
+    """
+    global _worker_matrix
+    arrays: dict = {}
+    for key, (name, shape, dtype) in descriptor["arrays"].items():
+        block = shared_memory.SharedMemory(name=name)
+        _worker_blocks.append(block)
+        arrays[key] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+    data = np.ones(arrays["indices"].shape, dtype=np.int8)
+    _worker_matrix = scipy.sparse.csr_array((data, arrays["indices"], arrays["indptr"]), shape=descriptor["shape"], copy=False)
+
+def _enrich_chunk(start: int, end: int, queries: scipy.sparse.csc_array, query_sizes: np.ndarray, background: np.ndarray, background_size: int, alternative: str, prune: float = None) -> tuple[int, np.ndarray, np.ndarray]:
+    """
+        Tests the categories between start and end of the attached annotation against every query
+    """
+    matrix: scipy.sparse.csr_array = _worker_matrix[start:end]
+    genes_from_query_in_set = np.asarray((matrix @ queries).toarray(), dtype=np.int64)
+    genes_from_background_in_set = np.asarray(matrix @ background, dtype=np.int64)[:, None]
+    pvalues = functional_enrichment.enrichment_pvalues(genes_from_query_in_set, genes_from_background_in_set,
+                                                       query_sizes[None, :] - genes_from_query_in_set, background_size - genes_from_background_in_set, alternative,
+                                                       prune=prune)
+    return start, genes_from_query_in_set, pvalues
+
+def _chunks(indptr: np.ndarray, n: int) -> list[tuple[int, int]]:
+    """
+        Splits the rows of a CSR matrix in at most n contiguous chunks with a similar number of non-zero values
+    """
+    rows: int = len(indptr) - 1
+    if rows == 0:
+        return []
+    bounds = np.searchsorted(indptr, np.linspace(0, indptr[-1], n + 1), side="left")
+    bounds[0], bounds[-1] = 0, rows
+    bounds = np.unique(np.clip(bounds, 0, rows))
+    return [(int(x), int(y)) for x, y in zip(bounds[:-1], bounds[1:]) if y > x]
+
+def parallel_functional_enrichment(queries: list, annotation: AnnotationMatrix, background: set, workers: int, alternative: str = "two-sided", chunks_per_worker: int = 4, prune: float = None) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+        Same as functional_enrichment.multi_query_functional_enrichment, with the categories split
+        across a pool of worker processes. prune is passed to enrichment_pvalues.
+    """
+    query_matrix = annotation.indicator_matrix(queries)
+    query_sizes = np.array([len(x) for x in queries], dtype=np.int64)
+    background_vector = annotation.indicator(background).astype(np.int64)
+    genes_from_query_in_set = np.zeros((len(annotation), len(queries)), dtype=np.int64)
+    pvalues = np.ones((len(annotation), len(queries)), dtype=float)
+    chunks: list = _chunks(annotation.matrix.indptr, workers * chunks_per_worker)
+    logging.info(f"Testing {len(annotation)} categories in {len(chunks)} chunks with {workers} workers")
+    with SharedAnnotation(annotation) as shared:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_attach, initargs=(shared.descriptor,)) as pool:
+            futures = [pool.submit(_enrich_chunk, start, end, query_matrix, query_sizes, background_vector, len(background), alternative, prune) for start, end in chunks]
+            for future in concurrent.futures.as_completed(futures):
+                start, in_set, pvals = future.result()
+                genes_from_query_in_set[start:start + len(in_set)] = in_set
+                pvalues[start:start + len(pvals)] = pvals
+    return annotation.names, genes_from_query_in_set, annotation.sizes, pvalues
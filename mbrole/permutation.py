@@ -0,0 +1,136 @@
+#! /usr/bin/env python3
+
+"""
+    Permutation enrichment.
+
+    Random query sets of the size of the query are drawn from the background, and the p-value of
+    every category is computed for each of them. The empirical p-value of a category is the fraction
+    of draws where it is as extreme as in the query, (1 + count) / (N + 1). As all the categories are
+    tested on the same draws, the minimum p-value of each draw gives a family-wise correction that
+    accounts for the overlap between categories (Westfall-Young min-p).
+
+    Query and background sizes are fixed, so the p-value of a category only depends on its overlap
+    with the draw: it is precomputed for every possible overlap, and each draw costs a sparse product
+    and a lookup. Draws are made in blocks, each one with its own seed spawned from the seed of the run,
+    so results are the same whatever the number of worker processes.
+"""
+
+import concurrent.futures
+import logging
+
+import numpy as np
+import scipy.sparse
+
+from mbrole import functional_enrichment, parallel
+from mbrole.incidence import AnnotationMatrix
+
+# Permutations drawn together, with the same random generator
+BLOCK_SIZE = 128
+
+class PValueLookup:
+    """
+        p-value of each category for each possible overlap with a query of the given size.
+        Overlaps of category i are in values[offsets[i]:offsets[i + 1]].
+    """
+
+    def __init__(self, background_in_set: np.ndarray, query_size: int, background_size: int, alternative: str = "two-sided"):
+        self.maximum = np.minimum(background_in_set, query_size)
+        support = self.maximum + 1
+        self.offsets = np.concatenate(([0], np.cumsum(support))).astype(np.int64)
+        category = np.repeat(np.arange(len(support)), support)
+        overlap = np.arange(self.offsets[-1]) - self.offsets[category]
+        in_set = background_in_set[category]
+        self.values = np.ones(len(overlap), dtype=float)
+        # As in enrichment_pvalues, categories without compounds of the query get a p-value of 1
+        tested = overlap > 0
+        self.values[tested] = functional_enrichment.fisher_exact_batch(overlap[tested], in_set[tested], query_size - overlap[tested],
+                                                                       background_size - in_set[tested], alternative,
+                                                                       functional_enrichment.LogFactorial(query_size + background_size))
+
+    def __call__(self, overlap: np.ndarray) -> np.ndarray:
+        """
+            p-values of category x draw overlaps. Overlaps above the largest possible one of a
+            draw (with compounds of the query outside the background) are taken as the largest.
+        """
+        overlap = np.minimum(overlap, self.maximum.reshape((-1,) + (1,) * (overlap.ndim - 1)))
+        offsets = self.offsets[:-1].reshape((-1,) + (1,) * (overlap.ndim - 1))
+        return self.values[offsets + overlap]
+
+def _draws(rng: np.random.Generator, columns: np.ndarray, compounds: int, query_size: int, permutations: int) -> scipy.sparse.csc_array:
+    """
+        compound x draw indicator matrix of random sets of query_size compounds of the background.
+        columns holds the column of each background compound in the annotation, -1 if it is not annotated.
+    """
+    rows: list = []
+    for _ in range(permutations):
+        found = columns[rng.choice(len(columns), query_size, replace=False)]
+        rows.append(found[found >= 0])
+    sizes = [len(x) for x in rows]
+    data = np.ones(sum(sizes), dtype=np.int32)
+    indptr = np.concatenate(([0], np.cumsum(sizes)))
+    return scipy.sparse.csc_array((data, np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64), indptr), shape=(compounds, permutations))
+
+def _permute(matrix: scipy.sparse.csr_array, seeds: list, permutations: list, columns: np.ndarray, query_size: int,
+             lookup: PValueLookup, observed: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+        Runs blocks of draws, one per seed. Returns, for each category, the number of draws with a p-value
+        as small as the observed one, and the minimum p-value of each draw.
+    """
+    exceed = np.zeros(matrix.shape[0], dtype=np.int64)
+    min_pvalues: list = []
+    threshold = observed * (1 + functional_enrichment.RELATIVE_ERROR)
+    for seed, block in zip(seeds, permutations):
+        draws = _draws(np.random.default_rng(seed), columns, matrix.shape[1], query_size, block)
+        pvalues = lookup(np.asarray((matrix @ draws).toarray(), dtype=np.int64))
+        exceed += np.count_nonzero(pvalues <= threshold[:, None], axis=1)
+        min_pvalues.append(pvalues.min(axis=0, initial=1.0))
+    return exceed, np.concatenate(min_pvalues) if min_pvalues else np.zeros(0)
+
+def _permute_shared(*args) -> tuple[np.ndarray, np.ndarray]:
+    """
+        _permute on the annotation attached by the worker (see parallel._attach)
+    """
+    return _permute(parallel._worker_matrix, *args)
+
+def permutation_enrichment(genes_in_query: set, annotation: AnnotationMatrix, background: set, permutations: int,
+                           seed=None, workers: int = 1, alternative: str = "two-sided") -> tuple[np.ndarray, np.ndarray]:
+    """
+        Empirical p-values of every category of the AnnotationMatrix for the query, from permutations
+        random sets of the same size drawn from the background.
+
+        seed is an int or a numpy.random.SeedSequence, for reproducible results. With workers > 1,
+        blocks of draws are split across a pool of processes.
+
+        Returns the empirical p-values and the family-wise (min-p) adjusted p-values, one per category.
+    """
+    seed_sequence = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    logging.info(f"Permutation seed: {seed_sequence.entropy}")
+    query_size: int = len(genes_in_query)
+    if query_size > len(background):
+        raise ValueError(f"Cannot draw sets of {query_size} compounds from a background of {len(background)}")
+    index: dict = annotation.compound_index
+    # Sorted, so draws do not depend on the iteration order of the set
+    columns = np.fromiter((index.get(x, -1) for x in sorted(background)), dtype=np.int64, count=len(background))
+    background_in_set = annotation.overlap(annotation.indicator(background))
+    lookup = PValueLookup(background_in_set, query_size, len(background), alternative)
+    observed = lookup(annotation.overlap(annotation.indicator(genes_in_query)))
+    blocks: list = [min(BLOCK_SIZE, permutations - x) for x in range(0, permutations, BLOCK_SIZE)]
+    seeds: list = seed_sequence.spawn(len(blocks))
+    if workers > 1 and len(blocks) > 1:
+        groups: list = [slice(x, len(blocks), workers) for x in range(min(workers, len(blocks)))]
+        exceed = np.zeros(len(annotation), dtype=np.int64)
+        min_pvalues: list = []
+        with parallel.SharedAnnotation(annotation) as shared:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=parallel._attach, initargs=(shared.descriptor,)) as pool:
+                futures = [pool.submit(_permute_shared, seeds[x], blocks[x], columns, query_size, lookup, observed) for x in groups]
+                for future in futures:
+                    counts, minimum = future.result()
+                    exceed += counts
+                    min_pvalues.append(minimum)
+        min_pvalues = np.concatenate(min_pvalues)
+    else:
+        exceed, min_pvalues = _permute(annotation.matrix, seeds, blocks, columns, query_size, lookup, observed)
+    empirical = (1 + exceed) / (permutations + 1)
+    min_pvalues.sort()
+    family_wise = (1 + np.searchsorted(min_pvalues, observed * (1 + functional_enrichment.RELATIVE_ERROR), side="right")) / (permutations + 1)
+    return empirical, family_wise
@@ -0,0 +1,135 @@
+#! /usr/bin/env python3
+
+"""
+    Redundant categories.
+
+    Merged databases hold many categories with the same compounds: the same pathway as a KEGG map and as
+    an organism pathway, ontology classes with a single child, copies of a pathway in several sources...
+
+    Categories with the same compounds are found by hashing their sorted compound columns (blake2b, 128 bits):
+    each distinct set is tested once, and its result given to every category with that set (see deduplicate).
+
+    Near duplicates are grouped with MinHash signatures and locality-sensitive hashing (see cluster_categories):
+    categories sharing a band of their signature are candidates, candidates whose exact Jaccard index reaches
+    the threshold are linked, and each cluster is a connected group of linked categories.
+"""
+
+import hashlib
+import itertools
+import logging
+
+import numpy as np
+import scipy.sparse
+import scipy.sparse.csgraph
+
+from mbrole.incidence import AnnotationMatrix
+
+# Hash functions of the MinHash signatures
+NUM_PERMUTATIONS = 64
+# Mersenne prime 2^31 - 1, modulus of the MinHash functions: products of two residues fit in 64 bits
+_PRIME = (1 << 31) - 1
+
+def set_hashes(annotation: AnnotationMatrix) -> np.ndarray:
+    """
+        128-bit hash of the sorted compound columns of each category, as a categories x 2 uint64 array
+    """
+    matrix: scipy.sparse.csr_array = annotation.matrix if annotation.matrix.has_sorted_indices else annotation.matrix.sorted_indices()
+    indices = matrix.indices.astype(np.int64)
+    hashes = np.empty((len(annotation), 2), dtype=np.uint64)
+    for row in range(len(annotation)):
+        digest: bytes = hashlib.blake2b(indices[matrix.indptr[row]:matrix.indptr[row + 1]].tobytes(), digest_size=16).digest()
+        hashes[row] = np.frombuffer(digest, dtype=np.uint64)
+    return hashes
+
+def deduplicate(annotation: AnnotationMatrix) -> tuple[np.ndarray, np.ndarray]:
+    """
+        Distinct compound sets of the categories. Returns the first category with each set, in order,
+        and for every category the position of its set in them: results computed on annotation.select(rows)
+        are fanned out to every category with result[inverse].
+    """
+    if len(annotation) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    _, first, inverse = np.unique(set_hashes(annotation), axis=0, return_index=True, return_inverse=True)
+    # Sets in the order of their first category
+    order = np.argsort(first, kind="stable")
+    position = np.empty(len(order), dtype=np.int64)
+    position[order] = np.arange(len(order))
+    return first[order], position[inverse.reshape(-1)]
+
+def minhash_signatures(matrix: scipy.sparse.csr_array, num_permutations: int = NUM_PERMUTATIONS, seed: int = 0) -> np.ndarray:
+    """
+        categories x num_permutations MinHash signatures: the minimum of each random hash function
+        (a * column + b) mod _PRIME over the compound columns of a category. Empty categories get _PRIME.
+    """
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, _PRIME, num_permutations, dtype=np.uint64)
+    b = rng.integers(0, _PRIME, num_permutations, dtype=np.uint64)
+    signatures = np.full((matrix.shape[0], num_permutations), _PRIME, dtype=np.uint64)
+    nonempty = np.flatnonzero(np.diff(matrix.indptr) > 0)
+    if nonempty.size == 0:
+        return signatures
+    columns = matrix.indices.astype(np.uint64)
+    for k in range(num_permutations):
+        # Empty rows have no values, so each segment is the row starting at its offset
+        signatures[nonempty, k] = np.minimum.reduceat((a[k] * columns + b[k]) % np.uint64(_PRIME), matrix.indptr[nonempty])
+    return signatures
+
+def _bands(threshold: float, num_permutations: int) -> int:
+    """
+        Rows per band of the signatures: the largest one whose LSH threshold (1 / bands) ^ (1 / rows) is
+        below the Jaccard threshold, so similar pairs are rarely missed. False candidates are discarded later.
+    """
+    best: int = 1
+    for rows in range(1, num_permutations + 1):
+        if num_permutations % rows == 0 and (rows / num_permutations) ** (1 / rows) <= threshold:
+            best = rows
+    return best
+
+def _candidate_pairs(signatures: np.ndarray, rows: int) -> np.ndarray:
+    """
+        Pairs of categories with the same values in some band of their signatures, as a pairs x 2 array
+    """
+    pairs: set = set()
+    for start in range(0, signatures.shape[1], rows):
+        _, inverse = np.unique(signatures[:, start:start + rows], axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        order = np.argsort(inverse, kind="stable")
+        bounds = np.flatnonzero(np.diff(inverse[order])) + 1
+        for bucket in np.split(order, bounds):
+            if len(bucket) > 1:
+                pairs.update(itertools.combinations(bucket.tolist(), 2))
+    return np.array(sorted(pairs), dtype=np.int64).reshape(-1, 2)
+
+def jaccard(matrix: scipy.sparse.csr_array, first: np.ndarray, second: np.ndarray) -> np.ndarray:
+    """
+        Exact Jaccard index of the compound sets of pairs of categories (rows of the matrix)
+    """
+    sizes = np.diff(matrix.indptr).astype(np.int64)
+    shared = np.asarray(matrix[first].multiply(matrix[second]).astype(np.int64).sum(axis=1)).reshape(-1)
+    union = sizes[first] + sizes[second] - shared
+    return np.divide(shared, union, out=np.zeros(len(shared), dtype=float), where=union > 0)
+
+def cluster_categories(annotation: AnnotationMatrix, threshold: float, num_permutations: int = NUM_PERMUTATIONS, seed: int = 0) -> np.ndarray:
+    """
+        Cluster of each category: categories linked by a Jaccard index of at least threshold, directly or through
+        other categories, share a cluster. Categories with the same compounds always do. Clusters are numbered
+        from 0 in the order of their first category; categories without similar ones are clusters of their own.
+    """
+    if len(annotation) == 0:
+        return np.zeros(0, dtype=np.int64)
+    rows, inverse = deduplicate(annotation)
+    matrix: scipy.sparse.csr_array = annotation.select(rows).matrix
+    nonempty = np.flatnonzero(np.diff(matrix.indptr) > 0)
+    candidates = _candidate_pairs(minhash_signatures(matrix[nonempty], num_permutations, seed), _bands(threshold, num_permutations))
+    pairs = nonempty[candidates]
+    linked = pairs[jaccard(matrix, pairs[:, 0], pairs[:, 1]) >= threshold] if len(pairs) else pairs
+    logging.info(f"{len(annotation)} categories, {len(rows)} distinct sets, {len(candidates)} candidate pairs, {len(linked)} above {threshold}")
+    graph = scipy.sparse.coo_array((np.ones(len(linked)), (linked[:, 0], linked[:, 1])), shape=(len(rows), len(rows)))
+    _, labels = scipy.sparse.csgraph.connected_components(graph, directed=False)
+    labels = labels[inverse]
+    # Number clusters by their first category
+    _, first, labels = np.unique(labels, return_index=True, return_inverse=True)
+    order = np.argsort(first, kind="stable")
+    position = np.empty(len(order), dtype=np.int64)
+    position[order] = np.arange(len(order))
+    return position[labels.reshape(-1)]
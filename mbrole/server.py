@@ -0,0 +1,215 @@
+#! /usr/bin/env python3
+
+"""
+    Enrichment server.
+
+    Keeps annotation DBs loaded in memory between analyses, so a pipeline can send many
+    queries without paying the start-up and loading cost every time.
+
+    It speaks a minimal HTTP/1.1 over TCP or a Unix socket:
+        - GET /health: status and loaded DBs.
+        - POST /enrich: runs an analysis. The body is a JSON object with:
+            - compounds: list of compounds of the query (mandatory).
+            - db_file: SQLite file with the annotation, one of the --db_file of the server. Defaults to the first one.
+            - table: must be the --table of the server, if given.
+            - annotation, database, background, pval, all: as in the command line.
+              background is a list of compounds; if missing, all compounds of the table are used.
+            - format: "csv" (default) or "json".
+
+    Loaded DBs are kept in an LRU cache. Analyses run in a thread pool, so requests are served concurrently.
+
+    Only the DB files and table given on start-up are served: other db_file or table values are refused (403),
+    so requests cannot open other files of the host or reach SQL through the table name.
+"""
+
+import argparse
+import asyncio
+import collections
+import io
+import json
+import logging
+import os
+import re
+
+import mbrole.cli
+import mbrole.functional_enrichment
+import mbrole.output
+import mbrole.snapshot
+from mbrole.annotation import AnnotationStore
+from mbrole.incidence import AnnotationMatrix
+
+MAX_BODY = 64 << 20
+# Table names are put into SQL, so only plain identifiers are accepted
+TABLE_NAME = re.compile(r"^\w+$")
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+class AnnotationCache:
+    """
+        LRU cache of loaded annotation tables, keyed by (db_file, table).
+
+        An entry is reloaded if its SQLite file changed since it was loaded.
+    """
+
+    def __init__(self, maxsize: int = 4):
+        self.maxsize = maxsize
+        self.entries: collections.OrderedDict = collections.OrderedDict()
+        self.locks: dict = collections.defaultdict(asyncio.Lock)
+
+    @staticmethod
+    def _load(db_file: str, table: str) -> AnnotationMatrix:
+        annotation: AnnotationMatrix = mbrole.snapshot.load_snapshot(db_file, table)
+        if annotation is None:
+            with AnnotationStore(db_file, table) as store:
+                annotation = store.annotation_matrix()
+        return annotation
+
+    async def get(self, db_file: str, table: str) -> tuple[AnnotationMatrix, set]:
+        """
+            Annotation matrix of the table and the set of all its compounds (default background)
+        """
+        key: tuple = (os.path.abspath(db_file), table)
+        if not os.path.isfile(key[0]):
+            raise HTTPError(404, f"db_file not found: {db_file}")
+        async with self.locks[key]:
+            stat = os.stat(key[0])
+            version: tuple = (stat.st_size, stat.st_mtime_ns)
+            if key in self.entries and self.entries[key][0] == version:
+                self.entries.move_to_end(key)
+                return self.entries[key][1]
+            logging.info(f"Loading annotation {key}")
+            annotation: AnnotationMatrix = await asyncio.get_running_loop().run_in_executor(None, self._load, *key)
+            self.entries[key] = (version, (annotation, set(annotation.compounds)))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                evicted, _ = self.entries.popitem(last=False)
+                logging.info(f"Evicting annotation {evicted}")
+                # Locks of evicted entries are dropped, unless a request is waiting on them
+                if not self.locks[evicted].locked():
+                    del self.locks[evicted]
+            return self.entries[key][1]
+
+def enrich(annotation: AnnotationMatrix, all_compounds: set, request: dict) -> tuple[str, bytes]:
+    """
+        Runs the analysis described by a request. Returns the content type and body of the response.
+    """
+    compounds: set = set(request.get("compounds") or [])
+    if len(compounds) == 0:
+        raise HTTPError(400, "Empty query: compounds is mandatory")
+    if request.get("annotation"):
+        annotation = annotation.for_annotations(request["annotation"])
+    else:
+        annotation = annotation.for_databases(request.get("database") or [])
+    background: set = set(request["background"]) if request.get("background") else all_compounds
+    options = argparse.Namespace(all=bool(request.get("all", False)), pval=float(request.get("pval", 0.05)))
+    names, in_set, in_annotation, pvals = mbrole.functional_enrichment.matrix_functional_enrichment(compounds, annotation, background,
+                                                                                                   prune=None if options.all else options.pval)
+    table: dict = mbrole.cli.result_table(names, in_set, in_annotation, pvals, options)
+    if request.get("format", "csv") == "json":
+        records: list = [dict(zip(mbrole.cli.RESULT_COLUMNS, row)) for row in zip(*(table[x].tolist() for x in mbrole.cli.RESULT_COLUMNS))]
+        return "application/json", json.dumps(records).encode("utf-8")
+    fhand = io.StringIO()
+    mbrole.output.write_csv(fhand, {"": table})
+    return "text/csv", fhand.getvalue().encode("utf-8")
+
+class EnrichmentServer:
+    """
+        asyncio server answering enrichment requests against cached annotation DBs
+    """
+
+    def __init__(self, db_files: list = None, table: str = "mbrole", cache_size: int = 4):
+        if not TABLE_NAME.match(table):
+            raise ValueError(f"Invalid table name: {table}")
+        self.db_files: list = db_files or []
+        self.allowed: set = {os.path.abspath(x) for x in self.db_files}
+        self.table = table
+        self.cache = AnnotationCache(cache_size)
+
+    async def preload(self) -> None:
+        for db_file in self.db_files:
+            await self.cache.get(db_file, self.table)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_line: bytes = await reader.readline()
+                if not request_line:
+                    break
+                keep_alive: bool = await self._respond(request_line, reader, writer)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, request_line: bytes, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bool:
+        headers: dict = {}
+        while True:
+            line: bytes = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            key, _, value = line.decode("latin-1").partition(":")
+            headers[key.strip().lower()] = value.strip()
+        keep_alive: bool = headers.get("connection", "").lower() != "close"
+        try:
+            method, path, _ = request_line.decode("latin-1").split()
+            length: int = int(headers.get("content-length", 0))
+            if length > MAX_BODY:
+                raise HTTPError(413, "Request too large")
+            body: bytes = await reader.readexactly(length) if length else b""
+            content_type, content = await self._route(method, path, body)
+            status = 200
+        except HTTPError as e:
+            status, content_type, content = e.status, "application/json", json.dumps({"error": e.message}).encode("utf-8")
+        except ValueError as e:
+            status, content_type, content = 400, "application/json", json.dumps({"error": str(e)}).encode("utf-8")
+        except Exception as e:
+            logging.exception("Error serving request")
+            status, content_type, content = 500, "application/json", json.dumps({"error": str(e)}).encode("utf-8")
+        reason: str = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large"}.get(status, "Internal Server Error")
+        writer.write((f"HTTP/1.1 {status} {reason}\r\nContent-Type: {content_type}\r\nContent-Length: {len(content)}\r\n"
+                      f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode("latin-1") + content)
+        return keep_alive
+
+    async def _route(self, method: str, path: str, body: bytes) -> tuple[str, bytes]:
+        if path == "/health":
+            loaded: list = [{"db_file": x[0], "table": x[1]} for x in self.cache.entries]
+            return "application/json", json.dumps({"status": "ok", "loaded": loaded}).encode("utf-8")
+        if path != "/enrich":
+            raise HTTPError(404, f"Unknown path {path}")
+        if method != "POST":
+            raise HTTPError(405, "Use POST for /enrich")
+        request: dict = json.loads(body or b"{}")
+        db_file: str = request.get("db_file") or (self.db_files[0] if self.db_files else None)
+        if db_file is None:
+            raise HTTPError(400, "db_file is mandatory")
+        if not isinstance(db_file, str) or os.path.abspath(db_file) not in self.allowed:
+            raise HTTPError(403, f"db_file is not served: {db_file}")
+        table = request.get("table", self.table)
+        if not isinstance(table, str) or not TABLE_NAME.match(table):
+            raise HTTPError(400, f"Invalid table name: {table}")
+        if table != self.table:
+            raise HTTPError(403, f"table is not served: {table}")
+        annotation, all_compounds = await self.cache.get(db_file, table)
+        return await asyncio.get_running_loop().run_in_executor(None, enrich, annotation, all_compounds, request)
+
+    async def start(self, host: str = None, port: int = None, socket_path: str = None) -> asyncio.AbstractServer:
+        await self.preload()
+        if socket_path:
+            server = await asyncio.start_unix_server(self.handle, path=socket_path)
+            logging.info(f"Listening on {socket_path}")
+        else:
+            server = await asyncio.start_server(self.handle, host=host, port=port)
+            logging.info(f"Listening on {host}:{port}")
+        return server
+
+    async def serve_forever(self, host: str = None, port: int = None, socket_path: str = None) -> None:
+        server: asyncio.AbstractServer = await self.start(host, port, socket_path)
+        async with server:
+            await server.serve_forever()
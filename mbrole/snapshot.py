@@ -0,0 +1,236 @@
+#! /usr/bin/env python3
+
+"""
+    Precompiled annotation snapshots.
+
+    A snapshot stores an AnnotationMatrix next to its SQLite file, so the analysis does not
+    need to query and rebuild the annotation on every run. It is a directory with:
+        - meta.json: format version, table, fingerprint of the SQLite file, the databases and their generations.
+        - indptr.npy, indices.npy, category_database.npy: the CSR arrays of the matrix.
+        - compounds.npy, names.npy: interned strings, as a NUL separated UTF-8 buffer, and
+          compounds.offsets.npy, names.offsets.npy: the offset of each string in it (see StringTable).
+
+    Arrays are loaded memory-mapped, and strings are decoded when first used, so loading does not
+    grow with the size of the annotation. A snapshot is used as is while the SQLite file it was compiled
+    from keeps its size and mtime. Otherwise, the generations of its sources tell which ones changed
+    through the loaders: only their categories are reloaded from SQLite, the rest still come from the snapshot.
+    Plain tables of older loaders have no generations: their snapshot stores the SHA-256 of the file instead.
+    Changes that leave every generation as it was (organism backgrounds, the id map...) do not touch
+    the annotation: the fingerprint in meta.json is updated, and the snapshot is used as is.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import os.path
+
+import numpy as np
+import scipy.sparse
+
+import mbrole.database
+from mbrole.annotation import AnnotationStore
+from mbrole.incidence import AnnotationMatrix
+
+FORMAT_VERSION = 2
+SEPARATOR = "\0"
+
+def snapshot_path(db_file: str, table: str) -> str:
+    return f"{db_file}.{table}.snapshot"
+
+def _file_hash(file: str) -> str:
+    digest = hashlib.sha256()
+    with open(file, "rb") as fhand:
+        for chunk in iter(lambda: fhand.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def fingerprint(db_file: str, with_hash: bool = True) -> dict:
+    """
+        Size, modification time and (optionally) SHA-256 of the SQLite file
+    """
+    stat = os.stat(db_file)
+    result: dict = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if with_hash:
+        result["sha256"] = _file_hash(db_file)
+    return result
+
+class StringTable:
+    """
+        Strings of a snapshot, memory-mapped: their UTF-8 bytes, each one followed by SEPARATOR, and the offset
+        where each one starts. A string is read without decoding the others, and decode() decodes all of them
+        at once, the first time it is called (see AnnotationMatrix.compounds and names).
+    """
+
+    def __init__(self, offsets: np.ndarray, data: np.ndarray):
+        self.offsets = offsets
+        self.data = data
+        self._decoded: np.ndarray = None
+
+    @staticmethod
+    def save(path: str, name: str, strings) -> None:
+        encoded: list = [x.encode("utf-8") + SEPARATOR.encode("utf-8") for x in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(x) for x in encoded])
+        np.save(os.path.join(path, f"{name}.offsets.npy"), offsets)
+        np.save(os.path.join(path, f"{name}.npy"), np.frombuffer(b"".join(encoded), dtype=np.uint8))
+
+    @classmethod
+    def load(cls, path: str, name: str) -> "StringTable":
+        offsets = np.load(os.path.join(path, f"{name}.offsets.npy"), mmap_mode="r")
+        # Empty files cannot be memory-mapped
+        data = np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") if offsets[-1] else np.zeros(0, dtype=np.uint8)
+        return cls(offsets, data)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return self.data[self.offsets[i]:self.offsets[i + 1] - 1].tobytes().decode("utf-8")
+
+    def decode(self) -> np.ndarray:
+        if self._decoded is None:
+            self._decoded = np.empty(len(self), dtype=object)
+            if len(self):
+                self._decoded[:] = self.data[:-1].tobytes().decode("utf-8").split(SEPARATOR)
+        return self._decoded
+
+def compile_snapshot(db_file: str, table: str) -> str:
+    """
+        Loads the whole annotation table and writes its snapshot.
+
+        Returns the path of the snapshot.
+    """
+    with AnnotationStore(db_file, table) as store:
+        # Only plain tables, without generations, need the hash of the file to tell changes apart
+        source: dict = fingerprint(db_file, with_hash=not mbrole.database.is_normalised(store.conn, table))
+        matrix: AnnotationMatrix = store.annotation_matrix()
+        generations: dict = mbrole.database.source_generations(store.conn, table)
+    path: str = snapshot_path(db_file, table)
+    os.makedirs(path, exist_ok=True)
+    # Meta is written last and removed first, so a partial snapshot is never considered valid
+    if os.path.exists(os.path.join(path, "meta.json")):
+        os.remove(os.path.join(path, "meta.json"))
+    np.save(os.path.join(path, "indptr.npy"), matrix.matrix.indptr)
+    np.save(os.path.join(path, "indices.npy"), matrix.matrix.indices)
+    np.save(os.path.join(path, "category_database.npy"), matrix.category_database)
+    StringTable.save(path, "compounds", matrix.compounds)
+    StringTable.save(path, "names", matrix.names)
+    meta: dict = {"format": FORMAT_VERSION,
+                  "table": table,
+                  "source": source,
+                  "databases": list(matrix.databases),
+                  "generations": generations,
+                  "compounds": len(matrix.compounds),
+                  "categories": len(matrix)}
+    _write_meta(path, meta)
+    logging.info(f"Snapshot of {table} written to {path}: {len(matrix)} categories, {len(matrix.compounds)} compounds")
+    return path
+
+def _read_meta(path: str) -> dict:
+    try:
+        with open(os.path.join(path, "meta.json")) as fhand:
+            return json.load(fhand)
+    except (OSError, ValueError):
+        return None
+
+def is_valid(db_file: str, meta: dict) -> bool:
+    """
+        Whether the snapshot described by meta was compiled from the current db_file, as is: same size and mtime
+    """
+    if meta is None or meta.get("format") != FORMAT_VERSION:
+        return False
+    stored: dict = meta["source"]
+    current: dict = fingerprint(db_file, with_hash=False)
+    return current["size"] == stored["size"] and current["mtime_ns"] == stored["mtime_ns"]
+
+def _write_meta(path: str, meta: dict) -> None:
+    """
+        Writes meta.json, replacing the previous one at once
+    """
+    with open(os.path.join(path, "meta.json.tmp"), "wt") as fhand:
+        json.dump(meta, fhand, indent=1)
+    os.replace(os.path.join(path, "meta.json.tmp"), os.path.join(path, "meta.json"))
+
+def refresh_fingerprint(db_file: str, table: str, meta: dict) -> None:
+    """
+        Records the current fingerprint of db_file in the snapshot described by meta, whose annotation is
+        still the one in the file. Snapshots that cannot be written (e.g. shared read-only) are left as they are.
+    """
+    meta["source"] = fingerprint(db_file, with_hash="sha256" in meta["source"])
+    try:
+        _write_meta(snapshot_path(db_file, table), meta)
+    except OSError as error:
+        logging.debug(f"Could not update the fingerprint of the snapshot: {error}")
+
+def stale_sources(db_file: str, table: str, meta: dict) -> set:
+    """
+        Source databases changed since the snapshot described by meta was compiled: empty if it is valid.
+        If the file changed but no generation did, the annotation is the same: the fingerprint is refreshed
+        (see refresh_fingerprint) and the set is empty. The file is only hashed for plain tables of older loaders,
+        which have no generations.
+        None if the whole snapshot is outdated: another format, or a plain table whose content changed.
+    """
+    if meta is None or meta.get("format") != FORMAT_VERSION:
+        return None
+    if is_valid(db_file, meta):
+        return set()
+    with AnnotationStore(db_file, table, immutable=False) as store:
+        normalised: bool = mbrole.database.is_normalised(store.conn, table)
+        current: dict = mbrole.database.source_generations(store.conn, table)
+    if normalised and "generations" in meta:
+        stored: dict = meta["generations"]
+        stale: set = {x for x in current.keys() | stored.keys() if current.get(x) != stored.get(x)}
+    elif "sha256" in meta["source"] and _file_hash(db_file) == meta["source"]["sha256"]:
+        # The file was touched, but has the same content
+        stale: set = set()
+    else:
+        return None
+    if not stale:
+        refresh_fingerprint(db_file, table, meta)
+    return stale
+
+def _refresh(snapshot: AnnotationMatrix, db_file: str, table: str, databases: set) -> AnnotationMatrix:
+    """
+        Replaces the categories of the given databases in the snapshot with those in SQLite.
+        Databases keep the order of mbrole.database.database_order, as in the other engines.
+    """
+    with AnnotationStore(db_file, table, immutable=False) as store:
+        reloaded: AnnotationMatrix = store.annotation_matrix(sorted(databases))
+        order: list = mbrole.database.database_order(store.conn, table)
+    parts: list = []
+    for database in order:
+        source: AnnotationMatrix = reloaded if database in databases else snapshot
+        parts.append(source.select(np.flatnonzero(source.databases[source.category_database] == database)))
+    return AnnotationMatrix.stack(parts)
+
+def load_snapshot(db_file: str, table: str) -> AnnotationMatrix:
+    """
+        Loads the snapshot of the table, memory-mapped. If some sources changed since it was
+        compiled (see stale_sources), their categories are reloaded from SQLite.
+
+        Returns None if there is no snapshot or it is outdated.
+    """
+    path: str = snapshot_path(db_file, table)
+    meta: dict = _read_meta(path)
+    if meta is None:
+        return None
+    stale: set = stale_sources(db_file, table, meta)
+    if stale is None:
+        logging.warning(f"Snapshot {path} is outdated, ignoring it. Run mbrole-cli compile to update it")
+        return None
+    indptr = np.load(os.path.join(path, "indptr.npy"), mmap_mode="r")
+    indices = np.load(os.path.join(path, "indices.npy"), mmap_mode="r")
+    category_database = np.load(os.path.join(path, "category_database.npy"), mmap_mode="r")
+    data = np.ones(indices.shape, dtype=np.int8)
+    matrix = scipy.sparse.csr_array((data, indices, indptr), shape=(meta["categories"], meta["compounds"]), copy=False)
+    databases = np.empty(len(meta["databases"]), dtype=object)
+    databases[:] = meta["databases"]
+    compounds: StringTable = StringTable.load(path, "compounds")
+    names: StringTable = StringTable.load(path, "names")
+    logging.info(f"Loaded snapshot {path}")
+    snapshot = AnnotationMatrix(compounds, names, databases, category_database, matrix)
+    if stale:
+        logging.warning(f"Snapshot {path} is outdated for {', '.join(sorted(stale))}, reloading them. Run mbrole-cli compile to update it")
+        snapshot = _refresh(snapshot, db_file, table, stale)
+    return snapshot
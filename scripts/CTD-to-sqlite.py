@@ -1,11 +1,18 @@
 #! /usr/bin/env python3
 
 import argparse
+import os
 import sqlite3
+import sys
 
 import pandas as pd
 import tqdm
 
+main_path=os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, main_path)
+
+import mbrole.database
+
 def _parse_args() -> argparse.ArgumentParser:
     parser: argparse.ArgumentParser = argparse.ArgumentParser()
     parser.add_argument("--input","-i", help="CTD csv file downloaded from the official repository")
@@ -13,22 +20,20 @@ def _parse_args() -> argparse.ArgumentParser:
     parser.add_argument("--output","-o", help="Path to the desired sqlite db file to store data")
     parser.add_argument("--table","-t", help="table of the DB in which store the info")
     parser.add_argument("--db_name","-db", help="Where the data comes from")
+    parser.add_argument("--version","-v", type=str, help="Release of the source, recorded in the database")
+    parser.add_argument("--append", action="store_true", help="Append the rows instead of replacing the previous release of the source")
     return parser.parse_args()
 
-def _save_to_sqlite(conn, table, id, name, db, url, category):
-    SQL = f"INSERT INTO {table} (compound, annotation, database, url) VALUES  (\"{id}\", \"{name}\", \"{db}\", \"{url}\");"
-    cursor = conn.cursor()
-    cursor.execute(SQL)
-    conn.commit()
-    cursor.close()
-
 def main() -> None:
     args = _parse_args()
     data = pd.read_csv(args.input, sep=",", header=args.header)
     conn = sqlite3.Connection(args.output)
-    for i in tqdm.tqdm(list(data.itertuples())):
-        _save_to_sqlite(conn, args.table, i[2], i[4], args.db_name, i[2], "")
-    pass
+    rows = ((i[2], i[4], "", args.db_name, i[2]) for i in tqdm.tqdm(data.itertuples(), total=len(data)))
+    if args.append:
+        mbrole.database.bulk_insert(conn, rows, args.table)
+    else:
+        mbrole.database.sync_source(conn, rows, args.table, args.version, [args.db_name])
+    conn.close()
 
 if __name__=="__main__":
-    main()
\ No newline at end of file
+    main()
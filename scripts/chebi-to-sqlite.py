@@ -12,13 +12,25 @@
 
 import argparse
 import gzip
-import json
 import logging
 import os
+import sys
 
 import sqlite3
 import tqdm
 
+main_path=os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, main_path)
+
+import mbrole.database
+import mbrole.identifiers
+import mbrole.jsonstream
+import mbrole.ontology
+
+OBO_URL = "http://purl.obolibrary.org/obo/"
+# Relation names, and their ids in the pred field of the edges
+RELATIONS = {"is_a": "is_a", "has_role": "RO_0000087"}
+
 def _parse_CHEBI_id_from_url(url: str) -> str:
     """
         Chebi id field is the url, of which the endpoint is the
@@ -59,6 +71,14 @@ def _parse_args() -> argparse.Namespace:
     parser.add_argument("--db_name","-db",required=True)
     parser.add_argument("--log_level","-l", type=str, default="info", choices=["debug","info","warning","error","critical"])
     parser.add_argument("--table_name","-t", type=str, default="mbrole")
+    parser.add_argument("--version","-v", type=str, help="Release of the source, recorded in the database")
+    parser.add_argument("--append", action="store_true", help="Append the rows instead of replacing the previous release of the source")
+    parser.add_argument("--relations", "-r", nargs="+", default=["is_a"], choices=sorted(RELATIONS),
+                        help="Relations of the ontology used as annotations")
+    parser.add_argument("--propagate", "-p", action="store_true",
+                        help="Annotate compounds with every ancestor class, not only the direct ones")
+    parser.add_argument("--id_map", action="store_true",
+                        help="Load the identifier map of the compounds (cross-references, InChIKeys and names) instead of their relations")
     return parser.parse_args()
 
 def initialized_db(file: str) -> bool:
@@ -78,77 +98,119 @@ def initialized_db(file: str) -> bool:
 
 def initialize_db(file: str, table_name:str) -> int:
     """
-        Creates the SQLite file and the table for mbrole
+        Creates the SQLite file and the mbrole schema (see mbrole.database)
         The table has these columns:
-            - compound: the name of the compound. For testing purposes, max length is 20.
+            - compound: the name of the compound.
             - annotation: the field to which the compound is part of, for the enrichment analysis.
+            - category: the kind of annotation, e.g. Chebi role.
             - database: the source for the compound name and annotation
-            - URL: officuak URL for compound info,
+            - URL: official URL for compound info,
     """
     conn = sqlite3.connect(file)
-    cursor = conn.cursor()
-    cursor.execute(f"CREATE TABLE IF NOT EXISTS {table_name} (compound VARCHAR(20), annotation VARCHAR(50), category VARCHAR(50), database VARCHAR(20), URL VARCHAR(100) );")
+    mbrole.database.create_schema(conn, table_name)
     conn.close()
     return 0 # 0 means success. It does not check if the file cannot exist, as the function initialized_db checked that.
 
-def load_chebi_data(file:str):
+
+def open_chebi(file: str):
     """
-        Loads the chebi ontology from th official JSON file from: https://ftp.ebi.ac.uk/pub/databases/chebi/ontology/
+        Opens the chebi ontology from th official JSON file from: https://ftp.ebi.ac.uk/pub/databases/chebi/ontology/
         As it can be either json, or json.gz, the correct function is determined according to the file extension.
 
         IMPROVEMENT TODO: check mimetype instead and handle errors accordingly.
     """
     open_function = gzip.open if file.endswith(".json.gz") else open
-    fhand = open_function(file, 'rt')
-    return json.load(fhand)
+    return open_function(file, 'rt', encoding="utf-8")
 
-def parse_chebi(data: str) -> tuple[str,str]:
+def iter_chebi(file: str, section: str):
+    """
+        Streams the nodes or edges (section) of the ontology graph, without loading the whole file.
+        Each call reads the file again, so memory does not depend on the size of the ontology.
     """
-        Parses the preloaded chebi data. Gets 2 fields:
+    with open_chebi(file) as fhand:
+        yield from mbrole.jsonstream.iter_array(fhand, ("graphs", 0, section))
+
+def parse_chebi(file: str, relations: tuple = ("is_a",)) -> tuple[str,str]:
+    """
+        Streams the relations of the chebi file. Gets 2 fields:
         - sub: ID of a compound
         - obj: ID of a category to which sub is ontologically related.
 
-        TODO: 
-            - keep the type of relation they have (E.j: is_a, has_role, etc)
-            - Maybe it would be faster if data was only the relations that is calculated
-            on the first line of the function.
+        Only edges of the given relations (see RELATIONS) are kept.
     """
-    relations = data["graphs"][0]["edges"]
-    for relation in relations:
+    predicates: set = {RELATIONS[x] for x in relations}
+    for relation in iter_chebi(file, "edges"):
         logging.debug(relation)
-        sub, obj = _parse_CHEBI_id_from_url(relation["sub"]), _parse_CHEBI_id_from_url(relation["obj"])
-        if (relation["pred"] == "is_a"):
-            # is_a is the indication for the roles in the ontology
-            yield (sub, obj)
+        if (_parse_CHEBI_id_from_url(relation["pred"]) in predicates):
+            yield (sys.intern(_parse_CHEBI_id_from_url(relation["sub"])), sys.intern(_parse_CHEBI_id_from_url(relation["obj"])))
 
-def _get_obj_name(chebi_id: str, chebi_data:dict) -> dict:
+def propagate_chebi(relations) -> tuple[str,str]:
     """
-        Filters the whole chebi data, to get just the node with the given id.
-
-        Then, returns the label. 
-        
-        TODO: Note that the label is not guaranteed to exist, but in practice,
-        exists for all categories or compounds we need
+        Relations from every node to all its ancestors, following the given (sub, obj) relations
+        (see mbrole.ontology.ancestor_closure). E.g. a compound that has_role a role is also related to the
+        ancestors of that role.
     """
-    node = next(filter(lambda x: x["id"] == f"http://purl.obolibrary.org/obo/{chebi_id}", chebi_data))
-    return node["lbl"]
+    for sub, ancestors in mbrole.ontology.ancestor_closure(relations):
+        for obj in ancestors:
+            yield (sub, obj)
 
-def _get_chebi_nodes(chebi_data: dict) -> dict[str, str]:
-    nodes = chebi_data["graphs"][0]["nodes"]
+def _get_chebi_nodes(file: str) -> dict[str, str]:
+    """
+        First pass over the file: labels of the nodes, by id. Only labels are kept,
+        the URL is rebuilt from the id when a node has the usual OBO one.
+    """
     chebi_nodes: dict[str, str] = {}
-    for node in nodes:
-        chebi_id = _parse_CHEBI_id_from_url(node["id"])
+    for node in iter_chebi(file, "nodes"):
         if ("lbl" in node):
-            chebi_nodes[chebi_id] = (node["lbl"], node["id"])
-        else: 
-            continue
+            chebi_id = _parse_CHEBI_id_from_url(node["id"])
+            chebi_nodes[chebi_id] = sys.intern(node["lbl"])
+            if (node["id"] != OBO_URL + chebi_id):
+                chebi_nodes[chebi_id] = (chebi_nodes[chebi_id], node["id"])
     return chebi_nodes
 
-def insert_into_db(table_name: str, compound: str, annotation: str, category:str, database: str, url: str, connection:sqlite3.Connection) -> None:
-    cursor = connection.cursor()
-    cursor.execute(f"INSERT INTO {table_name} (compound, annotation, category, database, URL) VALUES (?, ?, ?, ?, ?);", (compound, annotation, category, database, url))
-    connection.commit()
-    cursor.close()
+def parse_chebi_aliases(file: str):
+    """
+        Streams (namespace, alias, compound) rows for mbrole.database.store_id_map from the nodes:
+        the ChEBI ID, label and synonyms, InChIKey and the cross-references of known namespaces (see mbrole.identifiers).
+    """
+    for node in iter_chebi(file, "nodes"):
+        chebi_id: str = _parse_CHEBI_id_from_url(node["id"])
+        if not chebi_id.startswith("CHEBI_"):
+            continue
+        yield ("chebi", chebi_id, chebi_id)
+        if "lbl" in node:
+            yield ("name", node["lbl"], chebi_id)
+        meta: dict = node.get("meta", {})
+        for synonym in meta.get("synonyms", []):
+            yield ("name", synonym["val"], chebi_id)
+        for xref in meta.get("xrefs", []):
+            source, _, identifier = xref.get("val", "").partition(":")
+            namespace: str = mbrole.identifiers.namespace_of(source)
+            if namespace is not None and identifier:
+                yield (namespace, identifier, chebi_id)
+        for value in meta.get("basicPropertyValues", []):
+            if value.get("pred", "").endswith("/inchikey"):
+                yield ("inchikey", value["val"], chebi_id)
+
+def _node(chebi_id: str, chebi_nodes: dict) -> tuple[str, str]:
+    """
+        Label and URL of a node
+    """
+    node = chebi_nodes[chebi_id]
+    return node if isinstance(node, tuple) else (node, OBO_URL + chebi_id)
+
+def _relation_rows(relations, chebi_nodes: dict):
+    """
+        Rows for mbrole.database.bulk_insert from the parsed relations
+    """
+    for sub, obj in relations:
+        if (obj not in chebi_nodes or sub not in chebi_nodes):
+            logging.debug(f"Skipping relation without label: {sub} -> {obj}")
+            continue
+        obj, obj_url = _node(obj, chebi_nodes)
+        sub_url = _node(sub, chebi_nodes)[1]
+        logging.debug(f"Obtained relation: {sub} -> {obj}")
+        yield (sub, obj, "Chebi role", "CHEBI", sub_url)
 
 def main() -> None:
     args: argparse.Namespace = _parse_args()
@@ -156,19 +218,27 @@ def main() -> None:
     if (not initialized_db(args.file)):
         logger.info(f" Database {args.file} does not exist. Initializing database with table name {args.db_name}.")
         initialize_db(args.file, args.db_name)
+    if (args.id_map):
+        connection = sqlite3.connect(args.file)
+        total: int = mbrole.database.store_id_map(connection, tqdm.tqdm(parse_chebi_aliases(args.chebi)), "CHEBI", args.db_name)
+        logger.info(f"Inserted {total} ChEBI identifiers into {args.file}.")
+        connection.close()
+        return
     logger.info(f" Loading ChEBI data from {args.chebi}.")
-    chebi_data = load_chebi_data(args.chebi)
-    chebi_nodes = _get_chebi_nodes(chebi_data)
-    logger.info("Loaded chebi data")
-    parsed_data = list(parse_chebi(chebi_data))
-    logger.info(f"Parsed {len(parsed_data)} relations from ChEBI data.")
+    chebi_nodes = _get_chebi_nodes(args.chebi)
+    logger.info(f"Loaded {len(chebi_nodes)} chebi labels")
+    relations = parse_chebi(args.chebi, args.relations)
+    if (args.propagate):
+        logger.info(f"Propagating {', '.join(args.relations)} relations to all ancestors.")
+        relations = propagate_chebi(relations)
     connection = sqlite3.connect(args.file)
-    for sub, obj in tqdm.tqdm(parsed_data):
-        obj, obj_url = chebi_nodes[obj]
-        sub_url = chebi_nodes[sub][1]
-        logger.debug(f"Obtained relation: {sub} -> {obj}")
-        logger.debug(f"Inserting relation: {sub} -> {obj} into database {args.file}.")
-        insert_into_db(args.db_name, sub, obj, "Chebi role", "CHEBI", sub_url, connection)
+    rows = tqdm.tqdm(_relation_rows(relations, chebi_nodes))
+    if args.append:
+        total: int = mbrole.database.bulk_insert(connection, rows, args.db_name)
+    else:
+        total: int = mbrole.database.sync_source(connection, rows, args.db_name, args.version, ["CHEBI"])["rows"]
+    logger.info(f"Inserted {total} relations from ChEBI data into {args.file}.")
+    connection.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,63 @@
+#! /usr/bin/env python3
+
+"""
+    Loads the CSV files produced by the *-to-csv scripts (LMSD, SPMDB, ClinPGX, WikiPathways...)
+    into a mbrole SQLite database, through the bulk ingestion of mbrole.database.
+
+    Each CSV row holds, by default: compound, annotation, database, url.
+    Use --columns to give another layout, e.g. "compound,-,annotation,database,url" for ClinPGX,
+    where "-" marks a column to ignore.
+
+    The rows replace those of the databases found in the files (see mbrole.database.sync_source),
+    unless --append is used.
+"""
+
+import argparse
+import csv
+import logging
+import os
+import sqlite3
+import sys
+
+main_path=os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, main_path)
+
+import mbrole.database
+
+logging.basicConfig(level=logging.INFO)
+
+def _parse_args() -> argparse.Namespace:
+    parser: argparse.ArgumentParser = argparse.ArgumentParser()
+    parser.add_argument("--input", "-i", nargs="+", required=True, help="CSV files to load")
+    parser.add_argument("--output", "-o", required=True, help="SQLite database file")
+    parser.add_argument("--table", "-t", default=mbrole.database.DEFAULT_TABLE, help="Table of the DB in which store the info")
+    parser.add_argument("--columns", "-c", default="compound,annotation,database,url", help="Comma separated names of the CSV columns")
+    parser.add_argument("--category", "-cat", default="", help="Category stored for rows without a category column")
+    parser.add_argument("--version", "-v", type=str, help="Release of the source, recorded in the database")
+    parser.add_argument("--append", action="store_true", help="Append the rows instead of replacing the previous release of the source")
+    return parser.parse_args()
+
+def read_rows(files: list, columns: list, category: str):
+    """
+        Rows for mbrole.database.bulk_insert from the CSV files
+    """
+    for file in files:
+        with open(file, newline="") as fhand:
+            for line in csv.reader(fhand):
+                if not line:
+                    continue
+                row: dict = {"category": category, "url": ""} | dict(zip(columns, line))
+                yield (row["compound"], row["annotation"], row["category"], row["database"], row["url"])
+
+def main() -> None:
+    args = _parse_args()
+    conn = sqlite3.connect(args.output)
+    rows = read_rows(args.input, args.columns.split(","), args.category)
+    if args.append:
+        mbrole.database.bulk_insert(conn, rows, args.table)
+    else:
+        mbrole.database.sync_source(conn, rows, args.table, args.version)
+    conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,35 +1,188 @@
 #! /usr/bin/env python3
 
+"""
+    HMDB to SQLite
+
+    Loads the metabolites of the HMDB XML (hmdb_metabolites.xml, plain or gzipped) into a mbrole
+    SQLite database. For each metabolite, these annotations are stored (category in brackets):
+        - pathways (pathway)
+        - cellular locations (cellular location)
+        - biospecimen locations (biospecimen)
+        - terms of the HMDB chemical ontology, at any level (ontology)
+
+    With --id_map, the identifiers of each metabolite (secondary accessions, KEGG, ChEBI, PubChem,
+    CAS, InChIKey, name and synonyms) are loaded into the id map of the database instead.
+
+    The XML is streamed with iterparse and each metabolite is cleared once read, so memory does not
+    grow with the file. The input can also be the chunks written by split-hmdb-xml.py (files or a
+    directory): with --workers, they are parsed in a pool of processes while the rows are inserted.
+
+    Usage:
+        python hmdb-to-sqlite.py -i hmdb_metabolites.xml -o mbrole.db -db HMDB
+        python hmdb-to-sqlite.py -i chunks/ -o mbrole.db -db HMDB -w 8
+        python hmdb-to-sqlite.py -i hmdb_metabolites.xml -o mbrole.db --id_map
+"""
+
 import argparse
+import collections
+import concurrent.futures
+import functools
+import glob
+import gzip
 import logging
+import os
+import sqlite3
+import sys
 import xml.etree.ElementTree as ET
 
-logging.basicConfig(level=logging.DEBUG)
+import tqdm
+
+main_path=os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, main_path)
+
+import mbrole.database
+import mbrole.identifiers
+
+logging.basicConfig(level=logging.INFO)
+
+HMDB_URL = "https://hmdb.ca/metabolites/"
+# Category of each annotation: path of the elements, from a metabolite, with its name
+ANNOTATIONS = {"pathway": "biological_properties/pathways/pathway/name",
+               "cellular location": "biological_properties/cellular_locations/cellular",
+               "biospecimen": "biological_properties/biospecimen_locations/biospecimen",
+               "ontology": "ontology//term"}
+
+# Namespace of the identifiers of a metabolite, by path of their elements
+ALIASES = {"accession": "hmdb",
+           "secondary_accessions/accession": "hmdb",
+           "kegg_id": "kegg",
+           "chebi_id": "chebi",
+           "pubchem_compound_id": "pubchem",
+           "cas_registry_number": "cas",
+           "inchikey": "inchikey",
+           "name": "name",
+           "synonyms/synonym": "name"}
+
+def _local_name(tag: str) -> str:
+    return tag.rpartition("}")[2]
+
+def _open(file: str):
+    """
+        Opens a plain or gzipped file, whatever its extension
+    """
+    with open(file, "rb") as fhand:
+        compressed: bool = fhand.read(2) == b"\x1f\x8b"
+    return gzip.open(file, "rb") if compressed else open(file, "rb")
+
+@functools.cache
+def _paths(namespace: str) -> dict:
+    """
+        Paths of ANNOTATIONS, qualified with the namespace of the document
+    """
+    return {category: "/".join(f"{namespace}{x}" if x else x for x in path.split("/")) for category, path in ANNOTATIONS.items()}
+
+def _metabolite_rows(metabolite: ET.Element, namespace: str, db_name: str):
+    """
+        Rows for mbrole.database.bulk_insert from a metabolite element
+    """
+    accession = metabolite.findtext(f"{namespace}accession")
+    if not accession:
+        return
+    url: str = HMDB_URL + accession
+    for category, path in _paths(namespace).items():
+        for element in metabolite.iterfind(path):
+            if element.text and element.text.strip():
+                yield (accession, element.text.strip(), category, db_name, url)
+
+def _metabolite_aliases(metabolite: ET.Element, namespace: str, db_name: str):
+    """
+        Rows for mbrole.database.store_id_map from a metabolite element (see ALIASES)
+    """
+    accession = metabolite.findtext(f"{namespace}accession")
+    if not accession:
+        return
+    for path, alias_namespace in ALIASES.items():
+        for element in metabolite.iterfind("/".join(f"{namespace}{x}" for x in path.split("/"))):
+            if element.text and element.text.strip():
+                yield (alias_namespace, element.text.strip(), accession)
+
+def parse_hmdb(file: str, db_name: str, id_map: bool = False):
+    """
+        Streams the rows of every metabolite of an HMDB XML file: annotations or, if id_map, identifiers
+    """
+    metabolite_rows = _metabolite_aliases if id_map else _metabolite_rows
+    with _open(file) as fhand:
+        root = None
+        for event, element in ET.iterparse(fhand, events=("start", "end")):
+            if event == "start":
+                if root is None:
+                    root = element
+                continue
+            if _local_name(element.tag) == "metabolite" and element in root:
+                namespace: str = element.tag[:-len("metabolite")]
+                yield from metabolite_rows(element, namespace, db_name)
+                # Drop the parsed metabolite, so the tree does not grow with the file
+                root.remove(element)
+
+def parse_chunk(file: str, db_name: str, id_map: bool = False) -> list:
+    """
+        Rows of a whole chunk, to be sent back from a worker process
+    """
+    return list(parse_hmdb(file, db_name, id_map))
 
-def save_to_sqlite(data, sqlite_path, db, table):
-    pass
+def parallel_rows(files: list, db_name: str, workers: int, id_map: bool = False):
+    """
+        Parses the chunks in a pool of processes, yielding their rows in order.
+        Only a few chunks are parsed ahead of the insertion, so memory stays bounded.
+    """
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        pending: collections.deque = collections.deque()
+        for file in tqdm.tqdm(files, unit="chunk"):
+            pending.append(pool.submit(parse_chunk, file, db_name, id_map))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
 
-def _parse_xml(file: str, namespace="http://www.hmdb.ca") -> list:
-    logging.info("Loading HMDB XML tree...")
-    data = ET.iterparse(open(file))
-    logging.info("Loaded XML tree")
-    for event, element in data:
-        if("metabolite" in element.tag):
-            print("metabolite")
+def _input_files(inputs: list) -> list:
+    files: list = []
+    for path in inputs:
+        files.extend(sorted(glob.glob(os.path.join(path, "*"))) if os.path.isdir(path) else [path])
+    return files
 
 def _parse_args():
     parser = argparse.ArgumentParser()
-    parser.add_argument("--input","-i")
-    parser.add_argument("--output","-o")
-    parser.add_argument("--database","-db")
-    parser.add_argument("--table","-t")
+    parser.add_argument("--input","-i", nargs="+", required=True, help="HMDB XML file, or chunks (files or directory) from split-hmdb-xml.py")
+    parser.add_argument("--output","-o", required=True, help="SQLite database file")
+    parser.add_argument("--database","-db", default="HMDB", help="Name of the source database")
+    parser.add_argument("--table","-t", default=mbrole.database.DEFAULT_TABLE)
+    parser.add_argument("--workers","-w", type=int, default=1, help="Processes parsing chunks in parallel")
+    parser.add_argument("--version","-v", type=str, help="Release of the source, recorded in the database")
+    parser.add_argument("--append", action="store_true", help="Append the rows instead of replacing the previous release of the source")
+    parser.add_argument("--id_map", action="store_true", help="Load the identifiers of the metabolites into the id map instead of their annotations")
     return parser.parse_args()
 
 def main():
     args = _parse_args()
-    metabolites = _parse_xml(args.input)
-    save_to_sqlite(metabolites, args.output, args.db, args.table)
+    files: list = _input_files(args.input)
+    logging.info(f"Loading {len(files)} HMDB files with {args.workers} workers")
+    if args.workers > 1 and len(files) > 1:
+        rows = parallel_rows(files, args.database, args.workers, args.id_map)
+    else:
+        rows = (row for file in tqdm.tqdm(files, unit="file") for row in parse_hmdb(file, args.database, args.id_map))
+    conn = sqlite3.connect(args.output)
+    if args.id_map:
+        total: int = mbrole.database.store_id_map(conn, rows, args.database, args.table)
+        conn.close()
+        logging.info(f"Inserted {total} HMDB identifiers into {args.output}")
+        return
+    if args.append:
+        total: int = mbrole.database.bulk_insert(conn, rows, args.table)
+    else:
+        total: int = mbrole.database.sync_source(conn, rows, args.table, args.version, [args.database])["rows"]
+    conn.close()
+    logging.info(f"Inserted {total} HMDB annotations into {args.output}")
 
 
 if __name__=="__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,60 @@
+#! /usr/bin/env python3
+
+"""
+    Loads compound identifiers from CSV files into the id map of a mbrole SQLite database
+    (see mbrole.database.store_id_map), so queries with other IDs can be run with mbrole-cli --id-type.
+
+    Each CSV row holds, by default: alias, namespace, compound.
+    Use --columns to give another layout, where "-" marks a column to ignore, and --namespace for files
+    without a namespace column. E.g. for the --converser file of SPMDB.py (InChIKey, InChI, compound, database):
+
+        python id-map-to-sqlite.py -i converser.csv -o mbrole.db -c alias,-,compound,- -n inchikey -s SMPDB
+
+    The rows replace those previously loaded from the same source.
+"""
+
+import argparse
+import csv
+import logging
+import os
+import sqlite3
+import sys
+
+main_path=os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, main_path)
+
+import mbrole.database
+import mbrole.identifiers
+
+logging.basicConfig(level=logging.INFO)
+
+def _parse_args() -> argparse.Namespace:
+    parser: argparse.ArgumentParser = argparse.ArgumentParser()
+    parser.add_argument("--input", "-i", nargs="+", required=True, help="CSV files to load")
+    parser.add_argument("--output", "-o", required=True, help="SQLite database file")
+    parser.add_argument("--table", "-t", default=mbrole.database.DEFAULT_TABLE, help="Table of the DB whose id map is loaded")
+    parser.add_argument("--columns", "-c", default="alias,namespace,compound", help="Comma separated names of the CSV columns")
+    parser.add_argument("--namespace", "-n", choices=mbrole.identifiers.NAMESPACES, help="Namespace of the aliases, for files without a namespace column")
+    parser.add_argument("--source", "-s", required=True, help="Name of the source of the identifiers. Its previous rows are replaced")
+    return parser.parse_args()
+
+def read_rows(files: list, columns: list, namespace: str = None):
+    """
+        Rows for mbrole.database.store_id_map from the CSV files
+    """
+    for file in files:
+        with open(file, newline="") as fhand:
+            for line in csv.reader(fhand):
+                if not line:
+                    continue
+                row: dict = {"namespace": namespace} | dict(zip(columns, line))
+                yield (mbrole.identifiers.namespace_of(row["namespace"] or ""), row["alias"], row["compound"])
+
+def main() -> None:
+    args = _parse_args()
+    conn = sqlite3.connect(args.output)
+    mbrole.database.store_id_map(conn, read_rows(args.input, args.columns.split(","), args.namespace), args.source, args.table)
+    conn.close()
+
+if __name__ == "__main__":
+    main()
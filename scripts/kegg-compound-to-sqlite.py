@@ -9,19 +9,35 @@
     to avoid this but now I wonder wether I should take it into account in every script
 
     TODO: Add file encoding support to avoid this
+
+    With --id_map, the names and the DBLINKS (ChEBI, CAS) of the compounds are loaded
+    into the id map of the database instead of their pathways.
 """
 
 import argparse
 import collections
 import logging
 import gzip
+import os
+import sqlite3
+import sys
+
+main_path=os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, main_path)
+
+import mbrole.database
+import mbrole.identifiers
 
 logging.basicConfig(level=logging.WARN)
 
 def _parse_args() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser()
     parser.add_argument("--input","-i", type=str, help="Path to KEGG compound file", required=True)
-    parser.add_argument("--output","-o", type=str, help="Output DB to save Kegg data")
+    parser.add_argument("--output","-o", type=str, help="Output DB to save Kegg data. If not given, prints CSV rows to stdout")
+    parser.add_argument("--table","-t", type=str, help="Table of the DB in which store the info", default=mbrole.database.DEFAULT_TABLE)
+    parser.add_argument("--version","-v", type=str, help="Release of the source, recorded in the database")
+    parser.add_argument("--append", action="store_true", help="Append the rows instead of replacing the previous release of the source")
+    parser.add_argument("--id_map", action="store_true", help="Load the names and links of the compounds into the id map instead of their pathways")
     return parser.parse_args()
 
 def parse_kegg(file:str) -> list:
@@ -70,16 +86,71 @@ def parse_kegg(file:str) -> list:
                 compounds[ID].append(data)               
     return compounds
 
+def parse_kegg_aliases(file: str):
+    """
+        Streams (namespace, alias, compound) rows for mbrole.database.store_id_map: the KEGG ID,
+        the names (NAME section, one per line, ended by ;) and the DBLINKS of known namespaces, e.g:
+
+        DBLINKS     CAS: 50-99-7
+                    PubChem: 3333
+                    ChEBI: 4167 17634
+
+        PubChem links of KEGG are substance IDs (SID), not compound IDs, so they are skipped.
+    """
+    openf = gzip.open if file.endswith(".gz") else open
+    with openf(file, "rt") as fhand:
+        section = ""
+        ID = ""
+        for line in fhand:
+            line = line.rstrip("\n")
+            if not line.startswith(" "):
+                section = line.split(" ", 1)[0]
+                line = line[len(section):]
+            if section == "ENTRY":
+                ID = line.split()[0]
+                yield ("kegg", ID, ID)
+            elif section == "NAME" and ID:
+                yield ("name", line.strip().rstrip(";"), ID)
+            elif section == "DBLINKS" and ID:
+                source, _, identifiers = line.strip().partition(":")
+                namespace = mbrole.identifiers.namespace_of(source)
+                if namespace is not None and namespace != "pubchem":
+                    for identifier in identifiers.split():
+                        yield (namespace, identifier, ID)
+
+def _kegg_rows(data: dict):
+    """
+        Rows for mbrole.database.bulk_insert: one per compound and pathway
+    """
+    for key in data:
+        for pathway in data[key]:
+            yield (key, pathway[1], "pathway", "KEGG", "")
+
 def main():
     args = _parse_args()
+    if args.id_map:
+        if not args.output:
+            for row in parse_kegg_aliases(args.input):
+                print(",".join(row))
+            return
+        conn = sqlite3.connect(args.output)
+        mbrole.database.store_id_map(conn, parse_kegg_aliases(args.input), "KEGG", args.table)
+        conn.close()
+        return
     data = parse_kegg(args.input)
+    if args.output:
+        conn = sqlite3.connect(args.output)
+        if args.append:
+            mbrole.database.bulk_insert(conn, _kegg_rows(data), args.table)
+        else:
+            mbrole.database.sync_source(conn, _kegg_rows(data), args.table, args.version, ["KEGG"])
+        conn.close()
+        return
     #print("Compound","Pathway","DDBB","link")
-    i = 1
     for key in data:
         pathways = data[key]
         for pathway in pathways:
             print(f"{key},\"{pathway[1]}\",KEGG,False")
-            i += 1
 
 if __name__=="__main__":
     main()
\ No newline at end of file
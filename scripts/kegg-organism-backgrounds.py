@@ -1,21 +1,69 @@
 #! /usr/bin/env python3
 
+"""
+    KEGG organism backgrounds
+
+    Reads the compounds drawn in the KEGG pathway maps of an organism (the "circ" lines of its
+    .conf files, e.g. hsa00010.conf) and stores them as the background of the organism in a mbrole
+    SQLite database, to be used with mbrole-cli --organism. Without --db_file, compounds are printed.
+
+    The organism is taken from --organism or, if not given, from the prefix of each file name (hsa).
+
+    Usage:
+        python kegg-organism-backgrounds.py -i hsa/*.conf -dbf mbrole.db
+"""
+
 import argparse
+import collections
+import logging
+import os
+import re
+import sqlite3
+import sys
+
+main_path=os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, main_path)
+
+import mbrole.database
+
+logging.basicConfig(level=logging.INFO)
 
 def parse_args():
     parser = argparse.ArgumentParser()
-    parser.add_argument("--input","-i", nargs="+")
+    parser.add_argument("--input","-i", nargs="+", required=True, help="KEGG pathway .conf files of the organism")
+    parser.add_argument("--db_file","-dbf", help="SQLite database to store the background in. If not given, prints the compounds")
+    parser.add_argument("--organism","-org", help="KEGG code of the organism. By default, the prefix of each file name")
+    parser.add_argument("--table","-t", default=mbrole.database.DEFAULT_TABLE)
     return parser.parse_args()
 
+def organism_of(file: str) -> str:
+    match = re.match("[a-z]+", os.path.basename(file))
+    if match is None:
+        raise ValueError(f"Cannot tell the organism of {file}, use --organism")
+    return match.group(0)
+
+def parse_compounds(file: str):
+    with open(file) as fhand:
+        for line in fhand:
+            if line.startswith("circ"):
+                line:list = line.strip("\n").split()
+                if len(line) > 4:
+                    yield line[4]
+
 def main():
     args = parse_args()
+    backgrounds: dict = collections.defaultdict(set)
     for element in args.input:
-        with open(element) as fhand:
-            for line in fhand:
-                if line.startswith("circ"):
-                    line:list = line.strip("\n").split()
-                    compound:str = line[4]
-                    print(compound)
+        backgrounds[args.organism or organism_of(element)].update(parse_compounds(element))
+    if not args.db_file:
+        for compounds in backgrounds.values():
+            for compound in sorted(compounds):
+                print(compound)
+        return
+    conn = sqlite3.connect(args.db_file)
+    for organism, compounds in backgrounds.items():
+        mbrole.database.store_background(conn, organism, compounds, args.table)
+    conn.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
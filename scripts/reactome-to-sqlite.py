@@ -13,9 +13,15 @@
 import argparse
 import logging
 import os
+import sys
 
 import sqlite3
 
+main_path=os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, main_path)
+
+import mbrole.database
+
 def initialize_logger(default_logging_level: str) -> logging.Logger:
     logging_level:str = 0
     match default_logging_level:
@@ -38,9 +44,11 @@ def _parse_args() -> argparse.Namespace:
     parser:argparse.ArgumentParser = argparse.ArgumentParser()
     parser.add_argument("--reactome", "-i", required=True)
     parser.add_argument("--file", "-o", required=True)
-    parser.add_argument("--db_name","-db",required=True)
+    parser.add_argument("--db_name","-db", default="Reactome", help="Source database name stored for the rows")
     parser.add_argument("--log_level","-l", type=str, default="info", choices=["debug","info","warning","error","critical"])
     parser.add_argument("--table_name","-t", type=str, default="mbrole")
+    parser.add_argument("--version","-v", type=str, help="Release of the source, recorded in the database")
+    parser.add_argument("--append", action="store_true", help="Append the rows instead of replacing the previous release of the source")
     return parser.parse_args()
 
 def initialized_db(file: str) -> bool:
@@ -58,8 +66,7 @@ def initialized_db(file: str) -> bool:
 
 def initialize_db(file: str, table_name:str) -> int:
     with sqlite3.connect(file) as conn:
-        conn.execute(f"CREATE TABLE IF NOT EXISTS {table_name} (id INTEGER PRIMARY KEY, annotation VARCHAR(50), database VARCHAR(20) );")
-        conn.commit()
+        mbrole.database.create_schema(conn, table_name)
     return 0
 
 def connect_to_db(file: str, db:str) -> sqlite3.Connection:
@@ -78,11 +85,16 @@ def main() -> None:
     args: argparse.Namespace = _parse_args()
     logger: logging.Logger = initialize_logger(args.log_level)
     if (not initialized_db(args.file)):
-        logger.info(f" Database {args.file} does not exist. Initializing database with table name {args.db_name}.")
-        #initialized_db(args.file)
-    for data in parse_reactome(args.reactome):
-        print(f"\"{data[0]}\",\"{data[1]}\",\"{data[3]}\",\"{data[2]}\"")
-    pass
+        logger.info(f" Database {args.file} does not exist. Initializing database with table name {args.table_name}.")
+        initialize_db(args.file, args.table_name)
+    conn = sqlite3.connect(args.file)
+    rows = ((compound, pathway, namespace, args.db_name, "") for compound, pathway, _, namespace in parse_reactome(args.reactome))
+    if args.append:
+        total: int = mbrole.database.bulk_insert(conn, rows, args.table_name)
+    else:
+        total: int = mbrole.database.sync_source(conn, rows, args.table_name, args.version, [args.db_name])["rows"]
+    logger.info(f"Inserted {total} Reactome rows into {args.file}")
+    conn.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,13 +1,22 @@
 #! /usr/bin/env python3
 
+"""
+    Splits the HMDB XML (plain or gzipped) into gzipped chunks of --chunksize metabolites,
+    so hmdb-to-sqlite.py can parse them in parallel.
+
+    Each chunk is a complete XML document: the metabolites are wrapped in the <hmdb> root of the input.
+"""
+
 import argparse
 import gzip
 import logging
 import os
-import tqdm
 
 logging.basicConfig(level=logging.INFO)
 
+HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n'
+ROOT = '<hmdb xmlns="http://www.hmdb.ca">\n'
+
 def _parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("--input","-i")
@@ -15,23 +24,54 @@ def _parse_args():
     parser.add_argument("--chunksize","-c", type=int)
     return parser.parse_args()
 
-if __name__=="__main__":
-    args = _parse_args()
+def _open(file: str):
+    return gzip.open(file, "rt", encoding="utf-8") if file.endswith(".gz") else open(file, encoding="utf-8")
+
+def write_chunk(output: str, chunksize: int, file: int, root: str, lines: list) -> None:
+    # Numbers are padded, so chunks sorted by name keep the order of the input
+    filename = f"chunks_{chunksize}_{file:06d}.xml.gz"
+    with gzip.open(f"{output}/{filename}", "wt", encoding="utf-8") as fhand:
+        fhand.write(HEADER)
+        fhand.write(root)
+        fhand.writelines(lines)
+        fhand.write("</hmdb>\n")
+
+def split_hmdb(input: str, output: str, chunksize: int) -> int:
+    """
+        Writes the metabolites of the input in chunks of chunksize to the output directory.
+        Returns the number of chunks written.
+    """
     file = 0
     metabolites = 0
-    text = ""
-    if (not os.path.exists(args.output)): 
-        os.mkdir(args.output)
-    for line in open(args.input):
-        text += line
-        if line.startswith("<metabolite>"):
-            #logging.info("New metabolite found")
-            metabolites += 1
-        if line.startswith("</metabolite>") and metabolites == args.chunksize:
-            filename = f"chunks_{args.chunksize}_{file}"
-            file += 1
-            with gzip.open(f"{args.output}/{filename}", "wt") as fhand:
-                fhand.write(text)
-            metabolites = 0
-            text = ""
-        print(f"Current files saved: {file}, chunksize: {args.chunksize}, current metabolites parsed for next file: {metabolites} ", end="\r")
\ No newline at end of file
+    lines = []
+    root = ROOT
+    inside = False
+    if (not os.path.exists(output)):
+        os.mkdir(output)
+    with _open(input) as fhand:
+        for line in fhand:
+            if line.startswith("<hmdb"):
+                # Keep the root element of the input, with its namespaces
+                root = line
+            if line.startswith("<metabolite>"):
+                inside = True
+                metabolites += 1
+            if inside:
+                lines.append(line)
+            if line.startswith("</metabolite>"):
+                inside = False
+                if metabolites == chunksize:
+                    write_chunk(output, chunksize, file, root, lines)
+                    file += 1
+                    metabolites = 0
+                    lines = []
+                    print(f"Current files saved: {file}, chunksize: {chunksize}", end="\r")
+    if metabolites:
+        write_chunk(output, chunksize, file, root, lines)
+        file += 1
+    logging.info(f"Saved {file} files with up to {chunksize} metabolites")
+    return file
+
+if __name__=="__main__":
+    args = _parse_args()
+    split_hmdb(args.input, args.output, args.chunksize)
@@ -4,6 +4,9 @@
 
     Parses Wikipathways xml files
 
+    Molecules are written by their label. To load the database identifiers of the metabolites
+    into a mbrole database, use wikipathways-to-sqlite.py
+
 """
 
 import argparse
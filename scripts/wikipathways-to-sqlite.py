@@ -0,0 +1,206 @@
+#! /usr/bin/env python3
+
+"""
+    WikiPathways to SQLite
+
+    Loads the metabolites of WikiPathways GPML files into a mbrole SQLite database, one row per
+    metabolite and pathway (category "pathway"). Pathways are named by their title and WikiPathways ID,
+    e.g. "Glycolysis and gluconeogenesis (WP534)", so pathways with the same title (of other organisms,
+    or other versions) are kept apart. Metabolites are stored by the database identifier
+    of their Xref, written as in the other loaders, so they match the rows of other sources:
+        - ChEBI: CHEBI_15422
+        - HMDB: HMDB0000122 (old 5 digit accessions are padded)
+        - KEGG Compound: C00031
+    Xrefs of other databases (PubChem, CAS, Wikidata...) are skipped, unless --all_xrefs is used:
+    they are then stored as Database:ID.
+
+    Both GPML 2013 (Name, Type, Database, ID attributes) and GPML 2021 (title, type, dataSource,
+    identifier) are read. Input can be GPML files, folders or the zip archives WikiPathways publishes.
+    Files are parsed with iterparse in a pool of processes, and their rows are streamed to the database.
+
+    Usage:
+        python wikipathways-to-sqlite.py -i wikipathways-gpml-Homo_sapiens.zip -o mbrole.db -w 8
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import glob
+import io
+import logging
+import os
+import re
+import sqlite3
+import sys
+import xml.etree.ElementTree as ET
+import zipfile
+
+import tqdm
+
+main_path=os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, main_path)
+
+import mbrole.database
+import mbrole.identifiers
+
+logging.basicConfig(level=logging.INFO)
+
+PATHWAY_URL = "https://www.wikipathways.org/pathways/"
+# Files sent to a worker at once: most GPML files are parsed in a few milliseconds
+FILES_PER_TASK = 16
+
+def _local_name(tag: str) -> str:
+    return tag.rpartition("}")[2]
+
+# Namespaces stored as compounds by the other loaders (see mbrole.identifiers)
+COMPOUND_NAMESPACES = ("chebi", "hmdb", "kegg")
+
+def normalize_xref(database: str, identifier: str, all_xrefs: bool = False) -> str:
+    """
+        Compound ID of an Xref, as stored by the other loaders. None if the database is not
+        one of COMPOUND_NAMESPACES, or Database:ID if all_xrefs is True.
+    """
+    database, identifier = (database or "").strip(), (identifier or "").strip()
+    if not database or not identifier:
+        return None
+    namespace: str = mbrole.identifiers.namespace_of(database)
+    if namespace in COMPOUND_NAMESPACES:
+        return mbrole.identifiers.normalize(namespace, identifier)
+    return f"{database}:{identifier}" if all_xrefs else None
+
+def _attribute(element: ET.Element, *names: str) -> str:
+    for name in names:
+        if name in element.attrib:
+            return element.attrib[name]
+    return None
+
+def _pathway_id(name: str) -> str:
+    match = re.search(r"WP\d+", name)
+    return match.group(0) if match else None
+
+def pathway_name(title: str, pathway_id: str = None) -> str:
+    """
+        Annotation name of a pathway: its title, with its WikiPathways ID if known
+    """
+    return f"{title} ({pathway_id})" if pathway_id else title
+
+def _open(item):
+    """
+        Opens a GPML file, or a (zip archive, member) pair
+    """
+    if isinstance(item, tuple):
+        with zipfile.ZipFile(item[0]) as archive:
+            return io.BytesIO(archive.read(item[1]))
+    return open(item, "rb")
+
+def parse_gpml(item, db_name: str, types: tuple = ("Metabolite",), all_xrefs: bool = False, organism: str = None) -> list:
+    """
+        Rows for mbrole.database.bulk_insert of a GPML file: one per metabolite DataNode with a known Xref,
+        in the category of the pathway (see pathway_name). The WikiPathways ID is read from the Xref of the
+        pathway (GPML 2021) or the file name (GPML 2013). Pathways of other organisms than organism (if given) give no rows.
+    """
+    name: str = item[1] if isinstance(item, tuple) else item
+    pathway: str = None
+    pathway_id: str = _pathway_id(os.path.basename(name))
+    rows: list = []
+    seen: set = set()
+    with _open(item) as fhand:
+        # Inside a DataNode, and inside one of the types loaded
+        inside: bool = False
+        node: bool = False
+        for event, element in ET.iterparse(fhand, events=("start", "end")):
+            tag: str = _local_name(element.tag)
+            if event == "start":
+                if tag == "Pathway":
+                    pathway = _attribute(element, "Name", "title")
+                    species: str = _attribute(element, "Organism", "organism")
+                    if organism and species and species != organism:
+                        return []
+                elif tag == "DataNode":
+                    inside = True
+                    node = _attribute(element, "Type", "type") in types
+                continue
+            if tag == "Xref" and node:
+                compound: str = normalize_xref(_attribute(element, "Database", "dataSource"), _attribute(element, "ID", "identifier"), all_xrefs)
+                if compound and compound not in seen:
+                    seen.add(compound)
+                    rows.append(compound)
+            elif tag == "Xref" and not inside and _attribute(element, "dataSource") == "WikiPathways":
+                # GPML 2021 stores the pathway ID in the Xref of the Pathway
+                pathway_id = _attribute(element, "identifier") or pathway_id
+            elif tag == "DataNode":
+                inside = node = False
+                element.clear()
+    url: str = PATHWAY_URL + pathway_id if pathway_id else ""
+    return [(compound, pathway_name(pathway, pathway_id), "pathway", db_name, url) for compound in rows] if pathway else []
+
+def parse_chunk(items: list, *args) -> list:
+    """
+        Rows of a group of files, to be sent back from a worker process
+    """
+    return [row for item in items for row in parse_gpml(item, *args)]
+
+def parallel_rows(items: list, workers: int, *args):
+    """
+        Parses the files in a pool of processes, yielding their rows in order.
+        Only a few groups of files are parsed ahead of the insertion, so memory stays bounded.
+    """
+    groups: list = [items[x:x + FILES_PER_TASK] for x in range(0, len(items), FILES_PER_TASK)]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        pending: collections.deque = collections.deque()
+        for group in tqdm.tqdm(groups, unit="chunk"):
+            pending.append(pool.submit(parse_chunk, group, *args))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+def _input_files(inputs: list) -> list:
+    """
+        GPML files of the inputs: files, folders (searched recursively) and zip archives, as (archive, member) pairs
+    """
+    items: list = []
+    for path in inputs:
+        if os.path.isdir(path):
+            items.extend(sorted(glob.glob(os.path.join(path, "**", "*.gpml"), recursive=True)))
+        elif zipfile.is_zipfile(path):
+            with zipfile.ZipFile(path) as archive:
+                items.extend((path, x) for x in sorted(archive.namelist()) if x.endswith(".gpml"))
+        else:
+            items.append(path)
+    return items
+
+def _parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input","-i", nargs="+", required=True, help="GPML files, folders or zip archives")
+    parser.add_argument("--output","-o", required=True, help="SQLite database file")
+    parser.add_argument("--database","-db", default="WikiPathways", help="Name of the source database")
+    parser.add_argument("--table","-t", default=mbrole.database.DEFAULT_TABLE)
+    parser.add_argument("--organism","-org", help="Only load pathways of this organism, e.g. \"Homo sapiens\"")
+    parser.add_argument("--types", nargs="+", default=["Metabolite"], help="Types of DataNode loaded")
+    parser.add_argument("--all_xrefs", action="store_true", help="Also load Xrefs of databases without normalization, as Database:ID")
+    parser.add_argument("--workers","-w", type=int, default=os.cpu_count(), help="Processes parsing files in parallel")
+    parser.add_argument("--version","-v", type=str, help="Release of the source, recorded in the database")
+    parser.add_argument("--append", action="store_true", help="Append the rows instead of replacing the previous release of the source")
+    return parser.parse_args()
+
+def main():
+    args = _parse_args()
+    items: list = _input_files(args.input)
+    logging.info(f"Loading {len(items)} GPML files with {args.workers} workers")
+    options: tuple = (args.database, tuple(args.types), args.all_xrefs, args.organism)
+    if args.workers > 1 and len(items) > FILES_PER_TASK:
+        rows = parallel_rows(items, args.workers, *options)
+    else:
+        rows = (row for item in tqdm.tqdm(items, unit="file") for row in parse_gpml(item, *options))
+    conn = sqlite3.connect(args.output)
+    if args.append:
+        total: int = mbrole.database.bulk_insert(conn, rows, args.table)
+    else:
+        total: int = mbrole.database.sync_source(conn, rows, args.table, args.version, [args.database])["rows"]
+    conn.close()
+    logging.info(f"Inserted {total} WikiPathways annotations into {args.output}")
+
+
+if __name__=="__main__":
+    main()
@@ -2,10 +2,17 @@
 
 import argparse
 import json
+import os
 import sqlite3
+import sys
 
 import tqdm
 
+main_path=os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, main_path)
+
+import mbrole.database
+
 
 def parse_args():
     parser: argparse.ArgumentParser = argparse.ArgumentParser("YMDB")
@@ -14,6 +21,8 @@ def parse_args():
     parser.add_argument("--db_table","-t")
     parser.add_argument("--id_tag","-id")
     parser.add_argument("--output","-o")
+    parser.add_argument("--version","-v", type=str, help="Release of the source, recorded in the database")
+    parser.add_argument("--append", action="store_true", help="Append the rows instead of replacing the previous release of the source")
     return parser.parse_args()
 
 def parse_ymdb(file: str):
@@ -21,21 +30,15 @@ def parse_ymdb(file: str):
     for key in data:
         yield key
 
-def _save_to_sqlite(conn, table, id, name, db, url, category):
-    SQL = f"INSERT INTO {table} (compound, annotation, category, database, url) VALUES  (\"{id}\", \"{name}\", \"{category}\", \"{db}\", \"{url}\");"
-    cursor = conn.cursor()
-    cursor.execute(SQL)
-    conn.commit()
-    cursor.close()
-
-def main():
-    args = parse_args()
-    conn = sqlite3.Connection(args.output)
-    for compound in tqdm.tqdm(list(parse_ymdb(args.input))):
+def _ymdb_rows(compounds, db_name: str, id_tag: str):
+    """
+        Rows for mbrole.database.bulk_insert: pathways and locations of each compound
+    """
+    for compound in compounds:
         if "pathways" in compound and compound["pathways"]:
             pathways = compound["pathways"]
             for pathway in pathways:
-                _save_to_sqlite(conn, args.db_table, compound[args.id_tag], pathway["name"], args.db_name, compound[args.id_tag], "pathways")
+                yield (compound[id_tag], pathway["name"], "pathways", db_name, compound[id_tag])
         if "location" in compound and compound["location"]:
             location = compound["location"]
             if(";" in compound["location"]):
@@ -44,10 +47,19 @@ def main():
             else:
                 location = [location]
             for element in location:
-                _save_to_sqlite(conn, args.db_table, compound[args.id_tag], element, args.db_name, compound[args.id_tag], "location")
-    conn.close
+                yield (compound[id_tag], element, "location", db_name, compound[id_tag])
+
+def main():
+    args = parse_args()
+    conn = sqlite3.Connection(args.output)
+    rows = _ymdb_rows(tqdm.tqdm(parse_ymdb(args.input)), args.db_name, args.id_tag)
+    if args.append:
+        mbrole.database.bulk_insert(conn, rows, args.db_table)
+    else:
+        mbrole.database.sync_source(conn, rows, args.db_table, args.version, [args.db_name])
+    conn.close()
     
 
 if __name__=="__main__":
     main()
-    pass
\ No newline at end of file
+    pass
@@ -0,0 +1,69 @@
+#! /usr/bin/env python3
+
+import os
+import os.path
+import sqlite3
+import sys
+
+import pytest
+
+main_path=os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, main_path)
+
+from mbrole import annotation
+from mbrole import database
+from mbrole import functional_enrichment as fe
+
+
+def test_annotation_store(tmp_path):
+    db_file = str(tmp_path / "annotation.db")
+    conn = sqlite3.connect(db_file)
+    rows = [("A", 'say "hi"', "", "CHEBI", ""), ("B", "glycolysis", "", "CHEBI", ""),
+            ("B", "glycolysis", "", "KEGG", ""), ("C", "glycolysis", "", "KEGG", ""), ("D", "tca", "", "KEGG", "")]
+    database.bulk_insert(conn, rows)
+    with annotation.AnnotationStore(db_file) as store:
+        assert store.databases() == ["CHEBI", "KEGG"]
+        assert store.compounds() == {"A", "B", "C", "D"}
+        assert store.compounds_for_annotations(['say "hi"', "glycolysis", "missing"]) == {'say "hi"': {"A"}, "glycolysis": {"B", "C"}, "missing": set()}
+        for databases in (["CHEBI", "KEGG"], ["KEGG", "CHEBI"]):
+            merged = {}
+            for name in databases:
+                merged = merged | fe.get_genes_per_category(conn, "mbrole", name)
+            assert store.compounds_for_databases(databases) == merged
+        assert store.annotation_matrix(["KEGG"]).to_dict() == {"glycolysis": {"B", "C"}, "tca": {"D"}}
+        with pytest.raises(sqlite3.OperationalError):
+            store.conn.execute("DELETE FROM mbrole_compounds;")
+    conn.close()
+
+
+def test_organism_background(tmp_path):
+    db_file = str(tmp_path / "annotation.db")
+    conn = sqlite3.connect(db_file)
+    database.bulk_insert(conn, [("A", "glycolysis", "", "KEGG", ""), ("B", "tca", "", "KEGG", "")])
+    assert database.store_background(conn, "hsa", ["A", "B", "Z", "A"]) == 3
+    assert database.store_background(conn, "eco", ["A"]) == 1
+    # Storing again replaces the background
+    assert database.store_background(conn, "eco", ["B", "Y"]) == 2
+    with annotation.AnnotationStore(db_file) as store:
+        assert store.organisms() == {"hsa": 3, "eco": 2}
+        assert store.background("eco") == {"B", "Y"}
+        with pytest.raises(KeyError):
+            store.background("mmu")
+    conn.close()
+
+
+def test_translate(tmp_path):
+    db_file = str(tmp_path / "annotation.db")
+    conn = sqlite3.connect(db_file)
+    database.bulk_insert(conn, [("CHEBI_4167", "sugar", "", "CHEBI", ""), ("C00031", "glycolysis", "", "KEGG", ""), ("C00022", "glycolysis", "", "KEGG", "")])
+    aliases = [("kegg", "C00031", "CHEBI_4167"), ("hmdb", "HMDB00122", "CHEBI_4167"), ("inchikey", "WQZGKKKJIJFFOK-GASJEMHNSA-N", "CHEBI_4167"),
+               ("name", "D-Glucose", "CHEBI_4167"), ("chebi", "CHEBI:4167", "C00031"), ("hmdb", "HMDB0000122", "C00031"), ("kegg", "C99999", "missing")]
+    assert database.store_id_map(conn, aliases, "test") == 7
+    # Loading the source again replaces its rows
+    assert database.store_id_map(conn, aliases[:-1], "test") == 6
+    with annotation.AnnotationStore(db_file) as store:
+        translation = store.translate(["hmdb:122", "C00031", "d-glucose", "wqzgkkkjijffok-gasjemhnsa-n", "C99999", "pyruvate", "C00022"])
+        assert translation == {"hmdb:122": {"CHEBI_4167", "C00031"}, "C00031": {"CHEBI_4167", "C00031"}, "d-glucose": {"CHEBI_4167"},
+                               "wqzgkkkjijffok-gasjemhnsa-n": {"CHEBI_4167"}, "C99999": set(), "pyruvate": set(), "C00022": {"C00022"}}
+        assert store.translate(["4167"], "chebi") == {"4167": {"C00031", "CHEBI_4167"}}
+    conn.close()
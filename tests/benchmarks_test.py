@@ -0,0 +1,37 @@
+#! /usr/bin/env python3
+
+import json
+import os
+import os.path
+import sys
+
+main_path=os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, main_path)
+
+from benchmarks import run
+from benchmarks import synthetic
+
+
+def test_power_law_sizes():
+    sizes = synthetic.category_sizes(10000, 5000, alpha=2.0)
+    assert sizes.min() >= 3 and sizes.max() <= 1000
+    # Most categories are small, a few are large
+    assert (sizes < 10).mean() > 0.5 and (sizes > 100).sum() > 0
+
+
+def test_benchmark_smoke(tmp_path):
+    baseline = tmp_path / "baseline.json"
+    assert run.main(["--compounds", "500", "--categories", "50", "--queries", "2", "--query_size", "20",
+                     "--engines", "batch", "sql", "loop", "--save", str(baseline)]) == 0
+    result = json.loads(baseline.read_text())
+    assert set(result["results"]) == {"setup", "batch", "sql", "loop"}
+    for engine in ("batch", "sql", "loop"):
+        assert set(result["results"][engine]) == {"annotation", "background", "enrichment", "fdr", "output"}
+    # All engines find the same significant categories
+    assert len({result["results"][x]["output"]["rows"] for x in ("batch", "sql", "loop")}) == 1
+    faster, slower = json.loads(baseline.read_text()), json.loads(baseline.read_text())
+    for fast_stages, slow_stages in zip(faster["results"].values(), slower["results"].values()):
+        for fast, slow in zip(fast_stages.values(), slow_stages.values()):
+            fast["seconds"], slow["seconds"] = 0.5, 1.0
+    assert run.compare(faster, slower, 0.2) == []
+    assert len(run.compare(slower, faster, 0.2)) == 16
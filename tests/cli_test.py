@@ -0,0 +1,233 @@
+#! /usr/bin/env python3
+
+import csv
+import os
+import os.path
+import sqlite3
+import sys
+
+import pytest
+
+main_path=os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, main_path)
+
+from mbrole import cli
+from mbrole import database
+
+
+def _annotation_db(path):
+    conn = sqlite3.connect(path)
+    rows = [(f"C{i}", f"cat{j}", "", "KEGG", "") for j in range(6) for i in range(j, 40, j + 1)]
+    database.bulk_insert(conn, rows)
+    conn.close()
+
+
+def _run(monkeypatch, *argv):
+    monkeypatch.setattr(sys, "argv", ["mbrole-cli", *argv])
+    cli.main()
+
+
+def _read(path):
+    with open(path, newline="") as fhand:
+        return list(csv.DictReader(fhand))
+
+
+def _queries(tmp_path):
+    queries = tmp_path / "queries"
+    for folder, compounds in (("a", range(0, 12)), ("b", range(20, 30))):
+        (queries / folder).mkdir(parents=True)
+        (queries / folder / "q1.txt").write_text("".join(f"C{i}\n" for i in compounds))
+    (queries / "q2.txt").write_text("".join(f"C{i}\n" for i in range(0, 40, 3)))
+    (queries / "empty.txt").write_text("\n\n")
+    return queries
+
+
+def _single(monkeypatch, tmp_path, db_file, query):
+    output = str(tmp_path / "single.csv")
+    _run(monkeypatch, "-i", str(query), "-dbf", db_file, "-o", output, "--all")
+    return _read(output)
+
+
+def test_batch_directory_and_glob(tmp_path, monkeypatch):
+    db_file = str(tmp_path / "annotation.db")
+    _annotation_db(db_file)
+    queries = _queries(tmp_path)
+    # A directory: its files, without subfolders. The empty file is skipped
+    _run(monkeypatch, "-b", str(queries), "-dbf", db_file, "-od", str(tmp_path / "dir"), "--all")
+    assert sorted(os.listdir(tmp_path / "dir")) == ["q2.csv"]
+    assert _read(tmp_path / "dir" / "q2.csv") == _single(monkeypatch, tmp_path, db_file, queries / "q2.txt")
+    # A glob with the same file name in two folders: both are written
+    _run(monkeypatch, "-b", str(queries / "*" / "q1.txt"), "-dbf", db_file, "-od", str(tmp_path / "glob"), "--all")
+    assert sorted(os.listdir(tmp_path / "glob")) == ["a_q1.csv", "b_q1.csv"]
+    for folder in ("a", "b"):
+        assert _read(tmp_path / "glob" / f"{folder}_q1.csv") == _single(monkeypatch, tmp_path, db_file, queries / folder / "q1.txt")
+    assert _read(tmp_path / "glob" / "a_q1.csv") != _read(tmp_path / "glob" / "b_q1.csv")
+
+
+def test_batch_manifest(tmp_path, monkeypatch):
+    db_file = str(tmp_path / "annotation.db")
+    _annotation_db(db_file)
+    queries = _queries(tmp_path)
+    manifest = queries / "manifest.list"
+    manifest.write_text("a/q1.txt\nb/q1.txt\n\nq2.txt\nempty.txt\n")
+    output = str(tmp_path / "long.csv")
+    _run(monkeypatch, "-b", str(manifest), "-dbf", db_file, "-o", output, "--all")
+    rows = _read(output)
+    assert list(rows[0])[0] == "query"
+    assert list(dict.fromkeys(x["query"] for x in rows)) == [os.path.join("a", "q1"), os.path.join("b", "q1"), "q2"]
+    for name, file in ((os.path.join("a", "q1"), "a/q1.txt"), ("q2", "q2.txt")):
+        expected = _single(monkeypatch, tmp_path, db_file, queries / file)
+        assert [{x: y for x, y in row.items() if x != "query"} for row in rows if row["query"] == name] == expected
+
+
+def test_batch_of_empty_files(tmp_path, monkeypatch):
+    db_file = str(tmp_path / "annotation.db")
+    _annotation_db(db_file)
+    queries = tmp_path / "queries"
+    queries.mkdir()
+    (queries / "empty.txt").write_text("")
+    (queries / "blank.txt").write_text("\n \n")
+    with pytest.raises(SystemExit):
+        _run(monkeypatch, "-b", str(queries), "-dbf", db_file, "-od", str(tmp_path / "out"))
+    assert not os.path.exists(tmp_path / "out")
+
+
+def test_organism_background(tmp_path, monkeypatch):
+    import scipy.stats
+    db_file = str(tmp_path / "annotation.db")
+    _annotation_db(db_file)
+    background = [f"C{i}" for i in range(20)] + [f"Z{i}" for i in range(10)]
+    conn = sqlite3.connect(db_file)
+    database.store_background(conn, "hsa", background)
+    conn.close()
+    query = tmp_path / "query.txt"
+    query.write_text("".join(f"C{i}\n" for i in range(10)))
+    bg_file = tmp_path / "background.txt"
+    bg_file.write_text("\n".join(background))
+    for engine in ("batch", "loop", "sql"):
+        outputs = {}
+        for name, options in (("organism", ["--organism", "hsa"]), ("file", ["-bg", str(bg_file)]), ("default", [])):
+            outputs[name] = str(tmp_path / f"{name}_{engine}.csv")
+            _run(monkeypatch, "-i", str(query), "-dbf", db_file, "-o", outputs[name], "-e", engine, "--all", *options)
+        organism = {x["name"]: x for x in _read(outputs["organism"])}
+        assert list(organism.values()) == _read(outputs["file"])
+        # cat0 holds C0 to C39: 10 of the query and 20 of the 30 compounds of the organism
+        expected = scipy.stats.fisher_exact([[10, 20], [0, 10]]).pvalue
+        assert (organism["cat0"]["Compund-in-set"], organism["cat0"]["Compound-in-annotation"]) == ("10", "40")
+        assert abs(float(organism["cat0"]["pval"]) - expected) <= 1e-12 * expected
+        default = {x["name"]: x for x in _read(outputs["default"])}
+        assert float(default["cat0"]["pval"]) != float(organism["cat0"]["pval"])
+    with pytest.raises(SystemExit):
+        _run(monkeypatch, "-i", str(query), "-dbf", db_file, "-o", str(tmp_path / "missing.csv"), "--organism", "mmu")
+
+
+def test_id_type_translates_the_query(tmp_path, monkeypatch):
+    db_file = str(tmp_path / "annotation.db")
+    _annotation_db(db_file)
+    conn = sqlite3.connect(db_file)
+    database.store_id_map(conn, [("chebi", f"CHEBI:{i}", f"C{i}") for i in range(40)], "test")
+    conn.close()
+    exact = tmp_path / "exact.txt"
+    exact.write_text("".join(f"C{i}\n" for i in range(10)))
+    aliases = tmp_path / "aliases.txt"
+    aliases.write_text("".join(f"CHEBI:{i}\n" for i in range(10)) + "CHEBI:99\n")
+    bg_aliases = tmp_path / "background.txt"
+    bg_aliases.write_text("".join(f"chebi_{i}\n" for i in range(30)))
+    bg_exact = tmp_path / "bg_exact.txt"
+    bg_exact.write_text("".join(f"C{i}\n" for i in range(30)))
+    for engine in ("batch", "loop", "sql"):
+        def run(name, query, *options):
+            output = str(tmp_path / f"{name}_{engine}.csv")
+            _run(monkeypatch, "-i", str(query), "-dbf", db_file, "-o", output, "-e", engine, "--all", *options)
+            return _read(output)
+        expected = run("exact", exact)
+        assert sum(int(x["Compund-in-set"]) for x in expected) > 0
+        # The unmapped CHEBI:99 is left out of the query, so the tables are those of the exact IDs
+        assert run("chebi", aliases, "--id-type", "chebi") == expected
+        assert run("auto", aliases, "--id-type", "auto") == expected
+        # Without translation, no alias is a compound of the db
+        assert sum(int(x["Compund-in-set"]) for x in run("untranslated", aliases)) == 0
+        # The background file is translated too
+        assert run("bg", aliases, "--id-type", "chebi", "-bg", str(bg_aliases)) == run("bg_exact", exact, "-bg", str(bg_exact))
+
+
+def test_metrics_out(tmp_path, monkeypatch):
+    import json
+    import subprocess
+    db_file = str(tmp_path / "annotation.db")
+    _annotation_db(db_file)
+    query = tmp_path / "query.txt"
+    query.write_text("".join(f"C{i}\n" for i in range(10)))
+    for engine in ("batch", "loop", "sql"):
+        metrics_out = tmp_path / f"metrics_{engine}.json"
+        _run(monkeypatch, "-i", str(query), "-dbf", db_file, "-o", str(tmp_path / f"{engine}.csv"), "-e", engine, "--all", "--metrics-out", str(metrics_out))
+        stages = {x["stage"]: x for x in json.loads(metrics_out.read_text())["stages"]}
+        assert list(stages) == ["imports", "input", "categories", "annotation", "background", "enrichment", "fdr", "write"]
+        assert (stages["input"]["queries"], stages["input"]["compounds"]) == (1, 10)
+        assert stages["enrichment"]["tests"] == 6 and stages["write"]["rows"] == 6
+        if engine != "sql":
+            assert stages["annotation"]["categories"] == 6
+    # In a new process, numpy, scipy and the engines are imported in their own stage, not in the timed analysis
+    metrics_out = tmp_path / "metrics.json"
+    subprocess.run([sys.executable, "-m", "mbrole.cli", "-i", str(query), "-dbf", db_file, "-o", str(tmp_path / "new.csv"), "--metrics-out", str(metrics_out)],
+                   env=os.environ | {"PYTHONPATH": main_path}, cwd=main_path, capture_output=True, check=True)
+    imports, *stages = json.loads(metrics_out.read_text())["stages"]
+    assert imports["stage"] == "imports" and imports["modules_loaded"] > 0
+    assert [x["modules_loaded"] for x in stages] == [0] * len(stages)
+
+
+def _legacy_db(path):
+    """
+        Plain table of older loaders. cat0 is in KEGG, first, and in HMDB, later: HMDB's wins
+    """
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE mbrole (compound VARCHAR(20), annotation VARCHAR(50), database VARCHAR(20), url VARCHAR(100));")
+    rows = [(f"C{i}", "cat0", "KEGG", "") for i in range(6)] + [(f"C{i}", f"kegg{i % 3}", "KEGG", "") for i in range(20, 40)]
+    rows += [(f"C{i}", "cat0", "HMDB", "") for i in range(28)] + [(f"C{i}", f"hmdb{i % 4}", "HMDB", "") for i in range(10, 30)]
+    rows += [(f"C{i}", "cat0", "CHEBI", "") for i in range(3)] + [(f"C{i}", "chebi", "CHEBI", "") for i in range(40)]
+    conn.executemany("INSERT INTO mbrole VALUES (?, ?, ?, ?);", rows)
+    conn.commit()
+    return conn
+
+
+def test_engines_agree_on_migrated_db(tmp_path, monkeypatch):
+    query = tmp_path / "query.txt"
+    query.write_text("".join(f"C{i}\n" for i in range(0, 30, 2)))
+    outputs = {}
+    for name, options in (("all", []), ("databases", ["-db", "HMDB", "KEGG"])):
+        for migrated in (False, True):
+            db_file = str(tmp_path / f"{name}_{migrated}.db")
+            conn = _legacy_db(db_file)
+            if migrated:
+                database.create_schema(conn)
+                assert database.is_normalised(conn)
+            conn.close()
+            for engine in ("batch", "loop", "sql"):
+                output = str(tmp_path / f"{name}_{migrated}_{engine}.csv")
+                _run(monkeypatch, "-i", str(query), "-dbf", db_file, "-o", output, "-e", engine, "--all", *options)
+                outputs[name, migrated, engine] = _read(output)
+        expected = outputs[name, False, "sql"]
+        assert all(outputs[name, migrated, engine] == expected for migrated in (False, True) for engine in ("batch", "loop", "sql"))
+    # cat0 of the last database: CHEBI of all of them, KEGG of those given
+    assert {x["name"]: x["Compound-in-annotation"] for x in outputs["all", True, "batch"]}["cat0"] == "3"
+    assert {x["name"]: x["Compound-in-annotation"] for x in outputs["databases", True, "batch"]}["cat0"] == "6"
+
+
+def test_engines_agree_after_sync(tmp_path, monkeypatch):
+    db_file = str(tmp_path / "annotation.db")
+    conn = sqlite3.connect(db_file)
+    database.sync_source(conn, [(f"C{i}", "cat0", "", "KEGG", "") for i in range(6)], databases=["KEGG"])
+    database.sync_source(conn, [(f"C{i}", "cat0", "", "HMDB", "") for i in range(28)] + [(f"C{i}", "hmdb", "", "HMDB", "") for i in range(5, 15)], databases=["HMDB"])
+    # KEGG's rows are written again, after HMDB's, but its category keeps its place
+    database.sync_source(conn, [(f"C{i}", "cat0", "", "KEGG", "") for i in range(8)], databases=["KEGG"])
+    assert database.database_order(conn) == ["KEGG", "HMDB"]
+    conn.close()
+    query = tmp_path / "query.txt"
+    query.write_text("".join(f"C{i}\n" for i in range(0, 30, 3)))
+    outputs = {}
+    for engine in ("batch", "loop", "sql"):
+        outputs[engine] = str(tmp_path / f"{engine}.csv")
+        _run(monkeypatch, "-i", str(query), "-dbf", db_file, "-o", outputs[engine], "-e", engine, "--all")
+    expected = _read(outputs["sql"])
+    assert {x["name"]: x["Compound-in-annotation"] for x in expected} == {"cat0": "28", "hmdb": "10"}
+    assert _read(outputs["batch"]) == expected and _read(outputs["loop"]) == expected
@@ -0,0 +1,109 @@
+#! /usr/bin/env python3
+
+import os
+import os.path
+import sqlite3
+import sys
+import tracemalloc
+
+main_path=os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, main_path)
+
+from mbrole import annotation
+from mbrole import database
+from mbrole import functional_enrichment as fe
+
+
+def test_schema_insert_and_query(tmp_path):
+    db_file = str(tmp_path / "annotation.db")
+    conn = sqlite3.connect(db_file)
+    database.create_schema(conn)
+    assert database.is_normalised(conn)
+    assert database.get_schema_version(conn) == database.SCHEMA_VERSION
+    conn.execute("INSERT INTO mbrole (compound, annotation, category, database, url) VALUES ('A', 'acid', 'Chebi role', 'CHEBI', 'url');")
+    conn.execute("INSERT INTO mbrole (compound, annotation, database, url) VALUES ('B', 'glycolysis', 'KEGG', '');")
+    conn.execute("INSERT INTO mbrole (compound, annotation, database, url) VALUES ('B', 'glycolysis', 'KEGG', '');")
+    conn.commit()
+    assert annotation.get_categories_from_db(db_file, "mbrole") == ["CHEBI", "KEGG"]
+    assert fe.get_genes_per_category(conn, "mbrole", "KEGG") == {"glycolysis": ["B"]}
+    assert fe.get_category_compounds(conn, "acid") == {"A"}
+
+
+def test_migrate_legacy_table():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE mbrole (compound VARCHAR(20), annotation VARCHAR(50), database VARCHAR(20), url VARCHAR(100));")
+    rows = [("A", "glycolysis", "KEGG", ""), ("B", "glycolysis", "KEGG", ""), ("B", "glycolysis", "KEGG", ""), ("C", "acid", "CHEBI", "")]
+    conn.executemany("INSERT INTO mbrole VALUES (?, ?, ?, ?);", rows)
+    database.create_schema(conn)
+    assert database.is_normalised(conn)
+    assert conn.execute("SELECT compound, annotation, database FROM mbrole ORDER BY rowid;").fetchall() == [("A", "glycolysis", "KEGG"), ("B", "glycolysis", "KEGG"), ("C", "acid", "CHEBI")]
+    indexes = {x[0] for x in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index';")}
+    assert {"mbrole_categories_source", "mbrole_compounds_category", "mbrole_compounds_compound"} <= indexes
+
+
+def test_bulk_insert():
+    conn = sqlite3.connect(":memory:")
+    rows = [(f"C{i % 7}", f"cat{i % 3}", "", "KEGG", "") for i in range(50)]
+    assert database.bulk_insert(conn, iter(rows), batch_size=8) == 50
+    assert conn.execute("SELECT COUNT(*) FROM mbrole;").fetchone()[0] == len(set(rows))
+    # Appending keeps repeated rows out through the unique index
+    database.bulk_insert(conn, [("C0", "cat0", "", "KEGG", ""), ("X", "cat0", "", "CHEBI", "url")])
+    assert conn.execute("SELECT COUNT(*) FROM mbrole;").fetchone()[0] == len(set(rows)) + 1
+    # Relaxed settings are restored after the load
+    assert conn.execute("PRAGMA synchronous;").fetchone()[0] == 2
+
+
+def test_sync_source():
+    conn = sqlite3.connect(":memory:")
+    release = [("A", "glycolysis", "pathway", "KEGG", ""), ("B", "glycolysis", "pathway", "KEGG", ""), ("C", "tca", "pathway", "KEGG", "")]
+    database.bulk_insert(conn, [("X", "acid", "", "CHEBI", "")])
+    assert database.sync_source(conn, release, version="100") == {"rows": 3, "added": 2, "removed": 0, "changed": 0, "unchanged": 0}
+    assert database.sync_source(conn, iter(release), version="100")["unchanged"] == 2
+    assert database.source_generations(conn) == {"CHEBI": 1, "KEGG": 1}
+    # New release: glycolysis changes, tca is gone, urea is new
+    release = [("B", "glycolysis", "pathway", "KEGG", ""), ("A", "glycolysis", "pathway", "KEGG", ""), ("D", "glycolysis", "pathway", "KEGG", ""), ("A", "urea", "pathway", "KEGG", "")]
+    assert database.sync_source(conn, release, version="101", databases=["KEGG"]) == {"rows": 4, "added": 1, "removed": 1, "changed": 1, "unchanged": 0}
+    assert sorted(conn.execute("SELECT compound, annotation, database FROM mbrole;").fetchall()) == [("A", "glycolysis", "KEGG"), ("A", "urea", "KEGG"), ("B", "glycolysis", "KEGG"), ("D", "glycolysis", "KEGG"), ("X", "acid", "CHEBI")]
+    assert database.source_generations(conn) == {"CHEBI": 1, "KEGG": 2}
+    assert database.source_versions(conn)["KEGG"] == "101"
+    # Rows of other sources are refused, and nothing changes
+    try:
+        database.sync_source(conn, [("Y", "acid", "", "CHEBI", "")], databases=["KEGG"])
+        assert False
+    except ValueError:
+        pass
+    assert conn.execute("SELECT COUNT(*) FROM mbrole;").fetchone()[0] == 5
+
+
+def _release(size):
+    for i in range(size):
+        yield (f"C{i:08d}", f"pathway{i // 50}", "", "KEGG", f"https://example.org/{i}")
+
+
+def test_sync_source_streams():
+    # Peak Python memory of the sync, against that of the release grouped in a dict
+    conn = sqlite3.connect(":memory:")
+    tracemalloc.start()
+    try:
+        counts = database.sync_source(conn, _release(50000), batch_size=1000)
+        synced = tracemalloc.get_traced_memory()[1]
+        tracemalloc.reset_peak()
+        groups: dict = {}
+        for compound, name, category, source, url in _release(50000):
+            groups.setdefault((source, name, category), {}).setdefault(compound, url)
+        grouped = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert counts == {"rows": 50000, "added": 1000, "removed": 0, "changed": 0, "unchanged": 0}
+    assert conn.execute("SELECT COUNT(*) FROM mbrole;").fetchone()[0] == 50000
+    assert synced < grouped / 4
+    assert database.sync_source(conn, _release(50000), batch_size=1000)["unchanged"] == 1000
+
+
+def test_merge_categories():
+    categories = [("KEGG", "cat0"), ("KEGG", "kegg"), ("HMDB", "hmdb"), ("HMDB", "cat0"), ("CHEBI", "cat0")]
+    # The name is taken from the last database, at the position of its first category
+    assert database.merge_categories(categories, ["KEGG", "HMDB", "CHEBI"]) == [4, 1, 2]
+    assert database.merge_categories(categories, ["HMDB", "KEGG"]) == [2, 0, 1]
+    assert database.merge_categories(categories, ["HMDB"]) == [2, 3]
+    assert database.merge_categories(categories, []) == []
@@ -3,12 +3,14 @@
 import pytest
 import os
 import os.path
+import sqlite3
 import sys
 
 main_path=os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 sys.path.insert(0, main_path)
 
 from mbrole import functional_enrichment as fe
+from mbrole.incidence import AnnotationMatrix
 
 
 def test_enrichment():
@@ -16,4 +18,111 @@ def test_enrichment():
     background = {"A","B","C","D","E","F","G","H","I"}
     category = {"B","C","D","E"}
     pval = fe.functional_enrichment(query, category, background)
-    print(pval)
\ No newline at end of file
+    print(pval)
+
+def test_batch_enrichment_matches_fisher():
+    background = {f"C{i}" for i in range(200)}
+    query = {f"C{i}" for i in range(0, 60, 3)} | {"NOT_IN_BG"}
+    annotation = {f"cat{j}": [f"C{i}" for i in range(j, 200, j + 2)] for j in range(40)}
+    annotation["duplicated"] = ["C0", "C0", "C3"]
+    annotation["outside"] = ["X1", "X2"]
+    names, in_set, in_annotation, pvals = fe.batch_functional_enrichment(query, annotation, background)
+    assert names == list(annotation.keys())
+    for name, k, size, pval in zip(names, in_set, in_annotation, pvals):
+        expected = fe.functional_enrichment(query, annotation[name], background)
+        assert pval == expected[0]
+        assert k == expected[1]
+        assert size == expected[2]
+
+
+def test_multi_query_enrichment():
+    background = {f"C{i}" for i in range(100)}
+    annotation = AnnotationMatrix.from_dict({f"cat{j}": [f"C{i}" for i in range(j, 100, j + 3)] for j in range(20)})
+    queries = [{f"C{i}" for i in range(0, 50, 2)}, {"C1", "C4", "C7", "OTHER"}, set(range(5))]
+    names, in_set, sizes, pvals = fe.multi_query_functional_enrichment(queries, annotation, background)
+    assert in_set.shape == pvals.shape == (len(annotation), len(queries))
+    for i, query in enumerate(queries):
+        expected = fe.matrix_functional_enrichment(query, annotation, background)
+        assert list(in_set[:, i]) == list(expected[1])
+        assert list(pvals[:, i]) == list(expected[3])
+
+
+def test_sql_enrichment_matches_matrix():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE mbrole (compound VARCHAR(20), annotation VARCHAR(50), database VARCHAR(20), url VARCHAR(100));")
+    rows = [(f"C{i}", f"cat{j % 7}", database, "") for database in ("KEGG", "CHEBI") for j in range(12) for i in range(j, 80, j + 2)]
+    conn.executemany("INSERT INTO mbrole VALUES (?, ?, ?, ?);", rows)
+    query = {f"C{i}" for i in range(0, 40, 3)}
+    background = {f"C{i}" for i in range(60)}
+    for bg, databases, annotations in ((None, None, None), (background, ["CHEBI", "KEGG"], None), (background, None, ["cat2", "cat9"])):
+        matrix = AnnotationMatrix.from_db(conn, "mbrole")
+        matrix = matrix.for_annotations(annotations) if annotations else matrix.for_databases(databases)
+        expected = fe.matrix_functional_enrichment(query, matrix, bg if bg is not None else set(matrix.compounds))
+        result = fe.sql_functional_enrichment(conn, "mbrole", query, bg, databases, annotations)
+        assert list(result[0]) == list(expected[0])
+        for x, y in zip(result[1:], expected[1:]):
+            assert list(x) == list(y)
+
+
+def test_pvalue_cache(tmp_path):
+    import numpy as np
+    import scipy.stats
+    rng = np.random.default_rng(0)
+    tables = [rng.integers(0, x, 200) for x in (20, 200, 40, 2000)]
+    for alternative in ("two-sided", "less", "greater"):
+        cache = fe.PValueCache(maxsize=150, alternative=alternative)
+        pvals = cache.pvalues(*tables)
+        expected = [scipy.stats.fisher_exact([[a, b], [c, d]], alternative=alternative).pvalue for a, b, c, d in zip(*tables)]
+        assert np.allclose(pvals, expected, rtol=1e-6, atol=0)
+        assert len(cache) == 150
+        cache.save(tmp_path / "cache.npz")
+        loaded = fe.PValueCache.load(tmp_path / "cache.npz", alternative=alternative)
+        assert list(loaded.pvalues(*(x[-100:] for x in tables))) == list(pvals[-100:])
+        assert loaded.hits == 100 and loaded.misses == 0
+        assert len(fe.PValueCache.load(tmp_path / "cache.npz", alternative="other")) == 0
+
+
+def test_pvalue_cache_matches_uncached(tmp_path):
+    import numpy as np
+    rng = np.random.default_rng(0)
+    # Tables with a+b = c+d have a symmetric distribution: the tail on the other side ties with the observed table
+    half = rng.integers(5, 3000, 2000)
+    n = np.minimum(rng.integers(1, 200, 2000), half)
+    a = (rng.random(2000) * n).astype(np.int64)
+    ties = (a, half - a, n - a, half - n + a)
+    # And tables over large backgrounds, where log-factorials round the most
+    background = rng.integers(10 ** 5, 10 ** 6, 2000)
+    size = rng.integers(1, 2000, 2000)
+    query = rng.integers(1, 300, 2000)
+    a = rng.binomial(np.minimum(query, size), 0.2)
+    large = (a, size, query - a, background - size)
+    for alternative in ("two-sided", "less", "greater"):
+        for tables in (ties, large):
+            expected = fe.fisher_exact_batch(*tables, alternative=alternative)
+            cache = fe.PValueCache(alternative=alternative)
+            pvals = cache.pvalues(*tables)
+            # The same terms are added up: only rounding differs
+            assert np.allclose(pvals, expected, rtol=1e-8, atol=0)
+            cache.save(tmp_path / "cache.npz")
+            loaded = fe.PValueCache.load(tmp_path / "cache.npz", alternative=alternative)
+            assert np.array_equal(loaded.pvalues(*tables), pvals)
+            assert np.allclose(fe.enrichment_pvalues(*tables, alternative=alternative, cache=loaded), fe.enrichment_pvalues(*tables, alternative=alternative), rtol=1e-8, atol=0)
+        if alternative == "two-sided":
+            # Ties cannot be told apart from the log-factorials: they are computed as without the cache
+            assert np.array_equal(fe.PValueCache().pvalues(*ties), fe.fisher_exact_batch(*ties))
+
+
+def test_pruning_keeps_significant_categories():
+    import numpy as np
+    rng = np.random.default_rng(0)
+    b = rng.integers(0, 300, 2000)
+    a = rng.binomial(np.minimum(b, 40), 0.3)
+    c, d = 40 - np.minimum(a, 40), 1000 - b
+    pvalues = fe.enrichment_pvalues(a, b, c, d)
+    assert np.all(fe.minimum_pvalues(a, b, c, d) <= pvalues * (1 + 1e-9))
+    pruned = fe.enrichment_pvalues(a, b, c, d, prune=0.05)
+    assert (pruned != pvalues).sum() > 0
+    fdr, pruned_fdr = fe.correct_pvalue(pvalues), fe.correct_pvalue(pruned)
+    assert np.array_equal(fdr < 0.05, pruned_fdr < 0.05)
+    assert np.array_equal(fdr[fdr < 0.05], pruned_fdr[fdr < 0.05])
+    assert list(fe.size_window([1, 5, 10, 50], 5, 10)) == [False, True, True, False]
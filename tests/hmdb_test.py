@@ -0,0 +1,97 @@
+#! /usr/bin/env python3
+
+import gzip
+import importlib.util
+import os
+import os.path
+import sqlite3
+import sys
+
+main_path=os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, main_path)
+
+from mbrole import annotation
+from mbrole import database
+
+
+def _script(name):
+    """
+        Loads a script of scripts/ as a module. It is registered in sys.modules, so worker processes find its functions
+    """
+    spec = importlib.util.spec_from_file_location(name.replace("-", "_"), os.path.join(main_path, "scripts", f"{name}.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+hmdb = _script("hmdb-to-sqlite")
+split = _script("split-hmdb-xml")
+
+
+def _metabolite(i, secondary, pathways, terms):
+    return (f"<metabolite>\n"
+            f"  <accession>HMDB{i:07d}</accession>\n"
+            f"  <secondary_accessions>\n" + "".join(f"    <accession>{x}</accession>\n" for x in secondary) + "  </secondary_accessions>\n"
+            f"  <name>Metabolite {i}</name>\n"
+            f"  <kegg_id>C{i:05d}</kegg_id>\n"
+            f"  <ontology>\n    <root>\n      <term>{terms[0]}</term>\n      <descendants>\n" + "".join(f"        <descendant><term>{x}</term></descendant>\n" for x in terms[1:]) +
+            f"      </descendants>\n    </root>\n  </ontology>\n"
+            f"  <biological_properties>\n    <cellular_locations><cellular>Cytoplasm</cellular></cellular_locations>\n"
+            f"    <biospecimen_locations><biospecimen>Blood</biospecimen><biospecimen> </biospecimen></biospecimen_locations>\n"
+            f"    <pathways>\n" + "".join(f"      <pathway><name>{x}</name><smpdb_id>SMP1</smpdb_id></pathway>\n" for x in pathways) + "    </pathways>\n"
+            f"  </biological_properties>\n"
+            f"</metabolite>\n")
+
+
+def _hmdb_xml(path, metabolites=5):
+    with gzip.open(path, "wt", encoding="utf-8") as fhand:
+        fhand.write('<?xml version="1.0" encoding="UTF-8"?>\n<hmdb xmlns="http://www.hmdb.ca">\n')
+        for i in range(1, metabolites + 1):
+            fhand.write(_metabolite(i, [f"HMDB0{i}", f"HMDB0000{i}0"], [f"Pathway {j}" for j in range(i)], ["Disposition", f"Class {i % 2}"]))
+        fhand.write("</hmdb>\n")
+
+
+def test_parse_hmdb(tmp_path):
+    xml = str(tmp_path / "hmdb_metabolites.xml.gz")
+    _hmdb_xml(xml)
+    rows = list(hmdb.parse_hmdb(xml, "HMDB"))
+    url = "https://hmdb.ca/metabolites/HMDB0000002"
+    assert [x for x in rows if x[0] == "HMDB0000002"] == [("HMDB0000002", "Pathway 0", "pathway", "HMDB", url), ("HMDB0000002", "Pathway 1", "pathway", "HMDB", url),
+                                                          ("HMDB0000002", "Cytoplasm", "cellular location", "HMDB", url), ("HMDB0000002", "Blood", "biospecimen", "HMDB", url),
+                                                          ("HMDB0000002", "Disposition", "ontology", "HMDB", url), ("HMDB0000002", "Class 0", "ontology", "HMDB", url)]
+    assert len(rows) == 4 * 5 + sum(range(1, 6))
+
+
+def test_hmdb_id_map(tmp_path):
+    xml = str(tmp_path / "hmdb_metabolites.xml.gz")
+    _hmdb_xml(xml)
+    aliases = list(hmdb.parse_hmdb(xml, "HMDB", id_map=True))
+    assert [x for x in aliases if x[2] == "HMDB0000003"] == [("hmdb", "HMDB0000003", "HMDB0000003"), ("hmdb", "HMDB03", "HMDB0000003"), ("hmdb", "HMDB000030", "HMDB0000003"),
+                                                             ("kegg", "C00003", "HMDB0000003"), ("name", "Metabolite 3", "HMDB0000003")]
+    db_file = str(tmp_path / "annotation.db")
+    conn = sqlite3.connect(db_file)
+    database.sync_source(conn, hmdb.parse_hmdb(xml, "HMDB"), databases=["HMDB"])
+    database.store_id_map(conn, aliases, "HMDB")
+    conn.close()
+    # Secondary accessions, in any form, find the current one
+    with annotation.AnnotationStore(db_file) as store:
+        assert store.translate(["HMDB03", "HMDB0000030", "C00004", "nothing"], "auto") == {"HMDB03": {"HMDB0000003"}, "HMDB0000030": {"HMDB0000003"},
+                                                                                         "C00004": {"HMDB0000004"}, "nothing": set()}
+
+
+def test_split_and_parallel_parse(tmp_path):
+    xml = str(tmp_path / "hmdb_metabolites.xml.gz")
+    _hmdb_xml(xml, 12)
+    # 12 metabolites in chunks of 5: the trailing chunk has two
+    assert split.split_hmdb(xml, str(tmp_path / "chunks5"), 5) == 3
+    expected = list(hmdb.parse_hmdb(xml, "HMDB"))
+    assert [row for file in hmdb._input_files([str(tmp_path / "chunks5")]) for row in hmdb.parse_hmdb(file, "HMDB")] == expected
+    # More than 10 chunks are still read in the order of the input
+    chunks = str(tmp_path / "chunks")
+    assert split.split_hmdb(xml, chunks, 1) == 12
+    files = hmdb._input_files([chunks])
+    assert len(files) == 12
+    assert [row for file in files for row in hmdb.parse_hmdb(file, "HMDB")] == expected
+    assert list(hmdb.parallel_rows(files, "HMDB", 2)) == expected
+    assert list(hmdb.parallel_rows(files, "HMDB", 2, id_map=True)) == list(hmdb.parse_hmdb(xml, "HMDB", id_map=True))
@@ -0,0 +1,44 @@
+#! /usr/bin/env python3
+
+import os
+import os.path
+import sqlite3
+import sys
+
+main_path=os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, main_path)
+
+from mbrole import functional_enrichment as fe
+from mbrole.incidence import AnnotationMatrix
+
+
+def _annotation_db():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE mbrole (compound VARCHAR(20), annotation VARCHAR(50), database VARCHAR(20), url VARCHAR(100));")
+    rows = [("A", "glycolysis", "KEGG", ""), ("B", "glycolysis", "KEGG", ""), ("B", "glycolysis", "KEGG", ""),
+            ("C", "acid", "CHEBI", ""), ("D", "acid", "CHEBI", ""), ("A", "glycolysis", "CHEBI", "")]
+    conn.executemany("INSERT INTO mbrole VALUES (?, ?, ?, ?);", rows)
+    return conn
+
+
+def test_overlap():
+    matrix = AnnotationMatrix.from_db(_annotation_db(), "mbrole")
+    assert len(matrix) == 3
+    assert list(matrix.sizes) == [2, 2, 1]
+    assert list(matrix.overlap(matrix.indicator({"A", "D", "Z"}))) == [1, 1, 1]
+
+
+def test_databases_merge_as_dicts():
+    conn = _annotation_db()
+    for databases in (["KEGG", "CHEBI"], ["CHEBI", "KEGG"]):
+        annotation: dict = {}
+        for database in databases:
+            annotation = annotation | fe.get_genes_per_category(conn, "mbrole", database)
+        matrix = AnnotationMatrix.from_db(conn, "mbrole", databases).for_databases(databases)
+        assert list(matrix.names) == list(annotation.keys())
+        assert matrix.to_dict() == {k: set(v) for k, v in annotation.items()}
+
+
+def test_for_annotations():
+    matrix = AnnotationMatrix.from_db(_annotation_db(), "mbrole").for_annotations(["glycolysis", "missing"])
+    assert matrix.to_dict() == {"glycolysis": {"A", "B"}, "missing": set()}
@@ -0,0 +1,26 @@
+#! /usr/bin/env python3
+
+import io
+import json
+import os
+import os.path
+import sys
+
+main_path=os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, main_path)
+
+from mbrole import jsonstream
+
+
+def test_iter_array_matches_json_load():
+    document = {"meta": {"skip": ["[", "]", "{\"}"], "n": -1.5e3},
+                "graphs": [{"nodes": [{"id": "a"}], "edges": []},
+                           {"id": "second",
+                            "nodes": [{"id": "http://purl.obolibrary.org/obo/CHEBI_1", "lbl": "ü \\ \"x\""}, 12345, None, [1, [2]]],
+                            "edges": [{"sub": "a", "pred": "is_a", "obj": "b"}]}]}
+    text = json.dumps(document, indent=1, ensure_ascii=False)
+    for chunk_size in (1, 3, 7, 1 << 20):
+        assert list(jsonstream.iter_array(io.StringIO(text), ("graphs", 1, "nodes"), chunk_size)) == document["graphs"][1]["nodes"]
+        assert list(jsonstream.iter_array(io.StringIO(text), ("graphs", 1, "edges"), chunk_size)) == document["graphs"][1]["edges"]
+        assert list(jsonstream.iter_array(io.StringIO(text), ("graphs", 0, "edges"), chunk_size)) == []
+        assert list(jsonstream.iter_array(io.StringIO(text), ("graphs", 2, "nodes"), chunk_size)) == []
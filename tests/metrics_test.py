@@ -0,0 +1,32 @@
+#! /usr/bin/env python3
+
+import json
+import os
+import os.path
+import sys
+
+main_path=os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, main_path)
+
+from mbrole import metrics
+
+
+def test_disabled_metrics_record_nothing():
+    disabled = metrics.Metrics()
+    with disabled.stage("enrichment") as stage:
+        stage.count(tests=10)
+    assert disabled.stages == []
+
+
+def test_stage_metrics(tmp_path):
+    enabled = metrics.Metrics(enabled=True, trace_memory=True)
+    with enabled.stage("enrichment") as stage:
+        data = list(range(100000))
+        stage.count(tests=len(data))
+    enabled.write(str(tmp_path / "metrics.json"))
+    enabled.dump_tracemalloc(str(tmp_path / "tracemalloc.txt"))
+    result = json.loads((tmp_path / "metrics.json").read_text())
+    [record] = result["stages"]
+    assert record["stage"] == "enrichment" and record["tests"] == 100000
+    assert record["wall_seconds"] >= 0 and record["cpu_seconds"] >= 0 and record["peak_rss_mb"] > 0
+    assert record["peak_traced_mb"] > 1
@@ -0,0 +1,40 @@
+#! /usr/bin/env python3
+
+import os
+import os.path
+import random
+import sys
+
+main_path=os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, main_path)
+
+from mbrole import ontology
+
+
+def _ancestors(node, parents):
+    found = set()
+    stack = list(parents.get(node, ()))
+    while stack:
+        parent = stack.pop()
+        if parent not in found:
+            found.add(parent)
+            stack.extend(parents.get(parent, ()))
+    return found
+
+
+def test_ancestor_closure_matches_dfs():
+    rng = random.Random(1)
+    edges = [(f"n{child}", f"n{rng.randrange(child)}") for child in range(1, 300) for _ in range(rng.randint(1, 3))]
+    parents = {}
+    for child, parent in edges:
+        parents.setdefault(child, set()).add(parent)
+    closure = dict(ontology.ancestor_closure(edges))
+    assert set(closure) == set(parents)
+    for node, ancestors in closure.items():
+        assert len(ancestors) == len(set(ancestors))
+        assert set(ancestors) == _ancestors(node, parents)
+
+
+def test_ancestor_closure_skips_cycles():
+    edges = [("a", "root"), ("b", "c"), ("c", "b"), ("d", "b")]
+    assert dict(ontology.ancestor_closure(edges)) == {"a": ["root"]}
@@ -0,0 +1,52 @@
+#! /usr/bin/env python3
+
+import gzip
+import io
+import os
+import os.path
+import sys
+
+import numpy as np
+import pytest
+
+main_path=os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, main_path)
+
+from mbrole import output
+
+
+def _results():
+    names = np.empty(5, dtype=object)
+    names[:] = ["a", "b, c", 'say "hi"', "d", "e"]
+    table = {"name": names, "in_set": np.arange(5, dtype=np.int64), "pval": np.linspace(0, 1, 5)}
+    return {"q1": table, "q2": {x: y[:2] for x, y in table.items()}}
+
+
+def test_format_of():
+    assert output.format_of("out.csv") == "csv"
+    assert output.format_of("out.csv.gz") == "csv.gz"
+    assert output.format_of("out.parquet") == "parquet"
+    assert output.format_of("out.feather") == "arrow"
+    assert output.format_of("/dev/stdout") == "csv"
+    assert output.format_of("out.csv", "parquet") == "parquet"
+
+
+def test_write_csv_chunks(tmp_path):
+    whole = io.StringIO()
+    output.write_csv(whole, _results(), query_column=True)
+    chunked = io.StringIO()
+    output.write_csv(chunked, _results(), query_column=True, chunk_rows=2)
+    assert chunked.getvalue() == whole.getvalue()
+    assert whole.getvalue().splitlines()[:2] == ["query,name,in_set,pval", "q1,a,0,0.0"]
+    output.write_tables(str(tmp_path / "out.csv.gz"), _results(), query_column=True)
+    with gzip.open(tmp_path / "out.csv.gz", "rt", newline="") as fhand:
+        assert fhand.read() == whole.getvalue()
+
+
+def test_write_arrow(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    output.write_tables(str(tmp_path / "out.parquet"), _results(), query_column=True)
+    table = pq.read_table(tmp_path / "out.parquet")
+    assert table.column_names == ["query", "name", "in_set", "pval"]
+    assert table.column("query").to_pylist() == ["q1"] * 5 + ["q2"] * 2
+    assert table.column("name").to_pylist()[:3] == ["a", "b, c", 'say "hi"']
@@ -0,0 +1,30 @@
+#! /usr/bin/env python3
+
+import os
+import os.path
+import sys
+
+main_path=os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, main_path)
+
+from mbrole import functional_enrichment as fe
+from mbrole import parallel
+from mbrole.incidence import AnnotationMatrix
+
+
+def test_parallel_matches_serial():
+    background = {f"C{i}" for i in range(300)}
+    annotation = AnnotationMatrix.from_dict({f"cat{j}": [f"C{i}" for i in range(j, 300, j % 17 + 2)] for j in range(120)})
+    queries = [{f"C{i}" for i in range(0, 90, 3)}, {f"C{i}" for i in range(100, 140)}]
+    serial = fe.multi_query_functional_enrichment(queries, annotation, background)
+    result = parallel.parallel_functional_enrichment(queries, annotation, background, workers=2)
+    assert (serial[1] == result[1]).all()
+    assert (serial[3] == result[3]).all()
+    assert (fe.correct_pvalue(serial[3][:, 0]) == fe.correct_pvalue(result[3][:, 0])).all()
+
+
+def test_chunks_cover_all_rows():
+    annotation = AnnotationMatrix.from_dict({f"cat{j}": [f"C{i}" for i in range(j * j % 50 + 1)] for j in range(37)})
+    chunks = parallel._chunks(annotation.matrix.indptr, 8)
+    assert chunks[0][0] == 0 and chunks[-1][1] == len(annotation)
+    assert all(x[1] == y[0] for x, y in zip(chunks[:-1], chunks[1:]))
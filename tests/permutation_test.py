@@ -0,0 +1,37 @@
+#! /usr/bin/env python3
+
+import os
+import os.path
+import sys
+
+import numpy as np
+
+main_path=os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, main_path)
+
+from mbrole import functional_enrichment as fe
+from mbrole.incidence import AnnotationMatrix
+from mbrole.permutation import PValueLookup, permutation_enrichment
+
+
+def test_lookup_matches_enrichment():
+    background = {f"C{i}" for i in range(120)}
+    annotation = AnnotationMatrix.from_dict({f"cat{j}": [f"C{i}" for i in range(j, 150, j + 2)] for j in range(15)})
+    query = {f"C{i}" for i in range(0, 60, 4)} | {"C130"}
+    _, in_set, _, pvals = fe.matrix_functional_enrichment(query, annotation, background)
+    lookup = PValueLookup(annotation.overlap(annotation.indicator(background)), len(query), len(background))
+    assert np.allclose(lookup(in_set), pvals, rtol=1e-6, atol=0)
+
+
+def test_permutation_enrichment():
+    background = {f"C{i}" for i in range(200)}
+    annotation = AnnotationMatrix.from_dict({f"cat{j}": [f"C{i}" for i in range(j, 200, j + 2)] for j in range(30)})
+    query = {f"C{i}" for i in range(0, 40, 2)}
+    empirical, family_wise = permutation_enrichment(query, annotation, background, 300, seed=7)
+    assert empirical.shape == family_wise.shape == (len(annotation),)
+    assert ((empirical > 0) & (empirical <= 1)).all()
+    assert (family_wise >= empirical).all()
+    again = permutation_enrichment(query, annotation, background, 300, seed=7, workers=2)
+    assert (again[0] == empirical).all() and (again[1] == family_wise).all()
+    # cat0 holds every even compound: the query is always enriched in it
+    assert empirical[0] == 1 / 301
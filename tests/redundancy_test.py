@@ -0,0 +1,41 @@
+#! /usr/bin/env python3
+
+import os
+import os.path
+import sys
+
+import numpy as np
+
+main_path=os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, main_path)
+
+from mbrole import functional_enrichment, redundancy
+from mbrole.incidence import AnnotationMatrix
+
+ANNOTATION = {"map00010": {"C1", "C2", "C3", "C4"},
+              "hsa00010": {"C4", "C3", "C2", "C1"},
+              "glycolysis": {"C1", "C2", "C3", "C4", "C5"},
+              "tca": {"C6", "C7", "C8"},
+              "tca_copy": {"C8", "C7", "C6"},
+              "other": {"C9", "C10"}}
+
+
+def test_deduplicate_fans_out():
+    annotation = AnnotationMatrix.from_dict(ANNOTATION).for_annotations(list(ANNOTATION))
+    rows, inverse = redundancy.deduplicate(annotation)
+    assert rows.tolist() == [0, 2, 3, 5]
+    assert inverse.tolist() == [0, 0, 1, 2, 2, 3]
+    queries = [{"C1", "C2", "C6"}, {"C7", "C9"}]
+    background = {f"C{i}" for i in range(1, 21)}
+    _, in_set, _, pvals = functional_enrichment.multi_query_functional_enrichment(queries, annotation, background)
+    _, dedup_in_set, _, dedup_pvals = functional_enrichment.multi_query_functional_enrichment(queries, annotation.select(rows), background)
+    assert np.array_equal(dedup_in_set[inverse], in_set)
+    assert np.allclose(dedup_pvals[inverse], pvals)
+
+
+def test_cluster_categories():
+    annotation = AnnotationMatrix.from_dict(ANNOTATION).for_annotations(list(ANNOTATION))
+    # glycolysis shares 4 of 5 compounds with the KEGG maps
+    assert redundancy.cluster_categories(annotation, 0.8).tolist() == [0, 0, 0, 1, 1, 2]
+    # Identical sets always share a cluster
+    assert redundancy.cluster_categories(annotation, 1.0).tolist() == [0, 0, 1, 2, 2, 3]
@@ -0,0 +1,104 @@
+#! /usr/bin/env python3
+
+import asyncio
+import io
+import json
+import os
+import os.path
+import sqlite3
+import sys
+
+import pandas as pd
+
+main_path=os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, main_path)
+
+from mbrole import server
+
+
+def _annotation_db(path):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE mbrole (compound VARCHAR(20), annotation VARCHAR(50), database VARCHAR(20), url VARCHAR(100));")
+    rows = [(f"C{i}", f"cat{j}", "KEGG" if j % 2 else "CHEBI", "") for j in range(10) for i in range(j, 60, j + 1)]
+    conn.executemany("INSERT INTO mbrole VALUES (?, ?, ?, ?);", rows)
+    conn.commit()
+    conn.close()
+
+
+async def _post(socket_path, payload):
+    reader, writer = await asyncio.open_unix_connection(socket_path)
+    body = json.dumps(payload).encode("utf-8")
+    writer.write(b"POST /enrich HTTP/1.1\r\nConnection: close\r\n" + f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, content = response.partition(b"\r\n\r\n")
+    return int(head.split()[1]), content
+
+
+def test_server(tmp_path):
+    db_file = str(tmp_path / "annotation.db")
+    socket_path = str(tmp_path / "mbrole.sock")
+    _annotation_db(db_file)
+
+    async def run():
+        enrichment_server = server.EnrichmentServer([db_file], cache_size=1)
+        srv = await enrichment_server.start(socket_path=socket_path)
+        query = {"compounds": [f"C{i}" for i in range(0, 30, 2)], "all": True}
+        responses = await asyncio.gather(_post(socket_path, query),
+                                         _post(socket_path, query | {"database": ["KEGG"], "format": "json"}),
+                                         _post(socket_path, {"compounds": []}))
+        srv.close()
+        await srv.wait_closed()
+        return responses
+
+    (status_csv, csv), (status_json, records), (status_empty, _) = asyncio.run(run())
+    assert status_csv == 200 and status_json == 200 and status_empty == 400
+    df = pd.read_csv(io.BytesIO(csv))
+    assert len(df) == 10
+    assert list(df.columns) == ["name", "Compund-in-set", "Compound-in-annotation", "pval", "FDR"]
+    assert {x["name"] for x in json.loads(records)} == {f"cat{j}" for j in range(1, 10, 2)}
+
+
+def test_server_refuses_other_files_and_tables(tmp_path):
+    db_file = str(tmp_path / "annotation.db")
+    other_file = str(tmp_path / "other.db")
+    socket_path = str(tmp_path / "mbrole.sock")
+    _annotation_db(db_file)
+    _annotation_db(other_file)
+
+    async def run():
+        enrichment_server = server.EnrichmentServer([db_file])
+        srv = await enrichment_server.start(socket_path=socket_path)
+        query = {"compounds": ["C0", "C2"]}
+        responses = await asyncio.gather(_post(socket_path, query | {"db_file": other_file}),
+                                         _post(socket_path, query | {"db_file": "/etc/passwd"}),
+                                         _post(socket_path, query | {"table": "mbrole; DROP TABLE mbrole"}),
+                                         _post(socket_path, query | {"table": "sqlite_master"}),
+                                         _post(socket_path, query | {"db_file": os.path.relpath(db_file)}))
+        srv.close()
+        await srv.wait_closed()
+        return [status for status, _ in responses]
+
+    assert asyncio.run(run()) == [403, 403, 400, 403, 200]
+    try:
+        server.EnrichmentServer([db_file], "mbrole; --")
+        assert False
+    except ValueError:
+        pass
+
+
+def test_cache_drops_locks_of_evicted_entries(tmp_path):
+    db_files = [str(tmp_path / f"annotation{i}.db") for i in range(3)]
+    for db_file in db_files:
+        _annotation_db(db_file)
+
+    async def run():
+        cache = server.AnnotationCache(maxsize=1)
+        for db_file in db_files:
+            await cache.get(db_file, "mbrole")
+        return cache
+
+    cache = asyncio.run(run())
+    assert list(cache.entries) == [(db_files[-1], "mbrole")]
+    assert set(cache.locks) <= set(cache.entries)
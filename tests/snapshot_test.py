@@ -0,0 +1,119 @@
+#! /usr/bin/env python3
+
+import os
+import os.path
+import sqlite3
+import sys
+
+import pytest
+
+main_path=os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, main_path)
+
+from mbrole import snapshot
+from mbrole.incidence import AnnotationMatrix
+
+
+def _annotation_db(path):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE mbrole (compound VARCHAR(20), annotation VARCHAR(50), database VARCHAR(20), url VARCHAR(100));")
+    rows = [("A", "glycolysis", "KEGG", ""), ("B", "glycolysis", "KEGG", ""), ("C", "acid", "CHEBI", ""), ("D", "ácido", "CHEBI", "")]
+    conn.executemany("INSERT INTO mbrole VALUES (?, ?, ?, ?);", rows)
+    conn.commit()
+    return conn
+
+
+def test_snapshot_roundtrip(tmp_path):
+    db_file = str(tmp_path / "annotation.db")
+    conn = _annotation_db(db_file)
+    assert snapshot.load_snapshot(db_file, "mbrole") is None
+    snapshot.compile_snapshot(db_file, "mbrole")
+    loaded = snapshot.load_snapshot(db_file, "mbrole")
+    expected = AnnotationMatrix.from_db(conn, "mbrole")
+    assert list(loaded.names) == list(expected.names)
+    assert loaded.to_dict() == expected.to_dict()
+    assert list(loaded.for_databases(["CHEBI"]).names) == ["acid", "ácido"]
+
+    # Same content, newer mtime: still valid
+    os.utime(db_file)
+    assert snapshot.load_snapshot(db_file, "mbrole") is not None
+
+    conn.execute("INSERT INTO mbrole VALUES ('E', 'acid', 'CHEBI', '');")
+    conn.commit()
+    assert snapshot.load_snapshot(db_file, "mbrole") is None
+
+
+def test_snapshot_stale_sources(tmp_path):
+    from mbrole import database
+    db_file = str(tmp_path / "annotation.db")
+    conn = sqlite3.connect(db_file)
+    database.sync_source(conn, [("A", "glycolysis", "", "KEGG", ""), ("B", "glycolysis", "", "KEGG", ""), ("C", "acid", "", "CHEBI", "")])
+    snapshot.compile_snapshot(db_file, "mbrole")
+    database.sync_source(conn, [("D", "acid", "", "CHEBI", ""), ("C", "base", "", "CHEBI", "")], databases=["CHEBI"])
+    meta = snapshot._read_meta(snapshot.snapshot_path(db_file, "mbrole"))
+    assert snapshot.stale_sources(db_file, "mbrole", meta) == {"CHEBI"}
+    loaded = snapshot.load_snapshot(db_file, "mbrole")
+    assert loaded.to_dict() == AnnotationMatrix.from_db(conn, "mbrole").to_dict()
+    assert sorted(loaded.compounds) == ["A", "B", "C", "D"]
+    assert list(loaded.for_databases(["KEGG"]).names) == ["glycolysis"]
+
+
+def test_snapshot_survives_other_tables(tmp_path, caplog):
+    from mbrole import database
+    db_file = str(tmp_path / "annotation.db")
+    conn = sqlite3.connect(db_file)
+    database.sync_source(conn, [("A", "glycolysis", "", "KEGG", ""), ("B", "glycolysis", "", "KEGG", ""), ("C", "acid", "", "CHEBI", "")])
+    snapshot.compile_snapshot(db_file, "mbrole")
+    # Backgrounds and the id map change the file, not the annotation
+    database.store_background(conn, "hsa", ["A", "B", "C", "D"])
+    database.store_id_map(conn, [("chebi", "CHEBI:1", "C")], "test")
+    path = snapshot.snapshot_path(db_file, "mbrole")
+    assert snapshot.stale_sources(db_file, "mbrole", snapshot._read_meta(path)) == set()
+    # The fingerprint is refreshed, so later runs find the snapshot valid at once
+    meta = snapshot._read_meta(path)
+    assert meta["source"]["mtime_ns"] == os.stat(db_file).st_mtime_ns and meta["source"]["size"] == os.stat(db_file).st_size
+    assert snapshot.is_valid(db_file, meta)
+    with caplog.at_level("WARNING"):
+        loaded = snapshot.load_snapshot(db_file, "mbrole")
+    assert "outdated" not in caplog.text
+    assert loaded.to_dict() == AnnotationMatrix.from_db(conn, "mbrole").to_dict()
+
+
+def test_snapshot_strings_and_fingerprint(tmp_path, monkeypatch):
+    from mbrole import database
+    db_file = str(tmp_path / "annotation.db")
+    conn = sqlite3.connect(db_file)
+    database.sync_source(conn, [("A", "glycolysis", "", "KEGG", ""), ("Ñ", "ácido", "", "CHEBI", ""), ("", "empty", "", "CHEBI", "")])
+    snapshot.compile_snapshot(db_file, "mbrole")
+    assert "sha256" not in snapshot._read_meta(snapshot.snapshot_path(db_file, "mbrole"))["source"]
+    # Tables with generations never hash the file
+    monkeypatch.setattr(snapshot, "_file_hash", lambda *args: pytest.fail("hashed the database"))
+    os.utime(db_file)
+    loaded = snapshot.load_snapshot(db_file, "mbrole")
+    # Strings are read one by one, and decoded together only when needed
+    assert isinstance(loaded._compounds, snapshot.StringTable)
+    strings = [loaded._compounds[i] for i in range(len(loaded._compounds))]
+    assert sorted(strings) == ["", "A", "Ñ"]
+    assert list(loaded.compounds) == strings
+    assert loaded.compounds is loaded.compounds
+    assert loaded.to_dict() == AnnotationMatrix.from_db(conn, "mbrole").to_dict()
+    # An empty table
+    snapshot.StringTable.save(str(tmp_path), "strings", [])
+    assert len(snapshot.StringTable.load(str(tmp_path), "strings").decode()) == 0
+
+
+def test_snapshot_refresh_keeps_the_database_order(tmp_path):
+    from mbrole import database
+    db_file = str(tmp_path / "annotation.db")
+    conn = sqlite3.connect(db_file)
+    database.sync_source(conn, [("A", "acid", "", "KEGG", ""), ("B", "glycolysis", "", "KEGG", "")], databases=["KEGG"])
+    database.sync_source(conn, [("C", "acid", "", "CHEBI", ""), ("D", "base", "", "CHEBI", "")], databases=["CHEBI"])
+    snapshot.compile_snapshot(db_file, "mbrole")
+    # KEGG is reloaded from SQLite, but still comes first
+    database.sync_source(conn, [("A", "acid", "", "KEGG", ""), ("E", "acid", "", "KEGG", ""), ("B", "glycolysis", "", "KEGG", "")], databases=["KEGG"])
+    loaded = snapshot.load_snapshot(db_file, "mbrole")
+    expected = AnnotationMatrix.from_db(conn, "mbrole")
+    assert list(loaded.databases) == list(expected.databases) == ["KEGG", "CHEBI"]
+    merged = loaded.for_databases()
+    assert list(merged.names) == ["acid", "glycolysis", "base"]
+    assert merged.to_dict() == expected.for_databases().to_dict()
@@ -0,0 +1,42 @@
+#! /usr/bin/env python3
+
+import os
+import os.path
+import subprocess
+import sys
+
+main_path=os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, main_path)
+
+# Cumulative import time of mbrole.cli, in microseconds. Can be raised for slow machines
+IMPORT_BUDGET_US = int(os.environ.get("MBROLE_IMPORT_BUDGET_US", 500000))
+HEAVY_MODULES = ("numpy", "scipy", "pandas", "tqdm", "sqlite3")
+
+
+def _python(*args):
+    env = os.environ | {"PYTHONPATH": main_path}
+    return subprocess.run([sys.executable, *args], capture_output=True, text=True, env=env, cwd=main_path, check=True)
+
+
+def _import_time(module):
+    """
+        Cumulative import time of module, as reported by python -X importtime
+    """
+    stderr = _python("-X", "importtime", "-c", f"import {module}").stderr
+    for line in stderr.splitlines():
+        fields = [x.strip() for x in line.split("|")]
+        if len(fields) == 3 and fields[2] == module:
+            return int(fields[1])
+    raise AssertionError(f"{module} not found in the import times")
+
+
+def test_cli_imports_are_lazy():
+    loaded = _python("-c", f"import sys, mbrole.cli; print(*[x for x in {HEAVY_MODULES!r} if x in sys.modules])").stdout.split()
+    assert loaded == []
+    assert "usage" in _python("-m", "mbrole.cli", "--help").stdout
+
+
+def test_cli_import_time_budget():
+    # Best of a few runs, to leave out the noise of the machine
+    elapsed = min(_import_time("mbrole.cli") for _ in range(3))
+    assert elapsed < IMPORT_BUDGET_US, f"import mbrole.cli took {elapsed} us, budget is {IMPORT_BUDGET_US} us"
@@ -0,0 +1,115 @@
+#! /usr/bin/env python3
+
+import importlib.util
+import os
+import os.path
+import sqlite3
+import sys
+import zipfile
+
+main_path=os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, main_path)
+
+from mbrole import database
+
+
+def _script(name):
+    """
+        Loads a script of scripts/ as a module. It is registered in sys.modules, so worker processes find its functions
+    """
+    spec = importlib.util.spec_from_file_location(name.replace("-", "_"), os.path.join(main_path, "scripts", f"{name}.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+wikipathways = _script("wikipathways-to-sqlite")
+
+GPML_2013 = """<?xml version="1.0" encoding="UTF-8"?>
+<Pathway xmlns="http://pathvisio.org/GPML/2013a" Name="Glycolysis" Organism="Homo sapiens">
+  <DataNode TextLabel="Glucose" GraphId="a1" Type="Metabolite">
+    <Graphics CenterX="10" CenterY="10" Width="80" Height="20" />
+    <Xref Database="ChEBI" ID="CHEBI:4167" />
+  </DataNode>
+  <DataNode TextLabel="Pyruvate" GraphId="a2" Type="Metabolite">
+    <Xref Database="HMDB" ID="HMDB00243" />
+  </DataNode>
+  <DataNode TextLabel="Glucose again" GraphId="a3" Type="Metabolite">
+    <Xref Database="ChEBI" ID="4167" />
+  </DataNode>
+  <DataNode TextLabel="Lactate" GraphId="a4" Type="Metabolite">
+    <Xref Database="PubChem-compound" ID="612" />
+  </DataNode>
+  <DataNode TextLabel="HK1" GraphId="g1" Type="GeneProduct">
+    <Xref Database="Entrez Gene" ID="3098" />
+  </DataNode>
+</Pathway>
+"""
+
+GPML_2021 = """<?xml version="1.0" encoding="UTF-8"?>
+<Pathway xmlns="http://pathvisio.org/GPML/2021" title="Glycolysis" organism="Mus musculus">
+  <Xref identifier="WP157" dataSource="WikiPathways" />
+  <DataNodes>
+    <DataNode elementId="a1" textLabel="Glucose" type="Metabolite">
+      <Graphics centerX="10" centerY="10" width="80" height="20" />
+      <Xref identifier="C00031" dataSource="KEGG Compound" />
+    </DataNode>
+    <DataNode elementId="a2" textLabel="Pyruvate" type="Metabolite">
+      <Xref identifier="HMDB0000243" dataSource="HMDB" />
+    </DataNode>
+    <DataNode elementId="g1" textLabel="Hk1" type="GeneProduct">
+      <Xref identifier="15275" dataSource="Entrez Gene" />
+    </DataNode>
+  </DataNodes>
+</Pathway>
+"""
+
+
+def _gpml_files(folder):
+    folder.mkdir()
+    (folder / "Hs_Glycolysis_WP534_94259.gpml").write_text(GPML_2013)
+    (folder / "Mm_Glycolysis.gpml").write_text(GPML_2021)
+    return sorted(str(x) for x in folder.iterdir())
+
+
+def test_normalize_xref():
+    assert wikipathways.normalize_xref("ChEBI", "CHEBI:15422") == "CHEBI_15422"
+    assert wikipathways.normalize_xref("ChEBI", "15422") == "CHEBI_15422"
+    assert wikipathways.normalize_xref("HMDB", "HMDB00122") == "HMDB0000122"
+    assert wikipathways.normalize_xref("Human Metabolome Database", " HMDB0000122 ") == "HMDB0000122"
+    assert wikipathways.normalize_xref("KEGG Compound", "cpd:C00031") == "C00031"
+    assert wikipathways.normalize_xref("PubChem-compound", "5793") is None
+    assert wikipathways.normalize_xref("PubChem-compound", "5793", all_xrefs=True) == "PubChem-compound:5793"
+    assert wikipathways.normalize_xref("", "5793") is None
+    assert wikipathways.normalize_xref("ChEBI", None) is None
+
+
+def test_parse_gpml(tmp_path):
+    human, mouse = _gpml_files(tmp_path / "gpml")
+    url = "https://www.wikipathways.org/pathways/"
+    # GPML 2013: the ID comes from the file name. Repeated compounds are stored once
+    assert wikipathways.parse_gpml(human, "WikiPathways") == [("CHEBI_4167", "Glycolysis (WP534)", "pathway", "WikiPathways", url + "WP534"),
+                                                              ("HMDB0000243", "Glycolysis (WP534)", "pathway", "WikiPathways", url + "WP534")]
+    assert [x[0] for x in wikipathways.parse_gpml(human, "WikiPathways", all_xrefs=True)] == ["CHEBI_4167", "HMDB0000243", "PubChem-compound:612"]
+    assert [x[0] for x in wikipathways.parse_gpml(human, "WikiPathways", types=("GeneProduct",), all_xrefs=True)] == ["Entrez Gene:3098"]
+    # GPML 2021: the ID comes from the Xref of the pathway
+    assert wikipathways.parse_gpml(mouse, "WikiPathways") == [("C00031", "Glycolysis (WP157)", "pathway", "WikiPathways", url + "WP157"),
+                                                              ("HMDB0000243", "Glycolysis (WP157)", "pathway", "WikiPathways", url + "WP157")]
+    assert wikipathways.parse_gpml(mouse, "WikiPathways", organism="Homo sapiens") == []
+
+
+def test_pathways_with_the_same_title(tmp_path):
+    items = _gpml_files(tmp_path / "gpml")
+    archive = str(tmp_path / "wikipathways-gpml.zip")
+    with zipfile.ZipFile(archive, "w") as fhand:
+        for item in items:
+            fhand.write(item, os.path.basename(item))
+    zipped = wikipathways._input_files([archive])
+    assert zipped == [(archive, os.path.basename(x)) for x in items]
+    rows = [row for item in items for row in wikipathways.parse_gpml(item, "WikiPathways")]
+    assert list(wikipathways.parallel_rows(zipped, 2, "WikiPathways")) == rows
+    conn = sqlite3.connect(":memory:")
+    database.sync_source(conn, rows, databases=["WikiPathways"])
+    categories = dict(conn.execute("SELECT annotation, COUNT(*) FROM mbrole GROUP BY annotation;"))
+    assert categories == {"Glycolysis (WP534)": 2, "Glycolysis (WP157)": 2}